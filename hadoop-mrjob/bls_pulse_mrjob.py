@@ -1,24 +1,342 @@
 #!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+The cloud-kepler pipeline as a two-step mrjob job. The first step's mapper loads the
+requested lightcurves with :mod:`get_data` and its reducer joins the quarters of each
+target with :mod:`join_quarters`; the second step's reducer runs the BLS pulse search
+through :func:`drive_bls_pulse.run_bls` and writes the output in the format of
+``drive_bls_pulse.py``. All steps call the pipeline functions directly, and arrays are
+passed between steps with :class:`ArrayProtocol`.
+
+With ``--map-join``, the mappers also join the quarters of each target, and the job
+has a single step whose reducer runs the search; only one stitched record per target is
+shuffled instead of one record per quarter. All requests of a KIC ID must then be in
+the same input split, e.g., on adjacent lines of a small input file.
+
+With ``--block-segments N``, every target is cut into blocks of ``N`` segments (see
+:mod:`blocks`), the blocks are searched by separate reducers, and a last step merges
+the results of each target, so that long targets do not hold up a single reducer.
+
+With ``--balance-reducers N``, a first step estimates the cost of every target (see
+:mod:`cost`) and assigns the targets to ``N`` reducers, most expensive first, each to
+the least loaded reducer. The keys of the later steps are prefixed with a label that
+Hadoop's ``KeyFieldBasedPartitioner`` sends to the assigned reducer.
+
+The modules are imported from the ``python`` directory next to this one, which is put
+on the PYTHONPATH of every task; on Hadoop it must be on a filesystem shared by the
+nodes. Run it with, e.g.::
+
+    ./bls_pulse_mrjob.py -r local input.txt --source disk --datapath /path/to/data \
+        --bls-config ../python/sandbox/eprice/pulse.conf
+
+Paths given to ``--datapath`` and ``--cache-dir`` must be absolute.
+'''
+
+import os
+import sys
+
+# Root of the pipeline modules, if this script is run from a checkout.
+PYTHON_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir, 'python'))
+if os.path.isdir(PYTHON_DIR):
+    sys.path.insert(0, PYTHON_DIR)
+
+import numpy as np
 from mrjob.job import MRJob
-import mrjob.protocol
-import re
+from mrjob.step import MRStep
+from mrjob.conf import combine_dicts
+from mrjob.protocol import RawValueProtocol
+from utils import CODEC_MAGIC, encode_array, decode_array
+from get_data import get_loader, read_input, sort_requests
+from join_quarters import group_quarters, join_targets
+from blocks import result_keys, split_target, search_blocks, merge_blocks
+from local_runner import group_requests
+from sharding import assign_by_cost
+from cost import PARTITIONER, PARTITIONER_JOBCONF, partition_labels, target_cost
+from drive_bls_pulse import DEFAULTS, read_options, run_bls, format_output
+
+
+class ArrayProtocol(object):
+    '''
+    Internal protocol for values that are tuples of strings and NumPy arrays. A record is
+    the key and the fields of the value separated by tabs, with every array encoded by
+    :func:`utils.encode_array`, which keeps its type and is several times more compact
+    and faster than JSON. Arrays are decoded as writable arrays. String fields must not
+    contain tabs or newlines, or start with the codec marker.
+    '''
+
+    def read(self, line):
+        parts = line.split('\t')
+        return parts[0], tuple([decode_array(p, writable=True) if
+            p.startswith(CODEC_MAGIC) else p for p in parts[1:]])
+
+
+    def write(self, key, value):
+        return '\t'.join([key] + [encode_array(v) if isinstance(v, np.ndarray) else v
+            for v in value])
 
-FOLDER = "/oasis/scratch/zonca/temp_project/MAST/cloud-kepler/python/"
 
 class BLSPulse(MRJob):
-    """For testing purposes I am using the python scripts as bash scripts,
-using mrjob only for setting up Hadoop"""
+    '''
+    Runs the pipeline on the requests of KIC ID, quarter and cadence in the input, one
+    request per line.
+    '''
+
+    INPUT_PROTOCOL = RawValueProtocol
+    INTERNAL_PROTOCOL = ArrayProtocol
+    OUTPUT_PROTOCOL = RawValueProtocol
+
+    def configure_options(self):
+        super(BLSPulse, self).configure_options()
+
+        self.add_passthrough_option('--source', choices=['mast', 'disk', 'archive'],
+            default='mast', help='Source where Kepler FITS files should be retrieved.')
+        self.add_passthrough_option('--datapath', default=os.curdir, help='Absolute '
+            '(root) path to the Kepler lightcurve data for the disk source, or the '
+            'archive directory for the archive source.')
+        self.add_passthrough_option('--threads', type='int', dest='nthreads', default=4,
+            help='Number of concurrent downloads from MAST per mapper.')
+        self.add_passthrough_option('--cache-dir', dest='cachedir', default=None,
+            help='Directory in which to cache files downloaded from MAST.')
+        self.add_passthrough_option('--map-join', action='store_true', dest='map_join',
+            default=False, help='Join the quarters of each target in the mappers, and '
+            'skip the join step.')
+        self.add_passthrough_option('--block-segments', type='int',
+            dest='block_segments', default=None, help='Search every target in blocks of '
+            'this many segments, and merge the results in a last step.')
+        self.add_passthrough_option('--balance-reducers', type='int', dest='nreducers',
+            default=None, help='Balance the estimated cost of the targets over this many '
+            'reducers.')
+
+        # The search options of drive_bls_pulse.py; -c is taken by mrjob.
+        self.add_file_option('--bls-config', dest='config', default=None,
+            help='BLS configuration file. Configuration supersedes the options below.')
+        self.add_passthrough_option('--segment', type='float', dest='segment',
+            help='Trial segment (days).')
+        self.add_passthrough_option('--mindur', type='float', dest='mindur',
+            default=float(DEFAULTS['min_duration']), help='Minimum transit duration '
+            'to search for (days).')
+        self.add_passthrough_option('--maxdur', type='float', dest='maxdur',
+            default=float(DEFAULTS['max_duration']), help='Maximum transit duration '
+            'to search for (days).')
+        self.add_passthrough_option('--nbins', type='int', dest='nbins',
+            default=int(DEFAULTS['n_bins']), help='Number of bins to divide the '
+            'lightcurve into.')
+        self.add_passthrough_option('--direction', type='int', dest='direction',
+            default=int(DEFAULTS['direction']), help='Direction of box wave to look '
+            'for. 1 = blip (top-hat), -1 = dip (drop), 0 = most significant, 2 = both.')
+        self.add_passthrough_option('--mode', dest='mode', default='cython',
+            help='Implementation to use; python, vec, or cython.')
+        self.add_passthrough_option('--printformat', dest='fmt', default='encoded',
+            help='Format of the output; encoded or normal.')
+        self.add_passthrough_option('--search-threads', type='int', dest='search_threads',
+            default=int(DEFAULTS['threads']), help='Number of threads to search the '
+            'segments of a lightcurve on.')
+        self.add_passthrough_option('--kernel', dest='kernel', default=DEFAULTS['kernel'],
+            help='Search kernel; exhaustive, sliding or pruned.')
+        self.add_passthrough_option('--bls-profile', action='store_true', dest='profile',
+            default=False, help='Turn on speed profiling of the search.')
+
+
+    def load_options(self, args):
+        super(BLSPulse, self).load_options(args)
+
+        # Tasks run in their own working directories and get the options as given.
+        if self.options.source != 'mast' and not os.path.isabs(self.options.datapath):
+            self.option_parser.error('--datapath must be an absolute path.')
+        if self.options.cachedir is not None and not os.path.isabs(self.options.cachedir):
+            self.option_parser.error('--cache-dir must be an absolute path.')
+        if self.options.nreducers is not None and self.options.block_segments is not None:
+            self.option_parser.error('--balance-reducers cannot be used with '
+                '--block-segments.')
+
+        self.bls_options = read_options(self.option_parser, self.options, DEFAULTS)
+
+
+    def job_runner_kwargs(self):
+        kwargs = super(BLSPulse, self).job_runner_kwargs()
+
+        if os.path.isdir(PYTHON_DIR):
+            pythonpath = os.pathsep.join([PYTHON_DIR] +
+                filter(None, [os.environ.get('PYTHONPATH')]))
+            kwargs['cmdenv'] = combine_dicts(dict(PYTHONPATH=pythonpath),
+                kwargs.get('cmdenv'))
+
+        return kwargs
+
+
+    def partitioner(self):
+        if self.options.nreducers is not None:
+            return PARTITIONER
+
+        return super(BLSPulse, self).partitioner()
+
+
+    def jobconf(self):
+        conf = super(BLSPulse, self).jobconf()
+
+        if self.options.nreducers is not None:
+            conf = combine_dicts(conf, PARTITIONER_JOBCONF,
+                {'mapreduce.job.reduces':str(self.options.nreducers)})
+
+        return conf
 
-    INPUT_PROTOCOL = mrjob.protocol.RawValueProtocol
-    INTERNAL_PROTOCOL = mrjob.protocol.RawValueProtocol
-    OUTPUT_PROTOCOL = mrjob.protocol.RawValueProtocol
 
     def steps(self):
-        return [
-            self.mr(mapper_cmd=FOLDER + "download.py",
-                    reducer_cmd=FOLDER + "join_quarters.py"),
-            self.mr(reducer_cmd=FOLDER + "bls_pulse_vec_interface.py --mindur .01 --maxdur 2.0 --nbins 100 --segment 2.5 --direction -1 --printformat 'normal'")
-        ]
+        if self.options.block_segments is None:
+            search = [self.bls_reducer]
+        else:
+            search = [self.block_reducer, self.merge_reducer]
+
+        if self.options.nreducers is None:
+            steps = []
+            mapper = self.load_mapper
+        else:
+            # Plan the reducer of every target in a single reducer.
+            steps = [MRStep(mapper=self.plan_mapper, reducer=self.plan_reducer,
+                jobconf={'mapreduce.job.reduces':'1'})]
+            mapper = self.labelled_mapper
+
+        if self.options.map_join:
+            steps.append(MRStep(mapper_init=self.load_init, mapper=mapper,
+                mapper_final=self.join_final, reducer=search.pop(0)))
+        else:
+            steps.append(MRStep(mapper_init=self.load_init, mapper=mapper,
+                mapper_final=self.load_final, reducer=self.join_reducer))
+
+        return steps + [MRStep(reducer=reducer) for reducer in search]
+
+
+    def plan_mapper(self, _, line):
+        for request in read_input([line]):
+            yield 'plan', tuple(request)
+
+
+    def plan_reducer(self, _, values):
+        tasks = group_requests([list(v) for v in values])
+        costs = dict([(kepler_id + '_' + suffix, target_cost(task, self.bls_options))
+            for task in tasks for kepler_id, _, suffix in task[:1]])
+
+        labels = partition_labels(self.options.nreducers)
+        assignment = assign_by_cost(costs, self.options.nreducers)
+
+        for task in tasks:
+            for kepler_id, quarter, suffix in task:
+                yield labels[assignment[kepler_id + '_' + suffix]], (kepler_id, quarter,
+                    suffix)
+
+
+    def load_init(self):
+        self.requests = []
+        self.labels = {}
+
+
+    def load_mapper(self, _, line):
+        # Collect the requests, so that the loader can work on all of them at once.
+        self.requests.extend(read_input([line]))
+
+
+    def labelled_mapper(self, label, request):
+        kepler_id, _, suffix = request
+        self.requests.append(list(request))
+        self.labels[kepler_id + '_' + suffix] = label
+
+
+    def _key(self, k):
+        # Prefix the key with the label of the target's reducer, if any.
+        return self.labels[k] + '/' + k if k in self.labels else k
+
+
+    def _get_loader(self, data):
+        cache = None
+        if self.options.source == 'mast' and self.options.cachedir is not None:
+            from fits_cache import FITSCache
+            cache = FITSCache(self.options.cachedir)
+
+        return get_loader(self.options.source, data, self.options.datapath, cache=cache,
+            nthreads=self.options.nthreads)
+
+
+    def load_final(self):
+        for key, quarter, uri, time, flux, fluxerr in self._get_loader(self.requests):
+            yield self._key(key), (quarter, uri, time, flux, fluxerr)
+
+
+    def _emit_targets(self, targets):
+        block_segments = self.options.block_segments
+
+        for k, quarters, time, flux, fluxerr in targets:
+            if block_segments is None:
+                yield self._key(k), (quarters, time, flux, fluxerr)
+                continue
+
+            for _, i, _, epoch, first, count, nsegments, btime, bflux, bfluxerr in \
+            split_target(k, quarters, time, flux, fluxerr, self.bls_options['segment'],
+            block_segments):
+                yield '%s/%05d' % (k, i), (quarters, repr(epoch), str(first), str(count),
+                    str(nsegments), btime, bflux, bfluxerr)
+
+
+    def join_final(self):
+        loader = self._get_loader(sort_requests(self.requests))
+
+        for item in self._emit_targets(join_targets(group_quarters(loader))):
+            yield item
+
+
+    def join_reducer(self, key, values):
+        # Hadoop does not sort the values; order the quarters as the sort step of the
+        # shell pipeline does.
+        label, _, k = key.rpartition('/')
+        self.labels = {k:label} if label else {}
+
+        records = [(k, q, time, flux, fluxerr) for q, _, time, flux, fluxerr in
+            sorted(values, key=lambda v: (v[0], v[1]))]
+
+        for item in self._emit_targets(join_targets(records)):
+            yield item
+
+
+    def bls_reducer(self, key, values):
+        options = self.bls_options
+        key = key.rpartition('/')[2]
+
+        for quarters, time, flux, fluxerr in values:
+            out = run_bls(time, flux, fluxerr, options)
+            text = format_output(key, quarters, out, options['direction'], options['fmt'])
+
+            if text is not None:
+                yield None, text
+
+
+    def block_reducer(self, key, values):
+        k, i = key.rsplit('/', 1)
+        names = result_keys(self.bls_options['direction'])
+
+        blocks = [(k, int(i), q, float(epoch), int(first), int(count), int(nsegments), time,
+            flux, fluxerr) for q, epoch, first, count, nsegments, time, flux, fluxerr in
+            values]
+
+        for _, _, q, epoch, first, nsegments, out in search_blocks(blocks,
+        self.bls_options):
+            yield k, (i, q, repr(epoch), str(first), str(nsegments)) + \
+                tuple([out[name] for name in names])
+
+
+    def merge_reducer(self, key, values):
+        options = self.bls_options
+        names = result_keys(options['direction'])
+
+        results = [(key, int(v[0]), v[1], float(v[2]), int(v[3]), int(v[4]),
+            dict(zip(names, v[5:]))) for v in values]
+
+        for k, q, out in merge_blocks(results, options['segment'], options['direction']):
+            text = format_output(k, q, out, options['direction'], options['fmt'])
+
+            if text is not None:
+                yield None, text
+
 
 if __name__ == '__main__':
     BLSPulse.run()
@@ -12,6 +12,8 @@ echo "Running our mrjob Python script"
     -r hadoop \
     hdfs:///user/$USER/mrjob-input/$input_filename \
     --jobconf mapred.reduce.tasks=2 \
+    --source mast --cache-dir $PWD/fits-cache \
+    --bls-config $PWD/../python/sandbox/eprice/pulse.conf \
     --output-dir hdfs:///user/$USER/mrjob-output
 
 echo "Copying the the results back to the local filesystem"
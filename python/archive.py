@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Consolidated lightcurve archive. A tree of Kepler FITS files is packed once into a
+single data file plus a small index, so that re-ingesting the data costs sequential
+reads instead of hundreds of thousands of file opens.
+
+The archive is a directory with two files:
+
+* ``data.bin`` holds, for every lightcurve, the time, flux and flux error columns in
+  chunks of a fixed number of cadences; each column of each chunk is zlib-compressed
+  separately. After the chunks of a target comes a JSON block describing that target's
+  lightcurves (KIC, quarter, cadence, dtypes) and, for every chunk, its offset, the
+  compressed sizes of its columns, its row count, and its time range.
+* ``index.json`` maps each KIC ID to the offset and size of its JSON block.
+
+Looking up a target therefore takes one dictionary lookup and one read, and a time
+window of a lightcurve is read by decompressing only the chunks that overlap it.
+'''
+
+import os
+import json
+import zlib
+import logging
+import itertools
+import numpy as np
+from multiprocessing import Pool
+from argparse import ArgumentParser
+from utils import ordered_map
+from kepler_fits import read_lightcurve_file
+from manifest import find_fits_files
+
+# Basic logging configuration.
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+ARCHIVE_VERSION = 1
+DATA_FILE = 'data.bin'
+INDEX_FILE = 'index.json'
+
+# Default number of cadences per chunk; about one month of long-cadence data.
+DEFAULT_CHUNK_SIZE = 1024
+
+
+class ArchiveWriter(object):
+    '''
+    Writes a new archive. Lightcurves must be added grouped by KIC ID.
+    '''
+
+    def __init__(self, path, chunk_size=DEFAULT_CHUNK_SIZE):
+        '''
+        :param path: Archive directory; created if necessary
+        :type path: str
+        :param chunk_size: Number of cadences per chunk
+        :type chunk_size: int
+        '''
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        self.path = path
+        self.chunk_size = chunk_size
+        self.index = {}
+
+        self.__data = open(os.path.join(path, DATA_FILE), 'wb')
+        self.__kic = None
+        self.__entries = []
+
+
+    def add(self, kepler_id, quarter, cadence, time, flux, fluxerr, source=''):
+        '''
+        Appends one lightcurve to the archive.
+
+        :param kepler_id: Zero-padded KIC ID
+        :type kepler_id: str
+        :param quarter: Quarter number
+        :type quarter: int
+        :param cadence: Cadence identifier, ``llc`` or ``slc``
+        :type cadence: str
+        :param time: Array of times
+        :type time: numpy.ndarray
+        :param flux: Array of fluxes
+        :type flux: numpy.ndarray
+        :param fluxerr: Array of flux errors
+        :type fluxerr: numpy.ndarray
+        :param source: Name of the file the lightcurve was read from
+        :type source: str
+        '''
+        if kepler_id != self.__kic:
+            self.__flush_target()
+            self.__kic = kepler_id
+
+            if kepler_id in self.index:
+                raise ValueError('Lightcurves of %s are not grouped together' % kepler_id)
+
+        columns = [_little_endian(c) for c in [time, flux, fluxerr]]
+        chunks = []
+
+        for start in xrange(0, len(time), self.chunk_size):
+            blocks = [zlib.compress(c[start:start+self.chunk_size].tostring(), 1)
+                for c in columns]
+            t = columns[0][start:start+self.chunk_size]
+            finite = t[np.isfinite(t)]
+            tmin, tmax = (float(finite.min()), float(finite.max())) if len(finite) else \
+                (None, None)
+
+            chunks.append([self.__data.tell(), [len(b) for b in blocks], len(t), tmin, tmax])
+
+            for b in blocks:
+                self.__data.write(b)
+
+        self.__entries.append(dict(quarter=int(quarter), cadence=cadence, source=source,
+            nrows=len(time), dtypes=[c.dtype.str for c in columns], chunks=chunks))
+
+
+    def close(self):
+        '''
+        Writes the remaining target block and the index, and closes the archive.
+        '''
+        self.__flush_target()
+        self.__data.close()
+
+        tmppath = os.path.join(self.path, INDEX_FILE + '.tmp')
+        with open(tmppath, 'w') as f:
+            json.dump(dict(version=ARCHIVE_VERSION, targets=self.index), f)
+        os.rename(tmppath, os.path.join(self.path, INDEX_FILE))
+
+
+    def __flush_target(self):
+        if self.__kic is None:
+            return
+
+        block = json.dumps(self.__entries)
+        self.index[self.__kic] = [self.__data.tell(), len(block)]
+        self.__data.write(block)
+
+        self.__kic = None
+        self.__entries = []
+
+
+class ArchiveReader(object):
+    '''
+    Reads lightcurves from an archive written by :class:`ArchiveWriter`.
+    '''
+
+    def __init__(self, path):
+        '''
+        :param path: Archive directory
+        :type path: str
+        '''
+        with open(os.path.join(path, INDEX_FILE), 'r') as f:
+            index = json.load(f)
+
+        if index['version'] != ARCHIVE_VERSION:
+            raise ValueError('Unsupported archive version: %s' % index['version'])
+
+        self.index = index['targets']
+        self.__data = open(os.path.join(path, DATA_FILE), 'rb')
+
+
+    def entries(self, kepler_id):
+        '''
+        Returns the descriptions of all lightcurves of the given target, or an empty list
+        if the target is not in the archive.
+
+        :param kepler_id: Zero-padded KIC ID
+        :type kepler_id: str
+
+        :rtype: list
+        '''
+        if kepler_id not in self.index:
+            return []
+
+        offset, size = self.index[kepler_id]
+        self.__data.seek(offset)
+        return json.loads(self.__data.read(size))
+
+
+    def read(self, entry, tmin=None, tmax=None):
+        '''
+        Reads the lightcurve described by ``entry`` (as returned by :meth:`entries`).
+        If ``tmin`` or ``tmax`` is given, only the cadences in that time window are
+        returned, and only the chunks overlapping it are read.
+
+        :param entry: Lightcurve description
+        :type entry: dict
+        :param tmin: Start of the time window (RBJD)
+        :type tmin: float
+        :param tmax: End of the time window (RBJD)
+        :type tmax: float
+
+        :rtype: tuple
+        '''
+        dtypes = [np.dtype(d) for d in entry['dtypes']]
+        windowed = tmin is not None or tmax is not None
+        parts = [[], [], []]
+
+        for offset, sizes, nrows, cmin, cmax in entry['chunks']:
+            if windowed and (cmin is None or (tmin is not None and cmax < tmin) or
+            (tmax is not None and cmin > tmax)):
+                continue
+
+            self.__data.seek(offset)
+
+            for i, size in enumerate(sizes):
+                parts[i].append(np.frombuffer(zlib.decompress(self.__data.read(size)),
+                    dtype=dtypes[i]))
+
+        columns = [np.concatenate(p) if len(p) else np.empty((0,), dtype=d)
+            for p, d in zip(parts, dtypes)]
+
+        if windowed:
+            t = columns[0]
+            mask = np.isfinite(t)
+            if tmin is not None:
+                mask &= (t >= tmin)
+            if tmax is not None:
+                mask &= (t <= tmax)
+            columns = [c[mask] for c in columns]
+
+        return tuple([np.require(c, dtype=c.dtype.newbyteorder('='), requirements='C')
+            for c in columns])
+
+
+    def close(self):
+        self.__data.close()
+
+
+def _little_endian(arr):
+    arr = np.asarray(arr)
+    return np.ascontiguousarray(arr, dtype=arr.dtype.newbyteorder('<'))
+
+
+def build_archive(datapath, archivepath, chunk_size=DEFAULT_CHUNK_SIZE, nworkers=1):
+    '''
+    Packs every Kepler FITS file under ``datapath``, laid out as
+    ``<root>/<nnnn>/<kic>/kplr<kic>-<timestamp>_<cadence>.fits``, into a new archive.
+    The quarter of each file is read from its primary header.
+
+    :param datapath: Root of the FITS tree
+    :type datapath: str
+    :param archivepath: Archive directory to write
+    :type archivepath: str
+    :param chunk_size: Number of cadences per chunk
+    :type chunk_size: int
+    :param nworkers: Number of worker processes reading FITS files
+    :type nworkers: int
+
+    :rtype: int
+    '''
+    writer = ArchiveWriter(archivepath, chunk_size)
+    jobs = ((kepler_id, cadence, path) for kepler_id, _, cadence, path in
+        find_fits_files(datapath))
+
+    if nworkers > 1:
+        pool = Pool(nworkers)
+        results = ordered_map(pool, _read_archive_job, jobs, 4 * nworkers)
+    else:
+        pool = None
+        results = itertools.imap(_read_archive_job, jobs)
+
+    n = 0
+
+    try:
+        for kepler_id, cadence, name, out in results:
+            if out is None:
+                continue
+
+            time, flux, fluxerr, meta = out
+            writer.add(kepler_id, meta['QUARTER'], cadence, time, flux, fluxerr,
+                source=name)
+            n += 1
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+        writer.close()
+
+    return n
+
+
+def _read_archive_job(job):
+    '''
+    Reads one FITS file for the archive converter. Returns None in place of the data if
+    the file cannot be read or has no quarter in its primary header.
+    '''
+    kepler_id, cadence, path = job
+
+    try:
+        out = read_lightcurve_file(path, keywords=['QUARTER'])
+    except RuntimeError:
+        logging.error('Cannot read: ' + path)
+        return kepler_id, cadence, os.path.basename(path), None
+
+    try:
+        int(out[3]['QUARTER'])
+    except (TypeError, ValueError):
+        logging.error('No quarter in: ' + path)
+        out = None
+
+    return kepler_id, cadence, os.path.basename(path), out
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Pack a tree of Kepler FITS files into a '
+        'lightcurve archive that get_data.py can read with the "archive" source.')
+    parser.add_argument('datapath', action='store', help='(Root) path to the Kepler '
+        'lightcurve data, such that root is the path part <root>/<nnnn>/<nnnnnnnnn>/.')
+    parser.add_argument('archivepath', action='store', help='Archive directory to write.')
+    parser.add_argument('--chunk-size', action='store', type=int, dest='chunk_size',
+        default=DEFAULT_CHUNK_SIZE, help='[Optional] Number of cadences per chunk.')
+    parser.add_argument('--workers', action='store', type=int, dest='nworkers', default=1,
+        help='[Optional] Number of worker processes reading FITS files.')
+    args = parser.parse_args()
+
+    build_archive(args.datapath, args.archivepath, args.chunk_size, args.nworkers)
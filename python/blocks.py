@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Splitting of long lightcurves into blocks of whole segments. The BLS pulse search is
+independent per segment, so a long lightcurve, e.g., several quarters of short-cadence
+data, can be cut into blocks that are searched as separate work units and merged
+afterwards, instead of holding up a single reducer. All blocks of a target keep the
+segment grid of the whole lightcurve: segments start at the same epoch, the first
+time of the target, and each block is searched with the global indices of its segments
+(see :func:`bls_pulse_cython.bls_pulse`). The merged output is therefore identical to
+that of an unsplit search. Blocks without data are not emitted; their segments are
+filled in by the merge as empty segments.
+
+The module runs as one of three Hadoop streaming stages, selected by the first
+argument, each taking the options of :mod:`drive_bls_pulse`::
+
+    python join_quarters.py | python blocks.py split -c config.conf | sort \\
+        | python blocks.py search -c config.conf | sort \\
+        | python blocks.py merge -c config.conf
+
+* ``split`` reads joined targets and writes blocks keyed by KIC ID and block index;
+* ``search`` runs the search on every block;
+* ``merge`` reads the block results sorted by KIC ID and writes the output of
+  :mod:`drive_bls_pulse`.
+'''
+
+import sys
+import logging
+import numpy as np
+from itertools import groupby
+from operator import itemgetter
+from argparse import ArgumentParser
+from utils import read_mapper_output, encode_array, decode_array
+from drive_bls_pulse import DEFAULTS, init_parser, read_options, run_bls, format_output
+
+# Basic logging configuration.
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Default number of segments per block.
+DEFAULT_BLOCK_SEGMENTS = 64
+
+
+def result_keys(direction):
+    '''
+    Returns the names of the per-segment output arrays of a search in the given
+    direction, in the order they are written.
+
+    :param direction: Signal direction of the search
+    :type direction: int
+
+    :rtype: list
+    '''
+    if direction == 2:
+        names = ['srsq_dip', 'duration_dip', 'depth_dip', 'midtime_dip', 'srsq_blip',
+            'duration_blip', 'depth_blip', 'midtime_blip']
+    else:
+        names = ['srsq', 'duration', 'depth', 'midtime']
+
+    return ['segstart', 'segend'] + names
+
+
+def split_target(k, q, time, flux, fluxerr, segsize, block_segments):
+    '''
+    Cuts a joined target into blocks of ``block_segments`` whole segments and yields
+    them as tuples of KIC ID, block index, quarters, epoch, index of the first segment,
+    number of segments in the block, number of segments of the target, and the time,
+    flux, and flux error arrays of the block. Blocks without data are skipped. The time
+    array must be sorted, as produced by :func:`join_quarters.stitch_quarters`.
+
+    :param k: KIC ID
+    :type k: str
+    :param q: Quarters, as listed by the join step
+    :type q: str
+    :param time: Array of times
+    :type time: numpy.ndarray
+    :param flux: Array of fluxes
+    :type flux: numpy.ndarray
+    :param fluxerr: Array of flux errors
+    :type fluxerr: numpy.ndarray
+    :param segsize: Trial segment (days)
+    :type segsize: float
+    :param block_segments: Number of segments per block
+    :type block_segments: int
+
+    :rtype: generator
+    '''
+    if len(time) == 0:
+        return
+
+    # The segment grid of an unsplit search.
+    epoch = np.nanmin(time)
+    offset = time - epoch
+    nsegments = int(np.floor(np.nanmax(offset) / segsize) + 1)
+
+    # The search ends a segment at the first time at or after the end of the segment,
+    # computed as start + segsize; cut the blocks at the same times.
+    bounds = [0.] + [float(n - 1) * segsize + segsize for n in xrange(block_segments,
+        nsegments, block_segments)]
+    cuts = np.searchsorted(offset, bounds).tolist() + [len(time)]
+
+    for i in xrange(len(bounds)):
+        begin, end = cuts[i], cuts[i+1]
+        if begin == end:
+            continue
+
+        first = i * block_segments
+        yield k, i, q, epoch, first, min(block_segments, nsegments - first), nsegments, \
+            time[begin:end].copy(), flux[begin:end].copy(), fluxerr[begin:end].copy()
+
+
+def search_blocks(blocks, options):
+    '''
+    Runs the BLS pulse search on every block and yields tuples of KIC ID, block index,
+    quarters, epoch, index of the first segment, number of segments of the target, and
+    the search output of the block.
+
+    :param blocks: Blocks, as yielded by :func:`split_target`
+    :type blocks: iterable
+    :param options: Search options, as returned by :func:`drive_bls_pulse.read_options`
+    :type options: dict
+
+    :rtype: generator
+    '''
+    for k, i, q, epoch, first, count, nsegments, time, flux, fluxerr in blocks:
+        out = run_bls(time, flux, fluxerr, options, epoch=epoch, first_segment=first,
+            segment_count=count)
+        yield k, i, q, epoch, first, nsegments, out
+
+
+def merge_blocks(results, segsize, direction):
+    '''
+    Merges the block results of each target into the output of a search of the whole
+    target, and yields the KIC ID, the quarters, and the search output. The results
+    must be grouped by KIC ID, in any order within a target. Segments of blocks that
+    are missing are filled in as segments without data.
+
+    :param results: Block results, as yielded by :func:`search_blocks`
+    :type results: iterable
+    :param segsize: Trial segment (days)
+    :type segsize: float
+    :param direction: Signal direction the search was run with
+    :type direction: int
+
+    :rtype: generator
+    '''
+    names = result_keys(direction)
+
+    for k, group in groupby(results, itemgetter(0)):
+        group = sorted(group, key=itemgetter(1))
+        _, _, q, epoch, _, nsegments, _ = group[0]
+
+        merged = dict([(name, np.empty((nsegments,), dtype='float64')) for name in names])
+        covered = np.zeros((nsegments,), dtype=bool)
+
+        for _, _, _, _, first, _, out in group:
+            count = len(out['segstart'])
+            for name in names:
+                merged[name][first:first+count] = out[name]
+            covered[first:first+count] = True
+
+        # Segments without data, as the search reports them.
+        for n in np.where(~covered)[0]:
+            start = float(n) * segsize
+            merged['segstart'][n] = start + epoch
+            merged['segend'][n] = (start + segsize) + epoch
+            for name in names[2:]:
+                merged[name][n] = 0. if name.startswith('srsq') else np.nan
+
+        yield k, q, merged
+
+
+def format_block(block):
+    '''
+    Formats one block as a line of output of the split stage.
+
+    :param block: Block, as yielded by :func:`split_target`
+    :type block: tuple
+
+    :rtype: str
+    '''
+    k, i, q, epoch, first, count, nsegments, time, flux, fluxerr = block
+    return '\t'.join([k, "%05d" % i, q, repr(epoch), str(first), str(count),
+        str(nsegments), encode_array(time), encode_array(flux), encode_array(fluxerr)])
+
+
+def read_blocks(f):
+    '''
+    Reads the lines written by the split stage and yields the blocks. The arrays are
+    writable.
+
+    :param f: File to read; usually stdin
+    :type f: file
+
+    :rtype: generator
+    '''
+    for line in f:
+        k, i, q, epoch, first, count, nsegments, time, flux, fluxerr = \
+            line.rstrip('\n').split('\t')
+        yield k, int(i), q, float(epoch), int(first), int(count), int(nsegments), \
+            decode_array(time, writable=True), decode_array(flux, writable=True), \
+            decode_array(fluxerr, writable=True)
+
+
+def format_result(result, direction):
+    '''
+    Formats the search output of one block as a line of output of the search stage.
+
+    :param result: Block result, as yielded by :func:`search_blocks`
+    :type result: tuple
+    :param direction: Signal direction the search was run with
+    :type direction: int
+
+    :rtype: str
+    '''
+    k, i, q, epoch, first, nsegments, out = result
+    return '\t'.join([k, "%05d" % i, q, repr(epoch), str(first), str(nsegments)] +
+        [encode_array(out[name]) for name in result_keys(direction)])
+
+
+def read_results(f, direction):
+    '''
+    Reads the lines written by the search stage and yields the block results.
+
+    :param f: File to read; usually stdin
+    :type f: file
+    :param direction: Signal direction the search was run with
+    :type direction: int
+
+    :rtype: generator
+    '''
+    names = result_keys(direction)
+
+    for line in f:
+        parts = line.rstrip('\n').split('\t')
+        k, i, q, epoch, first, nsegments = parts[:6]
+        out = dict(zip(names, [decode_array(p) for p in parts[6:]]))
+        yield k, int(i), q, float(epoch), int(first), int(nsegments), out
+
+
+def main():
+    '''
+    Main function for this module. Runs the stage given on the command line on the
+    lines from STDIN.
+    '''
+    parser = ArgumentParser(description="Split long lightcurves into blocks of whole "
+        "segments, search the blocks, and merge the block results.")
+    parser.add_argument('stage', action='store', choices=['split', 'search', 'merge'],
+        help='Stage to run.')
+    init_parser(DEFAULTS, parser)
+    parser.add_argument('--block-segments', action='store', type=int,
+        dest='block_segments', default=DEFAULT_BLOCK_SEGMENTS, help='[Optional] Number '
+        'of segments per block.')
+    args = parser.parse_args()
+    options = read_options(parser, args, DEFAULTS)
+
+    if args.stage == 'split':
+        for k, q, time, flux, fluxerr in read_mapper_output(sys.stdin):
+            for block in split_target(k, q, time, flux, fluxerr, options['segment'],
+            args.block_segments):
+                print format_block(block)
+    elif args.stage == 'search':
+        for result in search_blocks(read_blocks(sys.stdin), options):
+            print format_result(result, options['direction'])
+    else:
+        results = read_results(sys.stdin, options['direction'])
+        for k, q, out in merge_blocks(results, options['segment'], options['direction']):
+            text = format_output(k, q, out, options['direction'], options['fmt'])
+            if text is not None:
+                print text
+
+
+if __name__ == '__main__':
+    main()
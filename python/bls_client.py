@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Client of the BLS worker daemon (see :mod:`bls_daemon`), and a drop-in replacement for
+``drive_bls_pulse.py``: it takes the same options and reads and writes the same data.
+The client itself only imports the standard library. It forwards its arguments,
+working directory and STDIN to the daemon over a Unix socket, and copies the output and
+error streams and the exit status of the run back. If no daemon is listening on the
+socket, the search runs in this process instead, exactly as ``drive_bls_pulse.py``
+would run it.
+
+The socket is given by ``--daemon-socket PATH``, which is not passed on, or by the
+``BLS_DAEMON_SOCKET`` environment variable; by default it is a per-user path in the
+temporary directory.
+
+Protocol: the client sends one line of JSON with the arguments and working directory,
+then the input, and shuts down its side of the connection. The daemon replies with
+frames of a one-byte channel, the payload length as a 4-byte unsigned big-endian
+integer, and the payload. Channel ``o`` carries output, ``e`` carries errors, and the
+last frame, on channel ``x``, the exit status.
+'''
+
+import os
+import sys
+import json
+import errno
+import socket
+import struct
+import tempfile
+import threading
+from argparse import ArgumentParser
+
+# Environment variable that overrides the default socket path.
+SOCKET_ENV = 'BLS_DAEMON_SOCKET'
+
+# Frame header: channel and payload length.
+FRAME_HEADER = struct.Struct('!cI')
+
+# Size of the chunks the input is sent in.
+CHUNK_SIZE = 65536
+
+
+def default_socket():
+    '''
+    Returns the socket path given by the environment, or the per-user default.
+
+    :rtype: str
+    '''
+    return os.environ.get(SOCKET_ENV) or os.path.join(tempfile.gettempdir(),
+        'cloud-kepler-bls-%d.sock' % os.getuid())
+
+
+def connect(path):
+    '''
+    Connects to the daemon on the given socket. Returns the connected socket, or None if
+    no daemon is listening.
+
+    :param path: Path of the Unix socket
+    :type path: str
+
+    :rtype: socket.socket
+    '''
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        sock.connect(path)
+    except socket.error as e:
+        sock.close()
+        if e.errno in (errno.ENOENT, errno.ECONNREFUSED):
+            return None
+        raise
+
+    return sock
+
+
+def __send(sock, args, stdin):
+    try:
+        sock.sendall(json.dumps(dict(argv=args, cwd=os.getcwd())) + '\n')
+
+        while True:
+            chunk = stdin.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            sock.sendall(chunk)
+
+        sock.shutdown(socket.SHUT_WR)
+    except socket.error:
+        # The daemon closed the connection; the reply says why.
+        pass
+
+
+def __recv_exactly(f, n):
+    data = f.read(n)
+    if len(data) != n:
+        raise IOError('Connection to the BLS daemon was lost')
+    return data
+
+
+def run_remote(sock, args, stdin=sys.stdin, stdout=sys.stdout, stderr=sys.stderr):
+    '''
+    Runs ``drive_bls_pulse.py`` with the given arguments on the daemon connected to
+    ``sock``, streaming ``stdin`` to it and its output back. Returns the exit status.
+
+    :param sock: Connected socket, as returned by :func:`connect`
+    :type sock: socket.socket
+    :param args: Command line arguments of ``drive_bls_pulse.py``
+    :type args: list
+    :param stdin: Input
+    :type stdin: file
+    :param stdout: File to write the output to
+    :type stdout: file
+    :param stderr: File to write the errors to
+    :type stderr: file
+
+    :rtype: int
+    '''
+    # Send from a separate thread, so that the output is read while the input is sent.
+    sender = threading.Thread(target=__send, args=(sock, args, stdin))
+    sender.daemon = True
+    sender.start()
+
+    f = sock.makefile('rb')
+    streams = {'o':stdout, 'e':stderr}
+
+    try:
+        while True:
+            channel, n = FRAME_HEADER.unpack(__recv_exactly(f, FRAME_HEADER.size))
+            payload = __recv_exactly(f, n)
+
+            if channel == 'x':
+                stdout.flush()
+                return int(payload)
+
+            streams[channel].write(payload)
+    finally:
+        f.close()
+        sock.close()
+
+
+def run_local(args):
+    '''
+    Runs ``drive_bls_pulse.py`` with the given arguments in this process.
+
+    :param args: Command line arguments of ``drive_bls_pulse.py``
+    :type args: list
+    '''
+    import drive_bls_pulse
+
+    sys.argv = [drive_bls_pulse.__file__] + args
+    drive_bls_pulse.main()
+
+
+def main():
+    '''
+    Main function for this module. Runs the search on the daemon, or in this process if
+    no daemon is listening.
+    '''
+    # Take out the socket option, and leave all others, including --help, to
+    # drive_bls_pulse.py.
+    parser = ArgumentParser(add_help=False)
+    parser.add_argument("--daemon-socket", action="store", dest="daemon_socket",
+        default=None)
+    known, args = parser.parse_known_args()
+    path = known.daemon_socket or default_socket()
+
+    sock = connect(path)
+    if sock is None:
+        run_local(args)
+    else:
+        sys.exit(run_remote(sock, args))
+
+
+if __name__ == '__main__':
+    main()
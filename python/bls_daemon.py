@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Warm BLS worker daemon. Every streaming task that runs ``drive_bls_pulse.py`` starts a
+new interpreter and imports NumPy, the configuration parser and the compiled search
+modules before it reads its first line, which for short tasks takes as long as the
+search itself. The daemon does this once: it imports the search modules, runs a short
+search to warm them up, and then serves :mod:`bls_client` over a Unix socket. Each
+connection is handled by a child process forked from the warm daemon, which runs
+:func:`drive_bls_pulse.main` with the client's arguments and working directory on the
+client's input, and sends its output, errors and exit status back. Forked children
+share the memory of the daemon, and a failing run cannot affect the daemon or other
+runs.
+
+Start one daemon per node, e.g.::
+
+    python bls_daemon.py --socket /tmp/bls.sock &
+    python join_quarters.py < lightcurves.txt | python bls_client.py \\
+        --daemon-socket /tmp/bls.sock -c config.conf
+
+The daemon removes its socket when it exits, after ``--idle-timeout`` seconds without
+connections if given.
+'''
+
+import os
+import sys
+import json
+import errno
+import signal
+import logging
+import traceback
+import SocketServer
+import numpy as np
+from argparse import ArgumentParser
+from bls_client import FRAME_HEADER, CHUNK_SIZE, default_socket, connect
+import drive_bls_pulse
+
+# Basic logging configuration.
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class FrameWriter(object):
+    '''
+    File-like object that sends what is written to it as frames of one channel of the
+    reply to the client.
+    '''
+    def __init__(self, conn, channel):
+        self._conn = conn
+        self._channel = channel
+        self._buffer = []
+        self._size = 0
+        self.softspace = 0
+
+    def write(self, data):
+        self._buffer.append(data)
+        self._size += len(data)
+        if self._size >= CHUNK_SIZE:
+            self.flush()
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        if self._size:
+            data = ''.join(self._buffer)
+            self._conn.sendall(FRAME_HEADER.pack(self._channel, len(data)) + data)
+            self._buffer = []
+            self._size = 0
+
+    def isatty(self):
+        return False
+
+
+class BLSHandler(SocketServer.BaseRequestHandler):
+    '''
+    Runs ``drive_bls_pulse.py`` for one client. The handler runs in a forked child.
+    '''
+    def handle(self):
+        stdin = self.request.makefile('rb')
+        stdout = FrameWriter(self.request, 'o')
+        stderr = FrameWriter(self.request, 'e')
+
+        request = json.loads(stdin.readline())
+        sys.stdin, sys.stdout, sys.stderr = stdin, stdout, stderr
+        sys.argv = [drive_bls_pulse.__file__] + request['argv']
+
+        try:
+            os.chdir(request['cwd'])
+            drive_bls_pulse.main()
+            status = 0
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else int(e.code is not None)
+            if e.code is not None and not isinstance(e.code, int):
+                stderr.write(str(e.code) + '\n')
+        except Exception:
+            stderr.write(traceback.format_exc())
+            status = 1
+
+        try:
+            stdout.flush()
+            stderr.flush()
+            self.request.sendall(FRAME_HEADER.pack('x', len(str(status))) + str(status))
+        except IOError as e:
+            # The client is gone; nobody is left to report to.
+            if e.errno != errno.EPIPE:
+                raise
+
+
+class BLSServer(SocketServer.ForkingMixIn, SocketServer.UnixStreamServer):
+    '''
+    Unix socket server that handles every connection in a forked child, and stops after
+    ``idle_timeout`` seconds without connections.
+    '''
+    def __init__(self, path, idle_timeout=None, max_children=None):
+        SocketServer.UnixStreamServer.__init__(self, path, BLSHandler)
+        self.timeout = idle_timeout
+        self.idle = False
+        if max_children is not None:
+            self.max_children = max_children
+
+    def handle_timeout(self):
+        SocketServer.ForkingMixIn.handle_timeout(self)
+        if not self.active_children:
+            self.idle = True
+
+    def serve_until_idle(self):
+        while not self.idle:
+            self.handle_request()
+
+
+def warm_up():
+    '''
+    Runs a short search on a synthetic lightcurve and formats its output, so that the
+    first search of every child does not pay for loading the compiled modules and
+    their dependencies.
+    '''
+    options = dict(segment=2., mindur=0.0416667, maxdur=0.5, nbins=100, direction=2,
+        mode='cython', profile=False)
+    t = np.arange(0., 2. * options['segment'], 1. / 48.94)
+    out = drive_bls_pulse.run_bls(t, np.ones_like(t), np.ones_like(t) * 0.001, options)
+    drive_bls_pulse.format_output('0', '[]', out, options['direction'], 'encoded')
+
+
+def __remove_socket(path):
+    try:
+        os.unlink(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def main():
+    '''
+    Main function for this module. Parses the command line arguments, warms up the
+    search and serves clients until interrupted or idle.
+    '''
+    parser = ArgumentParser(description="Serve BLS pulse searches to bls_client.py over "
+        "a Unix socket.")
+    parser.add_argument("--socket", action="store", dest="socket",
+        default=default_socket(), help="[Optional] Path of the Unix socket. Defaults to "
+            "$BLS_DAEMON_SOCKET or a per-user path in the temporary directory.")
+    parser.add_argument("--idle-timeout", action="store", type=float,
+        dest="idle_timeout", default=None, help="[Optional] Exit after this many seconds "
+            "without connections.")
+    parser.add_argument("--max-children", action="store", type=int, dest="max_children",
+        default=None, help="[Optional] Maximum number of searches to run at once.")
+    args = parser.parse_args()
+
+    sock = connect(args.socket)
+    if sock is not None:
+        sock.close()
+        parser.error('A daemon is already listening on %s.' % args.socket)
+
+    # A socket left behind by a daemon that was killed refuses connections.
+    __remove_socket(args.socket)
+    warm_up()
+
+    server = BLSServer(args.socket, args.idle_timeout, args.max_children)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        server.serve_until_idle()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        __remove_socket(args.socket)
+
+
+if __name__ == '__main__':
+    main()
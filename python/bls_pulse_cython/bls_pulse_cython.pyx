@@ -5,20 +5,59 @@ import detrend.polyfit as polyfit
 from numpy.polynomial import polynomial as poly
 cimport numpy as np
 cimport cython
+from cython.parallel cimport prange, threadid
+from libc.math cimport NAN
 
 
 cdef extern int do_bls_pulse_segment(double *time, double *flux, double *fluxerr, double *samples,
     int nbins, int n, int nbins_min_dur, int nbins_max_dur, int direction, double *srsq, 
-    double *duration, double *depth, double *midtime)
+    double *duration, double *depth, double *midtime) nogil
 
 cdef extern int do_bls_pulse_segment_compound(double *time, double *flux, double *fluxerr, 
     double *samples, int nbins, int n, int nbins_min_dur, int nbins_max_dur, 
     double *srsq_dip, double *duration_dip, double *depth_dip, double *midtime_dip, 
-    double *srsq_blip, double *duration_blip, double *depth_blip, double *midtime_blip)
+    double *srsq_blip, double *duration_blip, double *depth_blip, double *midtime_blip) nogil
 
-cdef extern int do_bin_segment(double *time, double *flux, double *fluxerr, int nbins,
-    double segsize, int nsamples, int n, int *ndx, double *stime, double *sflux,
-    double *sfluxerr, double *samples, double *start, double *end)
+cdef extern int do_bls_pulse_segment_sliding(double *time, double *flux, double *fluxerr,
+    double *samples, int nbins, int n, int nbins_min_dur, int nbins_max_dur, int direction,
+    double *srsq, double *duration, double *depth, double *midtime) nogil
+
+cdef extern int do_bls_pulse_segment_compound_sliding(double *time, double *flux,
+    double *fluxerr, double *samples, int nbins, int n, int nbins_min_dur,
+    int nbins_max_dur, double *srsq_dip, double *duration_dip, double *depth_dip,
+    double *midtime_dip, double *srsq_blip, double *duration_blip, double *depth_blip,
+    double *midtime_blip) nogil
+
+cdef extern int do_bls_pulse_segment_pruned(double *time, double *flux, double *fluxerr,
+    double *samples, int nbins, int n, int nbins_min_dur, int nbins_max_dur, int direction,
+    double *srsq, double *duration, double *depth, double *midtime) nogil
+
+cdef extern int do_bls_pulse_segment_compound_pruned(double *time, double *flux,
+    double *fluxerr, double *samples, int nbins, int n, int nbins_min_dur,
+    int nbins_max_dur, double *srsq_dip, double *duration_dip, double *depth_dip,
+    double *midtime_dip, double *srsq_blip, double *duration_blip, double *depth_blip,
+    double *midtime_blip) nogil
+
+cdef extern int find_segment_bounds(double *time, int nsamples, double segsize, int first,
+    int nsegments, int *bounds) nogil
+
+cdef extern int do_bin_range(double *time, double *flux, double *fluxerr, int lo, int hi,
+    int nbins, double segsize, int n, double *stime, double *sflux, double *sfluxerr,
+    double *samples, double *start, double *end) nogil
+
+cdef extern int do_bin_lightcurve(double *time, double *flux, double *fluxerr, int nsamples,
+    int nbins, double segsize, int first, int nsegments, int *bounds, double *binned,
+    double *start, double *end) nogil
+
+# Kernels of the search of one segment: the exhaustive search; the same search with
+# prefix sums of the sample counts and sliding extremes; and the exhaustive search of
+# only the start bins that can hold the best event. All three give identical output.
+cdef enum:
+    EXHAUSTIVE = 0
+    SLIDING = 1
+    PRUNED = 2
+
+KERNELS = {'exhaustive':EXHAUSTIVE, 'sliding':SLIDING, 'pruned':PRUNED}
 
 
 @cython.boundscheck(False)
@@ -26,100 +65,123 @@ cdef extern int do_bin_segment(double *time, double *flux, double *fluxerr, int
 @cython.profile(True)
 def bls_pulse(np.ndarray[double, ndim=1, mode='c'] time,
 np.ndarray[double, ndim=1, mode='c'] flux, np.ndarray[double, ndim=1, mode='c'] fluxerr,
-int nbins, double segsize, double mindur, double maxdur, int detrend_order=3, direction=0):
+int nbins, double segsize, double mindur, double maxdur, int detrend_order=3, direction=0,
+epoch=None, int first_segment=0, segment_count=None, int nthreads=1,
+kernel='exhaustive'):
+    '''
+    Runs the BLS pulse search on every segment of the lightcurve. Segments are
+    ``segsize`` long and start at ``epoch``, by default the first time. A block of a
+    longer lightcurve can be searched on its own by passing the epoch of the whole
+    lightcurve, the index of the block's first segment, and the number of segments in
+    the block; the results are then identical to those of the same segments in a search
+    of the whole lightcurve. With ``nthreads`` greater than one, the segments are
+    searched on that many threads (see :func:`__search_segments`); the results are
+    identical to those of a search on one thread. ``kernel`` selects the search of each
+    segment (see :data:`KERNELS`); the pruned kernel adds the number of start bins it
+    skipped in each segment to the output as ``pruned``.
+    '''
     cdef double t
-    cdef int i, nsamples, nsegments, save
+    cdef int i, nsegments, code
     cdef np.ndarray[double, ndim=1, mode='c'] segstart, segend
     cdef np.ndarray[double, ndim=1, mode='c'] stime, sflux, sfluxerr, samples
+    cdef np.ndarray[int, ndim=1, mode='c'] pruned
     cdef np.ndarray[double, ndim=2, mode='c'] srsq, depth, duration, midtime
     cdef np.ndarray[double, ndim=2, mode='c'] srsq_dip, depth_dip, duration_dip, midtime_dip
     cdef np.ndarray[double, ndim=2, mode='c'] srsq_blip, depth_blip, duration_blip, midtime_blip
 
+    code = __kernel_code(kernel)
+
     # Prepare the lightcurve so that it meets our assumptions.
-    t = np.nanmin(time)
+    t = np.nanmin(time) if epoch is None else epoch
     time -= t
 
-    nsamples = np.size(time)
-    nsegments = np.floor(np.nanmax(time) / segsize) + 1
-    save = 0
-
-    # This memory is only allocated once and will be reused.
-    stime = np.empty((nbins,), dtype='float64')
-    sflux = np.empty((nbins,), dtype='float64')
-    sfluxerr = np.empty((nbins,), dtype='float64')
-    samples = np.empty((nbins,), dtype='float64')
-
-    # Allocate memory for the segment start and end times.
-    segstart = np.empty((nsegments,), dtype='float64')
-    segend = np.empty((nsegments,), dtype='float64')
+    try:
+        if segment_count is None:
+            nsegments = np.floor(np.nanmax(time) / segsize) + 1 - first_segment
+        else:
+            nsegments = segment_count
+
+        if nthreads > 1:
+            bounds = __segment_bounds(time, first_segment, nsegments, segsize)
+            numbers = np.arange(first_segment, first_segment + nsegments, dtype=np.intc)
+            segstart, segend, results, pruned = __search_segments(time, flux, fluxerr,
+                bounds[:nsegments], bounds[1:], numbers, nbins, segsize, mindur, maxdur,
+                detrend_order, direction, nthreads, code)
+            return __packed_output(segstart, segend, results, t, direction,
+                pruned if code == PRUNED else None)
+
+        # Bin every segment in one pass; the segment start and end times come with them.
+        binned, segstart, segend = __bin_lightcurve(time, flux, fluxerr, nbins, segsize,
+            first_segment, nsegments)
+        pruned = np.zeros((nsegments,), dtype=np.intc)
 
-    if direction == 2:
-        srsq_dip = np.empty((nsegments,nbins), dtype='float64')
-        duration_dip = np.empty((nsegments,nbins), dtype='float64')
-        depth_dip = np.empty((nsegments,nbins), dtype='float64')
-        midtime_dip = np.empty((nsegments,nbins), dtype='float64')
-        srsq_blip = np.empty((nsegments,nbins), dtype='float64')
-        duration_blip = np.empty((nsegments,nbins), dtype='float64')
-        depth_blip = np.empty((nsegments,nbins), dtype='float64')
-        midtime_blip = np.empty((nsegments,nbins), dtype='float64')
-    else:
-        srsq = np.empty((nsegments,nbins), dtype='float64')
-        duration = np.empty((nsegments,nbins), dtype='float64')
-        depth = np.empty((nsegments,nbins), dtype='float64')
-        midtime = np.empty((nsegments,nbins), dtype='float64')
+        if direction == 2:
+            srsq_dip = np.empty((nsegments,nbins), dtype='float64')
+            duration_dip = np.empty((nsegments,nbins), dtype='float64')
+            depth_dip = np.empty((nsegments,nbins), dtype='float64')
+            midtime_dip = np.empty((nsegments,nbins), dtype='float64')
+            srsq_blip = np.empty((nsegments,nbins), dtype='float64')
+            duration_blip = np.empty((nsegments,nbins), dtype='float64')
+            depth_blip = np.empty((nsegments,nbins), dtype='float64')
+            midtime_blip = np.empty((nsegments,nbins), dtype='float64')
+        else:
+            srsq = np.empty((nsegments,nbins), dtype='float64')
+            duration = np.empty((nsegments,nbins), dtype='float64')
+            depth = np.empty((nsegments,nbins), dtype='float64')
+            midtime = np.empty((nsegments,nbins), dtype='float64')
         
-    for i in xrange(nsegments):
-        # Initialize these to zero for each new segment.
-        stime[:] = 0.
-        sflux[:] = 0.
-        sfluxerr[:] = 0.
-        samples[:] = 0.
-
-        # Get the binned data.
-        save, start, end = __get_binned_segment(time, flux, fluxerr, nbins, segsize, nsamples, i,
-            save, stime, sflux, sfluxerr, samples)
-        segstart[i] = start + t
-        segend[i] = end + t
-
-        # Perform sigma clipping and polynomial detrending.
-        ndx = np.where(np.isfinite(sflux))[0]
+        for i in xrange(nsegments):
+            # Get the binned data.
+            stime = binned[i,0]
+            sflux = binned[i,1]
+            sfluxerr = binned[i,2]
+            samples = binned[i,3]
+
+            # Perform sigma clipping and polynomial detrending.
+            ndx = np.where(np.isfinite(sflux))[0]
         
-        if len(ndx) <= detrend_order + 1 and detrend_order != 0:
-            # There aren't enough points to do any detrending; go on to the
-            # next segment.
+            if len(ndx) <= detrend_order + 1 and detrend_order != 0:
+                # There aren't enough points to do any detrending; go on to the
+                # next segment.
+                if direction == 2:
+                    srsq_dip[i,:] = 0.
+                    depth_dip[i,:] = np.nan
+                    duration_dip[i,:] = np.nan
+                    midtime_dip[i,:] = np.nan
+                    srsq_blip[i,:] = 0.
+                    depth_blip[i,:] = np.nan
+                    duration_blip[i,:] = np.nan
+                    midtime_blip[i,:] = np.nan
+                else:
+                    srsq[i,:] = 0.
+                    depth[i,:] = np.nan
+                    duration[i,:] = np.nan
+                    midtime[i,:] = np.nan
+
+                continue
+
+            if detrend_order != 0:
+                coeffs = polyfit.polyfit(stime[ndx], sflux[ndx], sfluxerr[ndx],
+                    detrend_order)
+                sflux /= poly.polyval(stime, coeffs)
+                sflux -= 1.
+            
+            # Call the algorithm.
             if direction == 2:
-                srsq_dip[i,:] = 0.
-                depth_dip[i,:] = np.nan
-                duration_dip[i,:] = np.nan
-                midtime_dip[i,:] = np.nan
-                srsq_blip[i,:] = 0.
-                depth_blip[i,:] = np.nan
-                duration_blip[i,:] = np.nan
-                midtime_blip[i,:] = np.nan
+                pruned[i] = __bls_pulse_binned_compound(stime, sflux, sfluxerr, samples,
+                    segsize, mindur, maxdur, code, srsq_dip[i,:], duration_dip[i,:],
+                    depth_dip[i,:], midtime_dip[i,:], srsq_blip[i,:], duration_blip[i,:],
+                    depth_blip[i,:], midtime_blip[i,:])
             else:
-                srsq[i,:] = 0.
-                depth[i,:] = np.nan
-                duration[i,:] = np.nan
-                midtime[i,:] = np.nan
-
-            continue
-
-        if detrend_order != 0:
-            coeffs = polyfit.polyfit(stime[ndx], sflux[ndx], sfluxerr[ndx], detrend_order)
-            sflux /= poly.polyval(stime, coeffs)
-            sflux -= 1.
-            
-        # Call the algorithm.
-        if direction == 2:
-            __bls_pulse_binned_compound(stime, sflux, sfluxerr, samples, segsize, mindur,
-                maxdur, srsq_dip[i,:], duration_dip[i,:], depth_dip[i,:], midtime_dip[i,:],
-                srsq_blip[i,:], duration_blip[i,:], depth_blip[i,:], midtime_blip[i,:])
-        else:
-            __bls_pulse_binned(stime, sflux, sfluxerr, samples, segsize, mindur, maxdur, 
-                direction, srsq[i,:], duration[i,:], depth[i,:], midtime[i,:])
+                pruned[i] = __bls_pulse_binned(stime, sflux, sfluxerr, samples, segsize,
+                    mindur, maxdur, direction, code, srsq[i,:], duration[i,:], depth[i,:],
+                    midtime[i,:])
+    finally:
+        # Fix the time offset (subtracted off earlier), even if the search fails.
+        time += t
 
-    # Fix the time offset (subtracted off earlier).
-    time += t
+    segstart += t
+    segend += t
 
     if direction == 2:
         midtime_dip += t
@@ -131,7 +193,7 @@ int nbins, double segsize, double mindur, double maxdur, int detrend_order=3, di
         ndx2 = np.nanargmax(srsq_blip, axis=1)
         ind2 = np.indices(ndx2.shape)
 
-        return dict(srsq_dip=srsq_dip[ind1,ndx1].ravel(), 
+        out = dict(srsq_dip=srsq_dip[ind1,ndx1].ravel(), 
             duration_dip=duration_dip[ind1,ndx1].ravel(), depth_dip=depth_dip[ind1,ndx1].ravel(),
             midtime_dip=midtime_dip[ind1,ndx1].ravel(), srsq_blip=srsq_blip[ind2,ndx2].ravel(),
             duration_blip=duration_blip[ind2,ndx2].ravel(), 
@@ -144,25 +206,310 @@ int nbins, double segsize, double mindur, double maxdur, int detrend_order=3, di
         ndx = np.nanargmax(srsq, axis=1)
         ind = np.indices(ndx.shape)
     
-        return dict(srsq=srsq[ind,ndx].ravel(), duration=duration[ind,ndx].ravel(), 
+        out = dict(srsq=srsq[ind,ndx].ravel(), duration=duration[ind,ndx].ravel(), 
             depth=depth[ind,ndx].ravel(), midtime=midtime[ind,ndx].ravel(),
             segstart=segstart, segend=segend)
 
+    if code == PRUNED:
+        out['pruned'] = pruned
+
+    return out
+
+
+@cython.profile(True)
+def bls_pulse_batch(np.ndarray[double, ndim=1, mode='c'] time,
+np.ndarray[double, ndim=1, mode='c'] flux, np.ndarray[double, ndim=1, mode='c'] fluxerr,
+offsets, int nbins, double segsize, double mindur, double maxdur, int detrend_order=3,
+int direction=0, int nthreads=1, kernel='exhaustive'):
+    '''
+    Runs the BLS pulse search on many lightcurves in one call. The lightcurves are packed
+    one after another into ``time``, ``flux`` and ``fluxerr``: lightcurve ``k`` is made
+    of the samples from ``offsets[k]`` up to ``offsets[k+1]``. The segments of all
+    lightcurves are searched in one loop on ``nthreads`` threads (see
+    :func:`__search_segments`). Returns the output of :func:`bls_pulse` for every
+    lightcurve packed the same way: each array holds the results of the segments of all
+    lightcurves one after another, and ``offsets`` gives the index of the first segment
+    of each lightcurve, followed by the total number of segments. The results of every
+    lightcurve are identical to those of :func:`bls_pulse`; the input arrays are not
+    modified.
+    '''
+    code = __kernel_code(kernel)
+    offsets = np.asarray(offsets, dtype=np.intp)
+    ntargets = len(offsets) - 1
+    epochs = np.empty((ntargets,), dtype='float64')
+    counts = np.empty((ntargets,), dtype=np.intp)
+    bounds = []
+
+    # Times relative to the epoch of each lightcurve, as bls_pulse makes them.
+    rtime = np.empty_like(time)
+
+    for k in xrange(ntargets):
+        a, b = offsets[k], offsets[k+1]
+        epochs[k] = np.nanmin(time[a:b])
+        rtime[a:b] = time[a:b] - epochs[k]
+        counts[k] = np.floor(np.nanmax(rtime[a:b]) / segsize) + 1
+        bounds.append(__segment_bounds(rtime[a:b], 0, counts[k], segsize) + a)
+
+    segment_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.intp)
+    target = np.repeat(np.arange(ntargets), counts)
+    numbers = np.arange(segment_offsets[-1]) - segment_offsets[:-1][target]
+
+    lo = np.concatenate([b[:-1] for b in bounds] + [[]]).astype(np.intc)
+    hi = np.concatenate([b[1:] for b in bounds] + [[]]).astype(np.intc)
+
+    segstart, segend, results, pruned = __search_segments(rtime, flux, fluxerr, lo, hi,
+        numbers.astype(np.intc), nbins, segsize, mindur, maxdur, detrend_order, direction,
+        nthreads, code)
+
+    out = __packed_output(segstart, segend, results, epochs[target], direction,
+        pruned if code == PRUNED else None)
+    out['offsets'] = segment_offsets
+    return out
+
+
+def __kernel_code(kernel):
+    '''
+    Returns the code of the search kernel named ``kernel``; raises ValueError if there
+    is no such kernel.
+    '''
+    if kernel not in KERNELS:
+        raise ValueError('Invalid kernel: %s' % kernel)
+
+    return KERNELS[kernel]
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def __segment_bounds(np.ndarray[double, ndim=1, mode='c'] time, int first_segment,
+int nsegments, double segsize):
+    '''
+    Returns the sample bounds of ``nsegments`` segments from ``first_segment`` on, found
+    by binary search on the zero-based time: segment ``first_segment + k`` is made of the
+    samples from ``bounds[k]`` up to ``bounds[k+1]``.
+    '''
+    cdef np.ndarray[int, ndim=1, mode='c'] bounds
+
+    bounds = np.empty((nsegments + 1,), dtype=np.intc)
+    find_segment_bounds(&time[0], time.shape[0], segsize, first_segment, nsegments,
+        &bounds[0])
+
+    return bounds
+
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.profile(True)
-def __get_binned_segment(np.ndarray[double, ndim=1, mode='c'] time, 
+def __bin_lightcurve(np.ndarray[double, ndim=1, mode='c'] time,
 np.ndarray[double, ndim=1, mode='c'] flux, np.ndarray[double, ndim=1, mode='c'] fluxerr,
-int nbins, double segsize, int nsamples, int n, int ndx, 
-np.ndarray[double, ndim=1, mode='c'] stime, np.ndarray[double, ndim=1, mode='c'] sflux,
-np.ndarray[double, ndim=1, mode='c'] sfluxerr, np.ndarray[double, ndim=1, mode='c'] samples):
-    cdef double start, end
+int nbins, double segsize, int first_segment, int nsegments):
+    '''
+    Bins ``nsegments`` segments of the zero-based lightcurve from ``first_segment`` on in
+    one pass. Returns an array of the binned time, flux, flux error and sample counts of
+    every segment, of shape ``(nsegments, 4, nbins)``, and the start and end times of the
+    segments. Empty bins hold NaN and a count of zero.
+    '''
+    cdef np.ndarray[double, ndim=3, mode='c'] binned
+    cdef np.ndarray[double, ndim=1, mode='c'] segstart, segend
+    cdef np.ndarray[int, ndim=1, mode='c'] bounds
 
-    do_bin_segment(&time[0], &flux[0], &fluxerr[0], nbins, segsize, nsamples, n, &ndx, 
-        &stime[0], &sflux[0], &sfluxerr[0], &samples[0], &start, &end)
+    binned = np.empty((nsegments, 4, nbins), dtype='float64')
+    segstart = np.empty((nsegments,), dtype='float64')
+    segend = np.empty((nsegments,), dtype='float64')
+    bounds = np.empty((nsegments + 1,), dtype=np.intc)
+
+    if nsegments > 0:
+        do_bin_lightcurve(&time[0], &flux[0], &fluxerr[0], time.shape[0], nbins, segsize,
+            first_segment, nsegments, &bounds[0], &binned[0,0,0], &segstart[0],
+            &segend[0])
+
+    return binned, segstart, segend
 
-    return ndx, start, end
+
+def __packed_output(segstart, segend, results, t, direction, pruned=None):
+    '''
+    Returns the output dictionary of :func:`bls_pulse` from the results of
+    :func:`__search_segments`, with the epoch ``t`` of the segments added to their times.
+    The numbers of pruned start bins are added if given.
+    '''
+    if direction == 2:
+        names = ['srsq_dip', 'duration_dip', 'depth_dip', 'midtime_dip', 'srsq_blip',
+            'duration_blip', 'depth_blip', 'midtime_blip']
+    else:
+        names = ['srsq', 'duration', 'depth', 'midtime']
+
+    out = dict(zip(names, results))
+    for name in names:
+        if name.startswith('midtime'):
+            out[name] += t
+
+    out['segstart'] = segstart + t
+    out['segend'] = segend + t
+    if pruned is not None:
+        out['pruned'] = pruned
+    return out
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def __search_segments(np.ndarray[double, ndim=1, mode='c'] time,
+np.ndarray[double, ndim=1, mode='c'] flux, np.ndarray[double, ndim=1, mode='c'] fluxerr,
+np.ndarray[int, ndim=1, mode='c'] lo, np.ndarray[int, ndim=1, mode='c'] hi,
+np.ndarray[int, ndim=1, mode='c'] numbers, int nbins, double segsize, double mindur, double maxdur, int detrend_order, int direction,
+int nthreads, int kernel):
+    '''
+    Searches a list of segments on ``nthreads`` threads. Segment ``i`` is segment number
+    ``numbers[i]`` of its lightcurve and is made of the samples from ``lo[i]`` up to
+    ``hi[i]`` of the arrays (see :func:`__segment_bounds`), with times relative to the
+    epoch of the lightcurve. Returns the start and end times of the
+    segments, the results, one row per output array of :func:`bls_pulse` in the order
+    of :func:`__packed_output`, and the number of start bins the kernel pruned in each
+    segment.
+
+    The segments are searched in three passes. The threads first bin every segment into
+    its own rows of one array without the GIL. The binned flux of each segment is then
+    detrended in turn, since the fit uses NumPy; doing it between the parallel passes
+    keeps the threads from waiting on the GIL in the middle of the search. Last, each
+    thread runs the search kernel on a segment into its own scratch rows and picks the
+    best bin, again without the GIL. Every segment goes through the same operations as
+    in the serial search, and the best bin is the first with the highest score, as
+    ``np.nanargmax`` picks it, so the results are identical.
+    '''
+    cdef int i, tid, failed = 0, nsegments, nmatrices, nbins_min_dur, nbins_max_dur
+    cdef np.ndarray[double, ndim=1, mode='c'] segstart, segend
+    cdef np.ndarray[double, ndim=2, mode='c'] results
+    cdef np.ndarray[double, ndim=3, mode='c'] binned, scratch
+    cdef np.ndarray[int, ndim=1, mode='c'] pruned, ok
+
+    nsegments = numbers.shape[0]
+    nmatrices = 8 if direction == 2 else 4
+
+    nbins_min_dur = max(np.floor(mindur / segsize * nbins), 1)
+    nbins_max_dur = np.ceil(maxdur / segsize * nbins)
+
+    segstart = np.empty((nsegments,), dtype='float64')
+    segend = np.empty((nsegments,), dtype='float64')
+    results = np.empty((nmatrices, nsegments), dtype='float64')
+    pruned = np.empty((nsegments,), dtype=np.intc)
+    ok = np.empty((nsegments,), dtype=np.intc)
+
+    # Binned time, flux, flux error and samples of every segment, and the results of
+    # every bin of the segment each thread works on.
+    binned = np.empty((nsegments, 4, nbins), dtype='float64')
+    scratch = np.empty((nthreads, nmatrices, nbins), dtype='float64')
+
+    for i in prange(nsegments, nogil=True, num_threads=nthreads, schedule='dynamic'):
+        do_bin_range(&time[0], &flux[0], &fluxerr[0], lo[i], hi[i], nbins, segsize,
+            numbers[i], &binned[i,0,0], &binned[i,1,0], &binned[i,2,0], &binned[i,3,0],
+            &segstart[i], &segend[i])
+
+    for i in xrange(nsegments):
+        ok[i] = __detrend_binned(binned[i], detrend_order)
+
+    for i in prange(nsegments, nogil=True, num_threads=nthreads, schedule='dynamic'):
+        tid = threadid()
+        pruned[i] = __search_segment(&binned[i,0,0], nbins, nbins_min_dur,
+            nbins_max_dur, direction, kernel, ok[i], &scratch[tid,0,0])
+        if pruned[i] < 0:
+            failed += 1
+        __maximize(&scratch[tid,0,0], nbins, nmatrices, &results[0,i], nsegments)
+
+    if failed:
+        raise MemoryError()
+
+    return segstart, segend, results, pruned
+
+
+def __detrend_binned(binned, int detrend_order):
+    '''
+    Detrends the binned flux of one segment in place, as the serial search does.
+    Returns 0 if the segment has too few bins to detrend, and 1 otherwise.
+    '''
+    stime, sflux, sfluxerr = binned[0], binned[1], binned[2]
+    ndx = np.where(np.isfinite(sflux))[0]
+
+    if len(ndx) <= detrend_order + 1 and detrend_order != 0:
+        return 0
+
+    if detrend_order != 0:
+        coeffs = polyfit.polyfit(stime[ndx], sflux[ndx], sfluxerr[ndx], detrend_order)
+        sflux /= poly.polyval(stime, coeffs)
+        sflux -= 1.
+
+    return 1
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef int __search_segment(double *scratch, int nbins, int nbins_min_dur,
+int nbins_max_dur, int direction, int kernel, int ok, double *out) nogil:
+    cdef int i, m, n, nmatrices = 8 if direction == 2 else 4
+    cdef double total = 0.
+
+    # Initialize the results as the serial search does.
+    for m in range(nmatrices):
+        for i in range(nbins):
+            out[m * nbins + i] = 0. if m % 4 == 0 else NAN
+
+    if not ok:
+        return 0
+
+    # The total number of points that were binned.
+    for i in range(nbins):
+        total += scratch[3 * nbins + i]
+    n = <int> total
+
+    return __run_kernel(kernel, scratch, scratch + nbins, scratch + 2 * nbins,
+        scratch + 3 * nbins, nbins, n, nbins_min_dur, nbins_max_dur, direction, out,
+        out + nbins, out + 2 * nbins, out + 3 * nbins, out + 4 * nbins, out + 5 * nbins,
+        out + 6 * nbins, out + 7 * nbins)
+
+
+cdef int __run_kernel(int kernel, double *time, double *flux, double *fluxerr,
+double *samples, int nbins, int n, int nbins_min_dur, int nbins_max_dur, int direction,
+double *srsq, double *duration, double *depth, double *midtime, double *srsq_blip,
+double *duration_blip, double *depth_blip, double *midtime_blip) nogil:
+    # Runs the search kernel on one binned segment, and returns what it returns. With
+    # direction 2 the first four outputs are those of dips; the last four are only
+    # written for direction 2.
+    if direction == 2:
+        if kernel == PRUNED:
+            return do_bls_pulse_segment_compound_pruned(time, flux, fluxerr, samples,
+                nbins, n, nbins_min_dur, nbins_max_dur, srsq, duration, depth, midtime,
+                srsq_blip, duration_blip, depth_blip, midtime_blip)
+        if kernel == SLIDING:
+            return do_bls_pulse_segment_compound_sliding(time, flux, fluxerr, samples,
+                nbins, n, nbins_min_dur, nbins_max_dur, srsq, duration, depth, midtime,
+                srsq_blip, duration_blip, depth_blip, midtime_blip)
+        return do_bls_pulse_segment_compound(time, flux, fluxerr, samples, nbins, n,
+            nbins_min_dur, nbins_max_dur, srsq, duration, depth, midtime, srsq_blip,
+            duration_blip, depth_blip, midtime_blip)
+
+    if kernel == PRUNED:
+        return do_bls_pulse_segment_pruned(time, flux, fluxerr, samples, nbins, n,
+            nbins_min_dur, nbins_max_dur, direction, srsq, duration, depth, midtime)
+    if kernel == SLIDING:
+        return do_bls_pulse_segment_sliding(time, flux, fluxerr, samples, nbins, n,
+            nbins_min_dur, nbins_max_dur, direction, srsq, duration, depth, midtime)
+    return do_bls_pulse_segment(time, flux, fluxerr, samples, nbins, n, nbins_min_dur,
+        nbins_max_dur, direction, srsq, duration, depth, midtime)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void __maximize(double *out, int nbins, int nmatrices, double *results,
+Py_ssize_t stride) nogil:
+    cdef int g, m, i, best
+
+    # For each direction, the first bin with the highest score; NaN scores are skipped.
+    for g in range(0, nmatrices, 4):
+        best = 0
+        for i in range(nbins):
+            if out[g * nbins + i] > out[g * nbins + best] or \
+            out[g * nbins + best] != out[g * nbins + best]:
+                best = i
+
+        for m in range(g, g + 4):
+            results[m * stride] = out[m * nbins + best]
 
 
 @cython.boundscheck(False)
@@ -171,10 +518,10 @@ np.ndarray[double, ndim=1, mode='c'] sfluxerr, np.ndarray[double, ndim=1, mode='
 def __bls_pulse_binned(np.ndarray[double, ndim=1, mode='c'] time, 
 np.ndarray[double, ndim=1, mode='c'] flux, np.ndarray[double, ndim=1, mode='c'] fluxerr,
 np.ndarray[double, ndim=1, mode='c'] samples, double segsize, double mindur, double maxdur,
-int direction, np.ndarray[double, ndim=1, mode='c'] srsq, 
+int direction, int kernel, np.ndarray[double, ndim=1, mode='c'] srsq, 
 np.ndarray[double, ndim=1, mode='c'] duration, np.ndarray[double, ndim=1, mode='c'] depth, 
 np.ndarray[double, ndim=1, mode='c'] midtime):
-    cdef int nbins, n, nbins_min_dur, nbins_max_dur
+    cdef int nbins, n, nbins_min_dur, nbins_max_dur, result
     cdef double c
 
     # These arrays will contain all of the final results. They are written inside the external
@@ -193,9 +540,14 @@ np.ndarray[double, ndim=1, mode='c'] midtime):
     # the total number of points that were binned
     n = np.sum(samples)
 
-    do_bls_pulse_segment(&time[0], &flux[0], &fluxerr[0], &samples[0], nbins, n, 
-        nbins_min_dur, nbins_max_dur, direction, &srsq[0], &duration[0], &depth[0], 
-        &midtime[0])
+    result = __run_kernel(kernel, &time[0], &flux[0], &fluxerr[0], &samples[0], nbins, n,
+        nbins_min_dur, nbins_max_dur, direction, &srsq[0], &duration[0], &depth[0],
+        &midtime[0], NULL, NULL, NULL, NULL)
+    if result < 0:
+        raise MemoryError()
+
+    # The number of start bins the kernel pruned.
+    return result
 
 
 @cython.boundscheck(False)
@@ -204,11 +556,11 @@ np.ndarray[double, ndim=1, mode='c'] midtime):
 def __bls_pulse_binned_compound(np.ndarray[double, ndim=1, mode='c'] time, 
 np.ndarray[double, ndim=1, mode='c'] flux, np.ndarray[double, ndim=1, mode='c'] fluxerr,
 np.ndarray[double, ndim=1, mode='c'] samples, double segsize, double mindur, double maxdur,
-np.ndarray[double, ndim=1, mode='c'] srsq_dip, np.ndarray[double, ndim=1, mode='c'] duration_dip, 
+int kernel, np.ndarray[double, ndim=1, mode='c'] srsq_dip, np.ndarray[double, ndim=1, mode='c'] duration_dip, 
 np.ndarray[double, ndim=1, mode='c'] depth_dip, np.ndarray[double, ndim=1, mode='c'] midtime_dip, 
 np.ndarray[double, ndim=1, mode='c'] srsq_blip, np.ndarray[double, ndim=1, mode='c'] duration_blip,
 np.ndarray[double, ndim=1, mode='c'] depth_blip, np.ndarray[double, ndim=1, mode='c'] midtime_blip):
-    cdef int nbins, n, nbins_min_dur, nbins_max_dur
+    cdef int nbins, n, nbins_min_dur, nbins_max_dur, result
     cdef double c
 
     # These arrays will contain all of the final results. They are written inside the external
@@ -225,14 +577,19 @@ np.ndarray[double, ndim=1, mode='c'] depth_blip, np.ndarray[double, ndim=1, mode
     midtime_dip[:] = np.nan
     srsq_blip[:] = 0.
     duration_blip[:] = np.nan
-    depth_dip[:] =  np.nan
-    midtime_dip[:] = np.nan
+    depth_blip[:] =  np.nan
+    midtime_blip[:] = np.nan
 
     # the total number of points that were binned
     n = np.sum(samples)
 
-    do_bls_pulse_segment_compound(&time[0], &flux[0], &fluxerr[0], &samples[0], nbins, n, 
-        nbins_min_dur, nbins_max_dur, &srsq_dip[0], &duration_dip[0], &depth_dip[0], 
+    result = __run_kernel(kernel, &time[0], &flux[0], &fluxerr[0], &samples[0], nbins, n,
+        nbins_min_dur, nbins_max_dur, 2, &srsq_dip[0], &duration_dip[0], &depth_dip[0],
         &midtime_dip[0], &srsq_blip[0], &duration_blip[0], &depth_blip[0],
         &midtime_blip[0])
+    if result < 0:
+        raise MemoryError()
+
+    # The number of start bins the kernel pruned.
+    return result
 
@@ -1,5 +1,6 @@
 #include <math.h>
 #include <stdio.h>
+#include <stdlib.h>
 
 #define true            (1)
 
@@ -11,17 +12,75 @@
  * If d = 0, givees the most extreme value of a and b. */
 #define extreme(a,b,d)  (d ? (d * a > d * b ? a : b) : (fabs(a) > fabs(b) ? a : b))
 
+/* Whether a is strictly more extreme than b, in the sense of `extreme`. */
+#define better(a,b,d)   (d ? (d * a > d * b) : (fabs(a) > fabs(b)))
 
-int do_bin_segment(double *time, double *flux, double *fluxerr, int nbins, 
-    double segsize, int nsamples, int n, int *ndx, double *stime, double *sflux, 
-    double *sfluxerr, double *samples, double *start, double *end)
+/* Fewest minimum-duration bins for which the sliding search saves time over the
+ * exhaustive search. The exhaustive search of dips and blips has less to save on, as
+ * the lowest and highest flux cost less to track than the most extreme one. */
+#define SLIDING_MIN_BINS             (12)
+#define SLIDING_MIN_BINS_COMPOUND    (100)
+
+/* Relative margin added to the upper bounds of the pruned search, far above the rounding
+ * errors of the sums they are computed from. */
+#define BOUND_MARGIN    (1e-9)
+
+/* A start bin of the pruned search and the upper bound of SR^2 of its events. */
+typedef struct
+{
+    double bound;
+    int bin;
+} candidate;
+
+
+int find_segment_bounds(double *time, int nsamples, double segsize, int first,
+    int nsegments, int *bounds)
+{
+    /**
+     * Finds the samples of `nsegments` segments from segment `first` on by binary search
+     * on the sorted, zero-based time. Segment `first + k` is made of the samples from
+     * `bounds[k]` up to `bounds[k + 1]`, so `bounds` must hold `nsegments + 1` indices.
+     * A segment ends at the first sample at or after its end time, computed as
+     * `start + segsize` so that the segments split exactly where a scan from the start
+     * of the lightcurve would split them.
+     */
+    int k, lo = 0, hi, mid;
+    double edge;
+
+    for (k = 0; k <= nsegments; k++)
+    {
+        /* The end of the previous segment; the edges only grow, so each search starts at
+         * the previous bound. */
+        edge = ((double) (first + k - 1)) * segsize + segsize;
+        hi = nsamples;
+
+        while (lo < hi)
+        {
+            mid = lo + (hi - lo) / 2;
+            if (time[mid] < edge)
+                lo = mid + 1;
+            else
+                hi = mid;
+        }
+
+        bounds[k] = lo;
+    }
+
+    return 0;
+}
+
+
+int do_bin_range(double *time, double *flux, double *fluxerr, int lo, int hi, int nbins,
+    double segsize, int n, double *stime, double *sflux, double *sfluxerr, double *samples,
+    double *start, double *end)
 {
     /**
      * This function is intended to be a very optimized phase-binning implementation.
      * We assume that the time is already sorted and zero-based; both are relatively
-     * inexpensive operations and can be carried out from Python. The user supplies
-     * the time index of the beginning of the segment in `ndx`, and the time index of
-     * the beginning of the next segment is returned by the same pointer.
+     * inexpensive operations and can be carried out from Python. The samples from `lo`
+     * up to `hi`, as found by `find_segment_bounds`, are binned into segment `n`. The
+     * binned arrays are cleared first and nothing else is written, so that segments can
+     * be binned in parallel.
      */
 
     /* Calculate the beginning and end times for this segment. */
@@ -31,121 +90,297 @@ int do_bin_segment(double *time, double *flux, double *fluxerr, int nbins,
     /* Calculate the size of a single bin. */
     double binsize = segsize / ((double) nbins);
 
-    /* We keep track of the time index, bin index, and number of points in this bin. */
-    int i = *ndx, j;
+    /* We keep track of the time index and bin index. */
+    int i, j;
+
+    for (j = 0; j < nbins; j++)
+    {
+        stime[j] = 0.;
+        sflux[j] = 0.;
+        sfluxerr[j] = 0.;
+        samples[j] = 0.;
+    }
 
-    while (true)
+    for (i = lo; i < hi; i++)
     {
         if (isnan(flux[i]))
-        {
-            i++;
             continue;
-        }
-
-        if ((time[i] >= *end) || (i >= nsamples))
-            break;
 
         j = (int) floor((time[i] - *start) / binsize);
 
+        /* Rounding can put a sample on the edge of the segment one bin outside of it. */
+        if (j < 0)
+            j = 0;
+        else if (j >= nbins)
+            j = nbins - 1;
+
         /* We're just adding here; we'll divide by the count number at the end. */
         stime[j] += time[i];
         sflux[j] += flux[i];
         sfluxerr[j] += fluxerr[i];
         samples[j] += 1.;
+    }
 
-        /* Advance to the next sample. */
-        i++;
+    for (j = 0; j < nbins; j++)
+    {
+        /* Take the arithmetic mean; empty bins become NaN. */
+        stime[j] /= samples[j];
+        sflux[j] /= samples[j];
+        sfluxerr[j] /= samples[j];
     }
 
-    /* Return the start index of the next segment to the caller. */
-    *ndx = i;
+    return 0;
+}
+
 
-    for (i = 0; i < nbins; i++)
+int do_bin_lightcurve(double *time, double *flux, double *fluxerr, int nsamples, int nbins,
+    double segsize, int first, int nsegments, int *bounds, double *binned, double *start,
+    double *end)
+{
+    /**
+     * Bins `nsegments` segments of the lightcurve from segment `first` on in one pass
+     * over the samples. The binned time, flux, flux error and sample counts of segment
+     * `first + k` are written one after another, `nbins` each, from `binned + 4 * k *
+     * nbins`, and its start and end times to `start[k]` and `end[k]`. `bounds` receives
+     * the sample bounds of the segments (see `find_segment_bounds`).
+     */
+    int k;
+    double *b;
+
+    find_segment_bounds(time, nsamples, segsize, first, nsegments, bounds);
+
+    for (k = 0; k < nsegments; k++)
     {
-        /* Take the arithmetic mean. */
-        stime[i] /= samples[i];
-        sflux[i] /= samples[i];
-        sfluxerr[i] /= samples[i];
+        b = binned + 4 * k * nbins;
+        do_bin_range(time, flux, fluxerr, bounds[k], bounds[k + 1], nbins, segsize,
+            first + k, b, b + nbins, b + 2 * nbins, b + 3 * nbins, start + k, end + k);
     }
 
     return 0;
 }
 
 
-int do_bls_pulse_segment(double *time, double *flux, double *fluxerr, double *samples,
-    int nbins, int n, int nbins_min_dur, int nbins_max_dur, int direction, double *srsq, 
-    double *duration, double *depth, double *midtime)
+static void search_events(double *time, double *flux, double *samples, int nbins,
+    double nn, int nbins_min_dur, int nbins_max_dur, int direction, int i, double s,
+    double r, double d, double *srsq, double *duration, double *depth, double *midtime)
 {
     /**
-     * This function takes an array of time, flux, error, and weights (number of samples 
-     * per bin), all of size `nbins`, and writes to the arrays `srsq`, `duration`,
-     * `depth`, and `midtime`, assumed to be pre-allocated and of the same size. There
-     * is no handling of NaN values; they should be filtered out before calling; this
-     * means that `nbins` is actually the number of non-NaN bins.
+     * Searches the events that start at bin `i`, given the flux sum `s`, sample count
+     * `r` and extreme flux `d` of their first `nbins_min_dur` bins, and writes the best
+     * one to element `i` of `srsq`, `duration`, `depth`, and `midtime`.
      */
-   
-    int i, j, k, bestdur;
-    double s, r, d, srsqmax, srsqnew, bestdepth;
-    double nn = (double) n;
 
-    for (i = 0; i < nbins - nbins_min_dur; i++)
+    int j, bestdur;
+    double srsqmax, srsqnew, bestdepth;
+
+    /* minimum possible value is 0 */
+    srsqmax = 0.;
+    bestdur = i;
+    bestdepth = NAN;
+
+    for (j = min(i + nbins_min_dur, nbins); j < min(i + nbins_max_dur + 1, nbins); j++)
     {
-        /* minimum possible value is 0 */
-        srsqmax = 0.;
-        bestdur = i;
-        bestdepth = NAN;
-        
-        if (samples[i] == 0.)
+        /* i and j will always be valid values for i1, i2 as defined in the algorithm
+         * of Kovacs, Zucker, & Mazeh (2002). */
+
+        if (samples[j] == 0.)
             continue;
-        
-        s = 0.;
-        r = 0.;
-        d = flux[i];
-
-        /* Instead of looping from i to j inside the j loop, we can precompute this
-         * part of the sum, which is independent of j. So we avoid having three 
-         * nested loops. */
-        for (k = i; k < i + nbins_min_dur; k++)
+
+        s += flux[j];
+        r += samples[j];
+        d = extreme(d, flux[j], direction);
+
+        srsqnew = (s * s) / (r * (nn - r));
+
+        if ((srsqnew > srsqmax) && (direction * d >= 0))
         {
-            if (samples[k] == 0.)
-                continue;
+            /* We found a better event than previously; overwrite the "best"
+             * parameters. */
+            srsqmax = srsqnew;
+            bestdur = j;        /* this is an index, not a time! */
+            bestdepth = d;      /* this is an absolute level, not relative */
+        }
+    }
+
+    /* Save the best parameters for events starting at this bin. */
+    srsq[i] = srsqmax;
+    duration[i] = time[bestdur] - time[i];
+    depth[i] = bestdepth;
+    midtime[i] = (time[bestdur] + time[i]) / 2.;
+}
+
+
+static void search_start(double *time, double *flux, double *samples, int nbins, double nn,
+    int nbins_min_dur, int nbins_max_dur, int direction, int i, double *srsq,
+    double *duration, double *depth, double *midtime)
+{
+    /**
+     * Searches the events that start at bin `i`, and writes the best one to element `i`
+     * of `srsq`, `duration`, `depth`, and `midtime`. Nothing is written if the bin is
+     * empty.
+     */
 
-            s += flux[k];
-            r += samples[k];
-            d = extreme(d, flux[k], direction);
+    int k;
+    double s, r, d;
+
+    if (samples[i] == 0.)
+        return;
+
+    s = 0.;
+    r = 0.;
+    d = flux[i];
+
+    /* Instead of looping from i to j inside the j loop, we can precompute this
+     * part of the sum, which is independent of j. So we avoid having three
+     * nested loops. */
+    for (k = i; k < i + nbins_min_dur; k++)
+    {
+        if (samples[k] == 0.)
+            continue;
+
+        s += flux[k];
+        r += samples[k];
+        d = extreme(d, flux[k], direction);
+    }
+
+    search_events(time, flux, samples, nbins, nn, nbins_min_dur, nbins_max_dur, direction,
+        i, s, r, d, srsq, duration, depth, midtime);
+}
+
+
+static void search_events_compound(double *time, double *flux, double *samples,
+    int nbins, double nn, int nbins_min_dur, int nbins_max_dur, int i, double s, double r,
+    double d_dip, double d_blip, double *srsq_dip, double *duration_dip, double *depth_dip,
+    double *midtime_dip, double *srsq_blip, double *duration_blip, double *depth_blip,
+    double *midtime_blip)
+{
+    /**
+     * Searches the dips and blips that start at bin `i`, given the flux sum `s`, sample
+     * count `r` and lowest and highest flux `d_dip` and `d_blip` of their first
+     * `nbins_min_dur` bins, and writes the best of each to element `i` of the output
+     * arrays.
+     */
+
+    int j, bestdur_dip, bestdur_blip;
+    double srsqmax_dip, srsqmax_blip, srsqnew, bestdepth_dip, bestdepth_blip;
+
+    /* minimum possible value is 0 */
+    srsqmax_dip = 0.;
+    srsqmax_blip = 0.;
+    bestdur_dip = i;
+    bestdur_blip = i;
+    bestdepth_dip = NAN;
+    bestdepth_blip = NAN;
+
+    for (j = min(i + nbins_min_dur, nbins); j < min(i + nbins_max_dur + 1, nbins); j++)
+    {
+        /* i and j will always be valid values for i1, i2 as defined in the algorithm
+         * of Kovacs, Zucker, & Mazeh (2002). */
+
+        if (samples[j] == 0.)
+            continue;
+
+        s += flux[j];
+        r += samples[j];
+
+        d_dip = min(d_dip, flux[j]);
+        d_blip = max(d_blip, flux[j]);
+
+        srsqnew = (s * s) / (r * (nn - r));
+
+        if ((srsqnew > srsqmax_dip) && (d_dip < 0.))
+        {
+            /* We found a better dip event than previously; overwrite the "best"
+             * parameters. */
+            srsqmax_dip = srsqnew;
+            bestdur_dip = j;             /* this is an index, not a time! */
+            bestdepth_dip = d_dip;       /* this is an absolute level, not relative */
         }
-        
-        for (j = min(i + nbins_min_dur, nbins); j < min(i + nbins_max_dur + 1, nbins); j++)
+
+        if ((srsqnew > srsqmax_blip) && (d_blip > 0.))
         {
-            /* i and j will always be valid values for i1, i2 as defined in the algorithm
-             * of Kovacs, Zucker, & Mazeh (2002). */
+            /* We found a better blip event than previously; overwrite the "best"
+             * parameters. */
+            srsqmax_blip = srsqnew;
+            bestdur_blip = j;           /* this is an index, not a time! */
+            bestdepth_blip = d_blip;    /* this is an absolute level, not relative */
+        }
+    }
+
+    /* Save the best parameters for dip events starting at this bin. */
+    srsq_dip[i] = srsqmax_dip;
+    duration_dip[i] = time[bestdur_dip] - time[i];
+    depth_dip[i] = bestdepth_dip;
+    midtime_dip[i] = (time[bestdur_dip] + time[i]) / 2.;
+
+    /* Save the best parameters for blip events starting at this bin. */
+    srsq_blip[i] = srsqmax_blip;
+    duration_blip[i] = time[bestdur_blip] - time[i];
+    depth_blip[i] = bestdepth_blip;
+    midtime_blip[i] = (time[bestdur_blip] + time[i]) / 2.;
+}
+
+
+static void search_start_compound(double *time, double *flux, double *samples, int nbins,
+    double nn, int nbins_min_dur, int nbins_max_dur, int i, double *srsq_dip,
+    double *duration_dip, double *depth_dip, double *midtime_dip, double *srsq_blip,
+    double *duration_blip, double *depth_blip, double *midtime_blip)
+{
+    /**
+     * Searches the dips and blips that start at bin `i`, and writes the best of each to
+     * element `i` of the output arrays. Nothing is written if the bin is empty.
+     */
 
-            if (samples[j] == 0.)
-                continue;
+    int k;
+    double s, r, d_dip, d_blip;
 
-            s += flux[j];
-            r += samples[j];
-            d = extreme(d, flux[j], direction);
+    if (samples[i] == 0.)
+        return;
 
-            srsqnew = (s * s) / (r * (nn - r));
+    s = 0.;
+    r = 0.;
+    d_dip = flux[i];
+    d_blip = flux[i];
 
-            if ((srsqnew > srsqmax) && (direction * d >= 0))
-            {
-                /* We found a better event than previously; overwrite the "best" 
-                 * parameters. */
-                srsqmax = srsqnew;
-                bestdur = j;        /* this is an index, not a time! */
-                bestdepth = d;      /* this is an absolute level, not relative */
-            }
-        }           
+    /* Instead of looping from i to j inside the j loop, we can precompute this
+     * part of the sum, which is independent of j. So we avoid having three
+     * nested loops. */
+    for (k = i; k < i + nbins_min_dur; k++)
+    {
+        if (samples[k] == 0.)
+            continue;
+
+        s += flux[k];
+        r += samples[k];
 
-        /* Save the best parameters for events starting at each bin. */
-        srsq[i] = srsqmax;
-        duration[i] = time[bestdur] - time[i];
-        depth[i] = bestdepth;
-        midtime[i] = (time[bestdur] + time[i]) / 2.;
+        d_dip = min(d_dip, flux[k]);
+        d_blip = max(d_blip, flux[k]);
     }
 
+    search_events_compound(time, flux, samples, nbins, nn, nbins_min_dur, nbins_max_dur,
+        i, s, r, d_dip, d_blip, srsq_dip, duration_dip, depth_dip, midtime_dip, srsq_blip,
+        duration_blip, depth_blip, midtime_blip);
+}
+
+
+int do_bls_pulse_segment(double *time, double *flux, double *fluxerr, double *samples,
+    int nbins, int n, int nbins_min_dur, int nbins_max_dur, int direction, double *srsq, 
+    double *duration, double *depth, double *midtime)
+{
+    /**
+     * This function takes an array of time, flux, error, and weights (number of samples 
+     * per bin), all of size `nbins`, and writes to the arrays `srsq`, `duration`,
+     * `depth`, and `midtime`, assumed to be pre-allocated and of the same size. There
+     * is no handling of NaN values; they should be filtered out before calling; this
+     * means that `nbins` is actually the number of non-NaN bins.
+     */
+   
+    int i;
+
+    for (i = 0; i < nbins - nbins_min_dur; i++)
+        search_start(time, flux, samples, nbins, (double) n, nbins_min_dur, nbins_max_dur,
+            direction, i, srsq, duration, depth, midtime);
+
     return 0;
 }
 
@@ -163,92 +398,354 @@ int do_bls_pulse_segment_compound(double *time, double *flux, double *fluxerr, d
      * means that `nbins` is actually the number of non-NaN bins.
      */
    
-    int i, j, k, bestdur_dip, bestdur_blip;
-    double s, r, d_dip, d_blip, srsqmax_dip, srsqmax_blip, srsqnew;
-    double bestdepth_dip, bestdepth_blip;
+    int i;
+
+    for (i = 0; i < nbins - nbins_min_dur; i++)
+        search_start_compound(time, flux, samples, nbins, (double) n, nbins_min_dur,
+            nbins_max_dur, i, srsq_dip, duration_dip, depth_dip, midtime_dip, srsq_blip,
+            duration_blip, depth_blip, midtime_blip);
+
+    return 0;
+}
+
+
+static void count_sums(double *samples, int nbins, double *nsum)
+{
+    /**
+     * Writes the sums of the sample counts of the bins before each bin to `nsum`, of size
+     * `nbins + 1`. The counts are whole numbers, so their sums and differences are exact.
+     */
+    int k;
+
+    nsum[0] = 0.;
+
+    for (k = 0; k < nbins; k++)
+        nsum[k + 1] = nsum[k] + samples[k];
+}
+
+
+static double head_sum(double *flux, double *samples, int i, int nbins_min_dur)
+{
+    /**
+     * Returns the sum of the flux of the non-empty bins among the first `nbins_min_dur`
+     * bins from bin `i`, added up in the same order as `search_start`.
+     */
+    int k;
+    double s = 0.;
+
+    for (k = i; k < i + nbins_min_dur; k++)
+    {
+        if (samples[k] == 0.)
+            continue;
+
+        s += flux[k];
+    }
+
+    return s;
+}
+
+
+static void slide_window(double *flux, double *samples, int *deque, int *head, int *tail,
+    int *next, int start, int end, int direction)
+{
+    /**
+     * Moves a monotonic deque of bin indices to the window of bins from `start` up to
+     * `end`. Non-empty bins are pushed from `*next` up to `end`, after dropping the bins
+     * they are at least as extreme as, and bins before `start` are dropped from the front.
+     * The front is then the last of the most extreme bins of the window, which is the
+     * bin that folding `extreme` over the window picks.
+     */
+    for (; *next < end; (*next)++)
+    {
+        if (samples[*next] == 0.)
+            continue;
+
+        while ((*tail > *head) && !better(flux[deque[*tail - 1]], flux[*next], direction))
+            (*tail)--;
+
+        deque[(*tail)++] = *next;
+    }
+
+    while ((*head < *tail) && (deque[*head] < start))
+        (*head)++;
+}
+
+
+int do_bls_pulse_segment_sliding(double *time, double *flux, double *fluxerr,
+    double *samples, int nbins, int n, int nbins_min_dur, int nbins_max_dur, int direction,
+    double *srsq, double *duration, double *depth, double *midtime)
+{
+    /**
+     * Same search as `do_bls_pulse_segment`, which works out the flux sum, sample count
+     * and extreme flux of the first `nbins_min_dur` bins of an event again for every
+     * start bin. Here the sample count comes from prefix sums, and the extreme flux from
+     * a monotonic deque that slides along with the start bin; both are exact. The flux
+     * sum is still added up bin by bin, since a difference of prefix sums would round
+     * differently, so the output is identical to that of `do_bls_pulse_segment`. Below
+     * `SLIDING_MIN_BINS` bins the deque costs more than it saves, and the exhaustive
+     * search is run instead. Returns -1 if the work arrays cannot be allocated.
+     */
+
+    int i, head = 0, tail = 0, next = 0;
     double nn = (double) n;
 
+    if (nbins_min_dur < SLIDING_MIN_BINS)
+        return do_bls_pulse_segment(time, flux, fluxerr, samples, nbins, n, nbins_min_dur,
+            nbins_max_dur, direction, srsq, duration, depth, midtime);
+
+    double *nsum = malloc((nbins + 1) * sizeof(double));
+    int *deque = malloc(nbins * sizeof(int));
+
+    if ((nsum == NULL) || (deque == NULL))
+    {
+        free(nsum);
+        free(deque);
+        return -1;
+    }
+
+    count_sums(samples, nbins, nsum);
+
     for (i = 0; i < nbins - nbins_min_dur; i++)
     {
-        /* minimum possible value is 0 */
-        srsqmax_dip = 0.;
-        srsqmax_blip = 0.;
-        bestdur_dip = i;
-        bestdur_blip = i;
-        bestdepth_dip = NAN;
-        bestdepth_blip = NAN;
-        
+        /* The deque follows the first bins of the event whether or not this one is
+         * searched. */
+        slide_window(flux, samples, deque, &head, &tail, &next, i, i + nbins_min_dur,
+            direction);
+
         if (samples[i] == 0.)
             continue;
-        
-        s = 0.;
-        r = 0.;
-        d_dip = flux[i];
-        d_blip = flux[i];
-
-        /* Instead of looping from i to j inside the j loop, we can precompute this
-         * part of the sum, which is independent of j. So we avoid having three 
-         * nested loops. */
-        for (k = i; k < i + nbins_min_dur; k++)
-        {
-            if (samples[k] == 0.)
-                continue;
 
-            s += flux[k];
-            r += samples[k];
+        search_events(time, flux, samples, nbins, nn, nbins_min_dur, nbins_max_dur,
+            direction, i, head_sum(flux, samples, i, nbins_min_dur),
+            nsum[i + nbins_min_dur] - nsum[i], flux[deque[head]], srsq, duration, depth,
+            midtime);
+    }
 
-            d_dip = min(d_dip, flux[k]);
-            d_blip = max(d_blip, flux[k]);
-        }
-        
-        for (j = min(i + nbins_min_dur, nbins); j < min(i + nbins_max_dur + 1, nbins); j++)
-        {
-            /* i and j will always be valid values for i1, i2 as defined in the algorithm
-             * of Kovacs, Zucker, & Mazeh (2002). */
-
-            if (samples[j] == 0.)
-                continue;
-
-            s += flux[j];
-            r += samples[j];
-
-            d_dip = min(d_dip, flux[j]);
-            d_blip = max(d_blip, flux[j]);
-
-            srsqnew = (s * s) / (r * (nn - r));
-
-            if ((srsqnew > srsqmax_dip) && (d_dip < 0.))
-            {
-                /* We found a better dip event than previously; overwrite the "best" 
-                 * parameters. */
-                srsqmax_dip = srsqnew;
-                bestdur_dip = j;             /* this is an index, not a time! */
-                bestdepth_dip = d_dip;       /* this is an absolute level, not relative */
-            }
-
-            if ((srsqnew > srsqmax_blip) && (d_blip > 0.))
-            {
-                /* We found a better blip event than previously; overwrite the "best"
-                 * parameters. */
-                srsqmax_blip = srsqnew;
-                bestdur_blip = j;           /* this is an index, not a time! */
-                bestdepth_blip = d_blip;    /* this is an absolute level, not relative */
-            }
-        }           
-
-        /* Save the best parameters for dip events starting at each bin. */
-        srsq_dip[i] = srsqmax_dip;
-        duration_dip[i] = time[bestdur_dip] - time[i];
-        depth_dip[i] = bestdepth_dip;
-        midtime_dip[i] = (time[bestdur_dip] + time[i]) / 2.;
-        
-        /* Save the best parameters for blip events starting at each bin. */
-        srsq_blip[i] = srsqmax_blip;
-        duration_blip[i] = time[bestdur_blip] - time[i];
-        depth_blip[i] = bestdepth_blip;
-        midtime_blip[i] = (time[bestdur_blip] + time[i]) / 2.;
+    free(nsum);
+    free(deque);
+    return 0;
+}
+
+
+int do_bls_pulse_segment_compound_sliding(double *time, double *flux, double *fluxerr,
+    double *samples, int nbins, int n, int nbins_min_dur, int nbins_max_dur,
+    double *srsq_dip, double *duration_dip, double *depth_dip, double *midtime_dip,
+    double *srsq_blip, double *duration_blip, double *depth_blip, double *midtime_blip)
+{
+    /**
+     * Same search as `do_bls_pulse_segment_compound`, with prefix sums of the sample
+     * counts and one monotonic deque each for the lowest and the highest flux of the
+     * first bins of an event; see `do_bls_pulse_segment_sliding`. Below
+     * `SLIDING_MIN_BINS_COMPOUND` bins the exhaustive search is run instead. Returns -1
+     * if the work arrays cannot be allocated.
+     */
+
+    int i;
+    int head_dip = 0, tail_dip = 0, next_dip = 0;
+    int head_blip = 0, tail_blip = 0, next_blip = 0;
+    double nn = (double) n;
+
+    if (nbins_min_dur < SLIDING_MIN_BINS_COMPOUND)
+        return do_bls_pulse_segment_compound(time, flux, fluxerr, samples, nbins, n,
+            nbins_min_dur, nbins_max_dur, srsq_dip, duration_dip, depth_dip, midtime_dip,
+            srsq_blip, duration_blip, depth_blip, midtime_blip);
+
+    double *nsum = malloc((nbins + 1) * sizeof(double));
+    int *deque_dip = malloc(2 * nbins * sizeof(int));
+
+    if ((nsum == NULL) || (deque_dip == NULL))
+    {
+        free(nsum);
+        free(deque_dip);
+        return -1;
     }
 
+    int *deque_blip = deque_dip + nbins;
+    count_sums(samples, nbins, nsum);
+
+    for (i = 0; i < nbins - nbins_min_dur; i++)
+    {
+        slide_window(flux, samples, deque_dip, &head_dip, &tail_dip, &next_dip, i,
+            i + nbins_min_dur, -1);
+        slide_window(flux, samples, deque_blip, &head_blip, &tail_blip, &next_blip, i,
+            i + nbins_min_dur, 1);
+
+        if (samples[i] == 0.)
+            continue;
+
+        search_events_compound(time, flux, samples, nbins, nn, nbins_min_dur,
+            nbins_max_dur, i, head_sum(flux, samples, i, nbins_min_dur),
+            nsum[i + nbins_min_dur] - nsum[i], flux[deque_dip[head_dip]],
+            flux[deque_blip[head_blip]], srsq_dip, duration_dip, depth_dip, midtime_dip,
+            srsq_blip, duration_blip, depth_blip, midtime_blip);
+    }
+
+    free(nsum);
+    free(deque_dip);
     return 0;
 }
 
+
+static int compare_candidates(const void *a, const void *b)
+{
+    /* Highest bound first, then lowest bin. */
+    const candidate *x = a, *y = b;
+
+    if (x->bound != y->bound)
+        return x->bound > y->bound ? -1 : 1;
+    return x->bin - y->bin;
+}
+
+
+static int start_bounds(double *flux, double *samples, int nbins, double nn,
+    int nbins_min_dur, int nbins_max_dur, double *work, candidate *candidates)
+{
+    /**
+     * Writes the non-empty start bins and an upper bound of SR^2 over the events that
+     * start at each to `candidates`, highest bound first, and returns their number.
+     * The flux sum of an event lies between minus the sum of the negative fluxes and
+     * the sum of the positive fluxes of the longest event from the same bin, and r (N - r)
+     * is smallest at the shortest or the longest event, so the bound is the larger of
+     * the two sums squared over the smaller of the two products. The sums come from
+     * prefix sums, and are raised by a margin relative to the sum of the absolute flux
+     * of the segment, which covers their rounding errors and those of the sums of the
+     * exhaustive search. A bound that is not finite is never pruned. `work` must hold
+     * `3 * (nbins + 1)` values.
+     */
+    int i, k, jmax, ncandidates = 0;
+    double a, rmin, rmax, den, margin;
+    double *psum = work, *qsum = work + nbins + 1, *nsum = work + 2 * (nbins + 1);
+
+    psum[0] = 0.;
+    qsum[0] = 0.;
+    nsum[0] = 0.;
+
+    for (k = 0; k < nbins; k++)
+    {
+        psum[k + 1] = psum[k] + ((samples[k] != 0.) && (flux[k] > 0.) ? flux[k] : 0.);
+        qsum[k + 1] = qsum[k] + ((samples[k] != 0.) && (flux[k] < 0.) ? -flux[k] : 0.);
+        nsum[k + 1] = nsum[k] + samples[k];
+    }
+
+    margin = BOUND_MARGIN * (psum[nbins] + qsum[nbins]);
+
+    for (i = 0; i < nbins - nbins_min_dur; i++)
+    {
+        if (samples[i] == 0.)
+            continue;
+
+        jmax = min(i + nbins_max_dur, nbins - 1);
+        a = max(psum[jmax + 1] - psum[i], qsum[jmax + 1] - qsum[i]) + margin;
+
+        rmin = nsum[i + nbins_min_dur + 1] - nsum[i];
+        rmax = nsum[jmax + 1] - nsum[i];
+        den = min(rmin * (nn - rmin), rmax * (nn - rmax));
+
+        candidates[ncandidates].bound = (den > 0.) && isfinite(a) ? a * a / den : INFINITY;
+        candidates[ncandidates].bin = i;
+        ncandidates++;
+    }
+
+    qsort(candidates, ncandidates, sizeof(candidate), compare_candidates);
+    return ncandidates;
+}
+
+
+int do_bls_pulse_segment_pruned(double *time, double *flux, double *fluxerr,
+    double *samples, int nbins, int n, int nbins_min_dur, int nbins_max_dur, int direction,
+    double *srsq, double *duration, double *depth, double *midtime)
+{
+    /**
+     * Same search as `do_bls_pulse_segment`, skipping the start bins that cannot hold
+     * the best event of the segment. The start bins are searched in order of their upper
+     * bound of SR^2 (see `start_bounds`), highest first, and the search stops at the
+     * first bound below the best SR^2 found so far; the remaining bins are left as empty
+     * bins are. Searched bins go through the same arithmetic as in the exhaustive
+     * search, and a skipped bin cannot reach the best SR^2, so the best event of the
+     * segment is identical. Returns the number of start bins skipped, or -1 if the work
+     * arrays cannot be allocated.
+     */
+
+    int c, i, ncandidates;
+    double best = 0.;
+
+    double *work = malloc(3 * (nbins + 1) * sizeof(double));
+    candidate *candidates = malloc(nbins * sizeof(candidate));
+
+    if ((work == NULL) || (candidates == NULL))
+    {
+        free(work);
+        free(candidates);
+        return -1;
+    }
+
+    ncandidates = start_bounds(flux, samples, nbins, (double) n, nbins_min_dur,
+        nbins_max_dur, work, candidates);
+
+    for (c = 0; c < ncandidates; c++)
+    {
+        if (candidates[c].bound < best)
+            break;
+
+        i = candidates[c].bin;
+        search_start(time, flux, samples, nbins, (double) n, nbins_min_dur, nbins_max_dur,
+            direction, i, srsq, duration, depth, midtime);
+
+        if (srsq[i] > best)
+            best = srsq[i];
+    }
+
+    free(work);
+    free(candidates);
+    return ncandidates - c;
+}
+
+
+int do_bls_pulse_segment_compound_pruned(double *time, double *flux, double *fluxerr,
+    double *samples, int nbins, int n, int nbins_min_dur, int nbins_max_dur,
+    double *srsq_dip, double *duration_dip, double *depth_dip, double *midtime_dip,
+    double *srsq_blip, double *duration_blip, double *depth_blip, double *midtime_blip)
+{
+    /**
+     * Same search as `do_bls_pulse_segment_compound`, pruned as in
+     * `do_bls_pulse_segment_pruned`; a start bin is skipped once its bound is below both
+     * the best dip and the best blip found so far. Returns the number of start bins
+     * skipped, or -1 if the work arrays cannot be allocated.
+     */
+
+    int c, i, ncandidates;
+    double best_dip = 0., best_blip = 0.;
+
+    double *work = malloc(3 * (nbins + 1) * sizeof(double));
+    candidate *candidates = malloc(nbins * sizeof(candidate));
+
+    if ((work == NULL) || (candidates == NULL))
+    {
+        free(work);
+        free(candidates);
+        return -1;
+    }
+
+    ncandidates = start_bounds(flux, samples, nbins, (double) n, nbins_min_dur,
+        nbins_max_dur, work, candidates);
+
+    for (c = 0; c < ncandidates; c++)
+    {
+        if ((candidates[c].bound < best_dip) && (candidates[c].bound < best_blip))
+            break;
+
+        i = candidates[c].bin;
+        search_start_compound(time, flux, samples, nbins, (double) n, nbins_min_dur,
+            nbins_max_dur, i, srsq_dip, duration_dip, depth_dip, midtime_dip, srsq_blip,
+            duration_blip, depth_blip, midtime_blip);
+
+        if (srsq_dip[i] > best_dip)
+            best_dip = srsq_dip[i];
+        if (srsq_blip[i] > best_blip)
+            best_blip = srsq_blip[i];
+    }
+
+    free(work);
+    free(candidates);
+    return ncandidates - c;
+}
@@ -8,5 +8,6 @@ import numpy as np
 
 setup(cmdclass = {'build_ext': build_ext}, ext_modules =
     [Extension('bls_pulse_cython', sources=['bls_pulse_cython.pyx','bls_pulse_extern.c'],
-    include_dirs=[np.get_include()])])
+    include_dirs=[np.get_include()], extra_compile_args=['-fopenmp'],
+    extra_link_args=['-fopenmp'])])
 
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+
+'''
+Cost model of the BLS pulse search, used to balance work before any data is read. The
+search of a target runs segment by segment; per segment it bins and detrends the data
+and then tries every transit duration from each occupied bin, so its run time is about
+
+    nsegments * (SEGMENT_COST + filled * (BIN_COST + durations * PAIR_COST))
+
+where ``filled`` is the number of occupied bins per segment, at most ``nbins``, and
+``durations`` the number of trial durations in bins. Reading and binning the samples
+themselves is negligible in comparison. The number of samples and the time span of a
+target are estimated from cheap metadata: the cadence and number of quarters of the
+requests, or the file sizes in a :class:`manifest.Manifest` of the data tree. Costs are
+in seconds on the machine the constants were measured on.
+
+Two uses are provided: :func:`longest_first` orders targets for local execution so that
+the most expensive ones start first, and :func:`partition_labels` with
+:func:`sharding.assign_by_cost` balances the targets over the reducers of a Hadoop job.
+Hadoop's ``KeyFieldBasedPartitioner`` sends a record to the reducer given by a hash of
+the selected key fields; :func:`partition_labels` finds one label per reducer that hashes
+to that reducer, so a record whose key starts with the label of its assigned reducer is
+sent exactly there.
+'''
+
+import numpy as np
+from quarters import LONG_QUARTER_PREFIXES
+
+# Measured costs (seconds) of the parts of the search of one segment.
+SEGMENT_COST = 6.e-4
+BIN_COST = 4.e-7
+PAIR_COST = 4.4e-9
+
+# Samples per day of each cadence.
+SAMPLES_PER_DAY = {'llc':48.94, 'slc':1471.}
+
+# Approximate length of each quarter (days); quarters not listed are about 90 days long.
+QUARTER_DAYS = {'0':9.7, '1':33.5, '17':31.8}
+DEFAULT_QUARTER_DAYS = 89.
+
+# Layout of a lightcurve FITS file, to derive the number of samples from its size.
+FITS_HEADER_BYTES = 28800
+FITS_ROW_BYTES = 100
+
+# Hadoop's partitioner on the first field of keys separated by '/'.
+PARTITIONER = 'org.apache.hadoop.mapred.lib.KeyFieldBasedPartitioner'
+PARTITIONER_JOBCONF = {'mapreduce.map.output.key.field.separator':'/',
+    'mapreduce.partition.keypartitioner.options':'-k1,1'}
+
+
+def search_cost(nsamples, ndays, options):
+    '''
+    Returns the estimated run time of the search of one lightcurve.
+
+    :param nsamples: Number of samples
+    :type nsamples: float
+    :param ndays: Time span of the lightcurve (days)
+    :type ndays: float
+    :param options: Search options, as returned by :func:`drive_bls_pulse.read_options`
+    :type options: dict
+
+    :rtype: float
+    '''
+    segsize, nbins = options['segment'], options['nbins']
+
+    nsegments = np.floor(ndays / segsize) + 1
+    filled = min(nbins, nsamples / nsegments)
+
+    # Trial durations, as bls_pulse_cython converts them to bins.
+    nbins_min_dur = max(np.floor(options['mindur'] / segsize * nbins), 1)
+    nbins_max_dur = np.ceil(options['maxdur'] / segsize * nbins)
+    durations = max(min(nbins_max_dur + 1, nbins) - nbins_min_dur, 0)
+
+    return float(nsegments * (SEGMENT_COST + filled * (BIN_COST + durations * PAIR_COST)))
+
+
+def target_size(requests, manifest=None):
+    '''
+    Returns the estimated number of samples and time span (days) of a target. With a
+    manifest, the samples are counted from the sizes of the files on disk and the
+    quarter wildcard selects the quarters present; otherwise every requested quarter is
+    assumed to be complete.
+
+    :param requests: Requests of KIC ID, quarter and cadence of one target
+    :type requests: list
+    :param manifest: Manifest of the data tree
+    :type manifest: manifest.Manifest
+
+    :rtype: tuple
+    '''
+    nsamples = 0.
+    ndays = 0.
+
+    for kepler_id, quarter, suffix in requests:
+        kepler_id = "%09d" % int(kepler_id)
+        per_day = SAMPLES_PER_DAY.get(suffix, SAMPLES_PER_DAY['llc'])
+
+        if manifest is not None:
+            if quarter == '*':
+                quarters = manifest.quarters(kepler_id, suffix)
+            else:
+                quarters = [str(int(quarter))]
+
+            for q in quarters:
+                for _, size in manifest.files.get(kepler_id, {}).get(suffix, {}).get(q,
+                []):
+                    n = max(size - FITS_HEADER_BYTES, 0) / float(FITS_ROW_BYTES)
+                    nsamples += n
+                    ndays += n / per_day
+        else:
+            quarters = sorted(LONG_QUARTER_PREFIXES, key=int) if quarter == '*' else \
+                [str(int(quarter))]
+
+            for q in quarters:
+                days = QUARTER_DAYS.get(q, DEFAULT_QUARTER_DAYS)
+                nsamples += days * per_day
+                ndays += days
+
+    return nsamples, ndays
+
+
+def target_cost(requests, options, manifest=None):
+    '''
+    Returns the estimated run time of the search of a target.
+
+    :param requests: Requests of KIC ID, quarter and cadence of one target
+    :type requests: list
+    :param options: Search options, as returned by :func:`drive_bls_pulse.read_options`
+    :type options: dict
+    :param manifest: Manifest of the data tree
+    :type manifest: manifest.Manifest
+
+    :rtype: float
+    '''
+    nsamples, ndays = target_size(requests, manifest)
+    return search_cost(nsamples, ndays, options) if nsamples > 0 else 0.
+
+
+def longest_first(tasks, options, manifest=None):
+    '''
+    Returns the targets sorted by decreasing estimated cost. Targets of equal cost keep
+    their order.
+
+    :param tasks: Targets, each a list of requests, as returned by
+        :func:`local_runner.group_requests`
+    :type tasks: list
+    :param options: Search options, as returned by :func:`drive_bls_pulse.read_options`
+    :type options: dict
+    :param manifest: Manifest of the data tree
+    :type manifest: manifest.Manifest
+
+    :rtype: list
+    '''
+    costs = [target_cost(task, options, manifest) for task in tasks]
+    order = sorted(xrange(len(tasks)), key=lambda i: -costs[i])
+    return [tasks[i] for i in order]
+
+
+def java_hash(s):
+    '''
+    Returns the hash Hadoop's ``KeyFieldBasedPartitioner`` computes of the given key
+    field.
+
+    :param s: Key field
+    :type s: str
+
+    :rtype: int
+    '''
+    h = 0
+    for c in s:
+        b = ord(c)
+        h = (31 * h + (b - 256 if b > 127 else b)) & 0xffffffff
+
+    return h - 0x100000000 if h > 0x7fffffff else h
+
+
+def partition_of(label, nreducers):
+    '''
+    Returns the reducer Hadoop's ``KeyFieldBasedPartitioner`` sends a key starting with
+    the given label to.
+
+    :param label: First key field
+    :type label: str
+    :param nreducers: Number of reducers
+    :type nreducers: int
+
+    :rtype: int
+    '''
+    return (java_hash(label) & 0x7fffffff) % nreducers
+
+
+def partition_labels(nreducers):
+    '''
+    Returns a list of ``nreducers`` labels, such that the label at index ``i`` is
+    partitioned to reducer ``i``.
+
+    :param nreducers: Number of reducers
+    :type nreducers: int
+
+    :rtype: list
+    '''
+    labels = [None] * nreducers
+    missing = nreducers
+    n = 0
+
+    while missing:
+        label = 'r%d' % n
+        i = partition_of(label, nreducers)
+        if labels[i] is None:
+            labels[i] = label
+            missing -= 1
+        n += 1
+
+    return labels
@@ -2,33 +2,44 @@
 # -*- coding: utf-8 -*-
 
 import sys
-import pstats
-import cProfile
 import logging
 import numpy as np
+from itertools import islice
 from utils import read_mapper_output, encode_array
+from journal import Journal, param_hash, read_journal, compact
 #from bls_pulse_python import bls_pulse as bls_pulse_python
 #from bls_pulse_vec import bls_pulse as bls_pulse_vec
-from bls_pulse_cython import bls_pulse as bls_pulse_cython
 from argparse import ArgumentParser
-from configparser import SafeConfigParser, NoOptionError
 
 # Basic logging configuration.
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# This is a global list of default values that will be used by the argument parser
+# and the configuration parser.
+DEFAULTS = {'min_duration':'0.0416667', 'max_duration':'0.5', 'n_bins':'100',
+    'direction':'0', 'mode':'vec', 'print_format':'encoded', 'verbose':'0', 'profiling':'0',
+    'threads':'1', 'kernel':'exhaustive'}
 
-def __init_parser(defaults):
+# Search kernels of the cython mode (see bls_pulse_cython.KERNELS).
+KERNELS = ['exhaustive', 'sliding', 'pruned']
+
+
+def init_parser(defaults=DEFAULTS, parser=None):
     '''
-    Set up an argument parser for all possible command line options. Returns the
-    parser object.
+    Set up an argument parser for all possible command line options, or add them to the
+    given parser. Returns the parser object.
 
     :param defaults: Default values of each parameter
     :type defaults: dict
+    :param parser: Parser to add the options to
+    :type parser: argparse.ArgumentParser
 
     :rtype: argparse.ArgumentParser
     '''
-    parser = ArgumentParser()
+    if parser is None:
+        parser = ArgumentParser()
+
     parser.add_argument('-c', '--config', action='store', type=str, dest='config',
         help='Configuration file to read. Configuration supersedes command line arguments.')
     parser.add_argument('-p', '--segment', action='store', type=float, dest='segment',
@@ -48,6 +59,16 @@ def __init_parser(defaults):
     parser.add_argument('--mode', action='store', type=str, dest='mode',
         default=defaults['mode'], help='[Optional] Implementation to use; python, '
         'vec, or cython.')
+    parser.add_argument('--search-threads', action='store', type=int, dest='search_threads',
+        default=int(defaults['threads']), help='[Optional] Number of threads to search '
+        'the segments of a lightcurve on; cython mode only.')
+    parser.add_argument('--kernel', action='store', type=str, dest='kernel',
+        default=defaults['kernel'], help='[Optional] Search kernel; exhaustive, '
+        'sliding, which tracks the sample count and extreme flux of the shortest event '
+        'across start bins and is faster for minimum durations of 12 bins or more (100 '
+        'for --direction 2), running the exhaustive search below that, or pruned, which '
+        'skips the start bins that cannot beat the best event. All give the same output. '
+        'Cython mode only.')
     parser.add_argument('-f', '--printformat', action='store', type=str, dest='fmt',
         default=defaults['print_format'], help='[Optional] Format of string printed to '
         'screen. Options are \'encoded\' (base-64 binary) or \'normal\' (human-readable '
@@ -60,7 +81,7 @@ def __init_parser(defaults):
     return parser
 
 
-def __check_args(segment, mindur, maxdur, nbins, direction):
+def __check_args(segment, mindur, maxdur, nbins, direction, nthreads, kernel):
     '''
     Sanity-checks the input arguments; raises ValueError if any checks fail.
 
@@ -75,6 +96,10 @@ def __check_args(segment, mindur, maxdur, nbins, direction):
     :param direction: Signal direction to accept; -1 for dips, +1 for blips, 0 for best,
         or 2 for best dip and blip
     :type direction: int
+    :param nthreads: Number of threads to search on
+    :type nthreads: int
+    :param kernel: Search kernel
+    :type kernel: str
     '''
     if segment <= 0.:
         raise ValueError('Segment size must be > 0.')
@@ -88,147 +113,353 @@ def __check_args(segment, mindur, maxdur, nbins, direction):
         raise ValueError('Number of bins must be > 0.')
     if direction not in [-1, 0, 1, 2]:
         raise ValueError('%d is not a valid value for direction.' % direction)
+    if nthreads <= 0:
+        raise ValueError('Number of threads must be > 0.')
+    if kernel not in KERNELS:
+        raise ValueError('%s is not a valid search kernel.' % kernel)
 
 
-def main():
-    '''
-    Main function for this module. Parses all command line arguments, reads in data
-    from stdin, and sends it to the proper BLS algorithm.
+def read_options(parser, args, defaults=DEFAULTS):
     '''
-    # This is a global list of default values that will be used by the argument parser
-    # and the configuration parser.
-    defaults = {'min_duration':'0.0416667', 'max_duration':'0.5', 'n_bins':'100',
-        'direction':'0', 'mode':'vec', 'print_format':'encoded', 'verbose':'0', 'profiling':'0'}
+    Returns the search options from the parsed command line arguments, or from the
+    configuration file if one was given. Exits through the parser if no trial segment is
+    given, and raises ValueError if the options fail the sanity checks.
 
-    # Set up the parser for command line arguments and read them.
-    parser = __init_parser(defaults)
-    args = parser.parse_args()
+    :param parser: Parser the arguments were read with
+    :type parser: argparse.ArgumentParser
+    :param args: Parsed command line arguments
+    :type args: argparse.Namespace
+    :param defaults: Default values of each parameter
+    :type defaults: dict
 
+    :rtype: dict
+    '''
     if not args.config:
         # No configuration file specified -- read in command line arguments.
         if not args.segment:
             parser.error('No trial segment specified and no configuration file given.')
 
-        segment = args.segment
-        mindur = args.mindur
-        maxdur = args.maxdur
-        nbins = args.nbins
-        direction = args.direction
-        mode = args.mode
-        fmt = args.fmt
-        verbose = args.verbose
-        profile = args.profile
+        options = dict(segment=args.segment, mindur=args.mindur, maxdur=args.maxdur,
+            nbins=args.nbins, direction=args.direction, mode=args.mode, fmt=args.fmt,
+            verbose=args.verbose, profile=args.profile, nthreads=args.search_threads,
+            kernel=args.kernel)
     else:
         # Configuration file was given; read in that instead.
+        from configparser import SafeConfigParser
+
         cp = SafeConfigParser(defaults)
         cp.read(args.config)
 
-        segment = cp.getfloat('DEFAULT', 'segment')
-        mindur = cp.getfloat('DEFAULT', 'min_duration')
-        maxdur = cp.getfloat('DEFAULT', 'max_duration')
-        nbins = cp.getint('DEFAULT', 'n_bins')
-        direction = cp.getint('DEFAULT', 'direction')
-        mode = cp.get('DEFAULT', 'mode')
-        fmt = cp.get('DEFAULT', 'print_format')
-        verbose = cp.getboolean('DEFAULT', 'verbose')
-        profile = cp.getboolean('DEFAULT', 'profiling')
+        options = dict(segment=cp.getfloat('DEFAULT', 'segment'),
+            mindur=cp.getfloat('DEFAULT', 'min_duration'),
+            maxdur=cp.getfloat('DEFAULT', 'max_duration'),
+            nbins=cp.getint('DEFAULT', 'n_bins'),
+            direction=cp.getint('DEFAULT', 'direction'),
+            mode=cp.get('DEFAULT', 'mode'),
+            fmt=cp.get('DEFAULT', 'print_format'),
+            verbose=cp.getboolean('DEFAULT', 'verbose'),
+            profile=cp.getboolean('DEFAULT', 'profiling'),
+            nthreads=cp.getint('DEFAULT', 'threads'),
+            kernel=cp.get('DEFAULT', 'kernel'))
 
     # Perform any sanity-checking on the arguments.
-    __check_args(segment, mindur, maxdur, nbins, direction)
-
-    # Send the data to the algorithm.
-    for k, q, time, flux, fluxerr in read_mapper_output(sys.stdin):
-        # Extract the array columns.
-        time = np.array(time, dtype='float64')
-        flux = np.array(flux, dtype='float64')
-        fluxerr = np.array(fluxerr, dtype='float64')
-
-        if profile:
-            # Turn on profiling.
-            pr = cProfile.Profile()
-            pr.enable()
-
-        if mode == 'python':
-            raise NotImplementedError
-            out = bls_pulse_python(time, flux, fluxerr, nbins, segment, mindur, maxdur,
-                direction=direction)
-        elif mode == 'vec':
-            raise NotImplementedError
-            out = bls_pulse_vec(time, flux, fluxerr, nbins, segment, mindur, maxdur,
-                direction=direction)
-        elif mode == 'cython':
-            out = bls_pulse_cython(time, flux, fluxerr, nbins, segment, mindur, maxdur,
-                direction=direction)
-        else:
-            raise ValueError('Invalid mode: %s' % mode)
-
-        if profile:
-            # Turn off profiling.
-            pr.disable()
-            ps = pstats.Stats(pr, stream=sys.stderr).sort_stats('time')
-            ps.print_stats()
-
-        if direction == 2:
-            srsq_dip = out['srsq_dip']
-            duration_dip = out['duration_dip']
-            depth_dip = out['depth_dip']
-            midtime_dip = out['midtime_dip']
-            srsq_blip = out['srsq_blip']
-            duration_blip = out['duration_blip']
-            depth_blip = out['depth_blip']
-            midtime_blip = out['midtime_blip']
-            segstart = out['segstart']
-            segend = out['segend']
-
-            # Print output.
-            if fmt == 'encoded':
-                print "\t".join([k, q, encode_array(segstart), encode_array(segend), encode_array(srsq_dip),
-                    encode_array(duration_dip), encode_array(depth_dip), encode_array(midtime_dip),
-                    encode_array(srsq_blip), encode_array(duration_blip),
-                    encode_array(depth_blip), encode_array(midtime_blip)])
-            elif fmt == 'normal':
-                print "-" * 120
-                print "Kepler " + k
-                print "Quarters: " + q
-                print "-" * 120
-                print '{0: <7s} {1: <13s} {2: <13s} {3: <13s} {4: <13s} {5: <13s} {6: <13s} {7: <13s} ' \
-                    '{8: <13s}'.format('Segment', 'Dip SR^2', 'Dip dur.', 'Dip depth', 'Dip mid.',
-                    'Blip SR^2', 'Blip dur.', 'Blip depth', 'Blip mid.')
-                for i in xrange(len(srsq_dip)):
-                    print '{0: <7d} {1: <13.6f} {2: <13.6f} {3: <13.6f} {4: <13.6f} ' \
-                        '{5: <13.6f} {6: <13.6f} {7: <13.6f} {8: <13.6f}'.format(i,
-                        srsq_dip[i], duration_dip[i], depth_dip[i], midtime_dip[i],
-                        srsq_blip[i], duration_blip[i], depth_blip[i], midtime_blip[i])
-                print "-" * 120
-                print
-                print
+    __check_args(options['segment'], options['mindur'], options['maxdur'],
+        options['nbins'], options['direction'], options['nthreads'], options['kernel'])
+
+    return options
+
+
+def run_bls(time, flux, fluxerr, options, epoch=None, first_segment=0,
+segment_count=None):
+    '''
+    Runs the BLS pulse search selected by ``options['mode']`` on one lightcurve and
+    returns its output dictionary. If ``options['profile']`` is set, a speed profile of
+    the search is written to STDERR. The time array must be writable because the time
+    offset is removed in place. The segments to search can be given as for
+    :func:`bls_pulse_cython.bls_pulse`, to search one block of a longer lightcurve (see
+    :mod:`blocks`); only the cython mode supports this. The cython mode searches on
+    ``options['nthreads']`` threads, one if not given, with the kernel
+    ``options['kernel']``, the exhaustive search if not given.
+
+    :param time: Array of times
+    :type time: numpy.ndarray
+    :param flux: Array of fluxes
+    :type flux: numpy.ndarray
+    :param fluxerr: Array of flux errors
+    :type fluxerr: numpy.ndarray
+    :param options: Search options, as returned by :func:`read_options`
+    :type options: dict
+    :param epoch: Start time of the first segment of the whole lightcurve
+    :type epoch: float
+    :param first_segment: Index of the first segment to search
+    :type first_segment: int
+    :param segment_count: Number of segments to search
+    :type segment_count: int
+
+    :rtype: dict
+    '''
+    mode = options['mode']
+    args = (options['nbins'], options['segment'], options['mindur'], options['maxdur'])
+
+    if options['profile']:
+        # Turn on profiling.
+        import cProfile
+
+        pr = cProfile.Profile()
+        pr.enable()
+
+    if mode == 'python':
+        raise NotImplementedError
+        out = bls_pulse_python(time, flux, fluxerr, *args,
+            direction=options['direction'])
+    elif mode == 'vec':
+        raise NotImplementedError
+        out = bls_pulse_vec(time, flux, fluxerr, *args, direction=options['direction'])
+    elif mode == 'cython':
+        from bls_pulse_cython import bls_pulse as bls_pulse_cython
+        out = bls_pulse_cython(time, flux, fluxerr, *args,
+            direction=options['direction'], epoch=epoch, first_segment=first_segment,
+            segment_count=segment_count, nthreads=options.get('nthreads', 1),
+            kernel=options.get('kernel', 'exhaustive'))
+    else:
+        raise ValueError('Invalid mode: %s' % mode)
+
+    if options['profile']:
+        # Turn off profiling.
+        pr.disable()
+        import pstats
+
+        ps = pstats.Stats(pr, stream=sys.stderr).sort_stats('time')
+        ps.print_stats()
+
+    return out
+
+
+def run_bls_batch(lightcurves, options):
+    '''
+    Runs the BLS pulse search on several lightcurves and returns the list of their output
+    dictionaries, in order. The cython mode packs the lightcurves into one set of arrays
+    and searches all of their segments in one call (see
+    :func:`bls_pulse_cython.bls_pulse_batch`), which saves the per-call overhead on
+    short lightcurves; the output of each lightcurve is identical to that of
+    :func:`run_bls`. Other modes search the lightcurves one by one. If
+    ``options['profile']`` is set, a speed profile of the search is written to STDERR.
+
+    :param lightcurves: Tuples of the time, flux and flux error arrays of each lightcurve
+    :type lightcurves: list
+    :param options: Search options, as returned by :func:`read_options`
+    :type options: dict
+
+    :rtype: list
+    '''
+    if options['mode'] != 'cython':
+        return [run_bls(time, flux, fluxerr, options) for time, flux, fluxerr in
+            lightcurves]
+
+    from bls_pulse_cython import bls_pulse_batch
+
+    if options['profile']:
+        # Turn on profiling.
+        import cProfile
+
+        pr = cProfile.Profile()
+        pr.enable()
+
+    offsets = np.cumsum([0] + [len(lc[0]) for lc in lightcurves])
+    packed = bls_pulse_batch(np.concatenate([lc[0] for lc in lightcurves]),
+        np.concatenate([lc[1] for lc in lightcurves]),
+        np.concatenate([lc[2] for lc in lightcurves]), offsets, options['nbins'],
+        options['segment'], options['mindur'], options['maxdur'],
+        direction=options['direction'], nthreads=options.get('nthreads', 1),
+        kernel=options.get('kernel', 'exhaustive'))
+
+    if options['profile']:
+        # Turn off profiling.
+        pr.disable()
+        import pstats
+
+        ps = pstats.Stats(pr, stream=sys.stderr).sort_stats('time')
+        ps.print_stats()
+
+    segments = packed.pop('offsets')
+    return [dict([(name, arr[a:b]) for name, arr in packed.items()]) for a, b in
+        zip(segments[:-1], segments[1:])]
+
+
+def format_output(k, q, out, direction, fmt):
+    '''
+    Formats the search output of one target for printing. Returns None if ``fmt`` is
+    neither 'encoded' nor 'normal'.
+
+    :param k: KIC ID
+    :type k: str
+    :param q: Quarters, as listed by the join step
+    :type q: str
+    :param out: Output of the BLS pulse search
+    :type out: dict
+    :param direction: Signal direction the search was run with
+    :type direction: int
+    :param fmt: Output format; 'encoded' or 'normal'
+    :type fmt: str
+
+    :rtype: str
+    '''
+    lines = []
+
+    if direction == 2:
+        srsq_dip = out['srsq_dip']
+        duration_dip = out['duration_dip']
+        depth_dip = out['depth_dip']
+        midtime_dip = out['midtime_dip']
+        srsq_blip = out['srsq_blip']
+        duration_blip = out['duration_blip']
+        depth_blip = out['depth_blip']
+        midtime_blip = out['midtime_blip']
+        segstart = out['segstart']
+        segend = out['segend']
+
+        if fmt == 'encoded':
+            lines.append("\t".join([k, q, encode_array(segstart), encode_array(segend),
+                encode_array(srsq_dip), encode_array(duration_dip), encode_array(depth_dip),
+                encode_array(midtime_dip), encode_array(srsq_blip),
+                encode_array(duration_blip), encode_array(depth_blip),
+                encode_array(midtime_blip)]))
+        elif fmt == 'normal':
+            lines.append("-" * 120)
+            lines.append("Kepler " + k)
+            lines.append("Quarters: " + q)
+            lines.append("-" * 120)
+            lines.append('{0: <7s} {1: <13s} {2: <13s} {3: <13s} {4: <13s} {5: <13s} '
+                '{6: <13s} {7: <13s} {8: <13s}'.format('Segment', 'Dip SR^2', 'Dip dur.',
+                'Dip depth', 'Dip mid.', 'Blip SR^2', 'Blip dur.', 'Blip depth',
+                'Blip mid.'))
+            for i in xrange(len(srsq_dip)):
+                lines.append('{0: <7d} {1: <13.6f} {2: <13.6f} {3: <13.6f} {4: <13.6f} '
+                    '{5: <13.6f} {6: <13.6f} {7: <13.6f} {8: <13.6f}'.format(i,
+                    srsq_dip[i], duration_dip[i], depth_dip[i], midtime_dip[i],
+                    srsq_blip[i], duration_blip[i], depth_blip[i], midtime_blip[i]))
+            lines.extend(["-" * 120, "", ""])
+    else:
+        srsq = out['srsq']
+        duration = out['duration']
+        depth = out['depth']
+        midtime = out['midtime']
+        segstart = out['segstart']
+        segend = out['segend']
+
+        if fmt == 'encoded':
+            lines.append("\t".join([k, q, encode_array(segstart), encode_array(segend),
+                encode_array(srsq), encode_array(duration), encode_array(depth),
+                encode_array(midtime)]))
+        elif fmt == 'normal':
+            lines.append("-" * 80)
+            lines.append("Kepler " + k)
+            lines.append("Quarters: " + q)
+            lines.append("-" * 80)
+            lines.append('{0: <7s} {1: <13s} {2: <10s} {3: <9s} {4: <13s}'.format(
+                'Segment', 'SR^2', 'Duration', 'Depth', 'Midtime'))
+            for i in xrange(len(srsq)):
+                lines.append('{0: <7d} {1: <13.6f} {2: <10.6f} {3: <9.6f} '
+                    '{4: <13.6f}'.format(i, srsq[i], duration[i], depth[i], midtime[i]))
+            lines.extend(["-" * 80, "", ""])
+
+    if not lines:
+        return None
+
+    return "\n".join(lines)
+
+
+def main():
+    '''
+    Main function for this module. Parses all command line arguments, reads in data
+    from stdin, and sends it to the proper BLS algorithm.
+    '''
+    # Set up the parser for command line arguments and read them.
+    parser = init_parser(DEFAULTS)
+    parser.add_argument('-o', '--output', action='store', type=str, dest='output',
+        default=None, help='[Optional] File to write the output to instead of STDOUT.')
+    parser.add_argument('--journal', action='store', type=str, dest='journal',
+        default=None, help='[Optional] Record every finished target in this journal, so '
+        'that an interrupted run can be resumed. Requires --output.')
+    parser.add_argument('--resume', action='store_true', dest='resume', default=False,
+        help='[Optional] Resume an interrupted run: repair the output, then skip the '
+        'targets in the journal. The search parameters must be those of the '
+        'interrupted run.')
+    parser.add_argument('--batch-size', action='store', type=int, dest='batch_size',
+        default=1, help='[Optional] Number of lightcurves to search in one call; cython '
+        'mode only. Larger batches save the per-call overhead on short lightcurves.')
+    args = parser.parse_args()
+    options = read_options(parser, args, DEFAULTS)
+
+    if args.journal and not args.output:
+        parser.error('A journal requires an output file.')
+    if args.resume and not args.journal:
+        parser.error('Cannot resume without a journal.')
+    if args.batch_size <= 0:
+        parser.error('Batch size must be > 0.')
+
+    done = set()
+    offset = 0
+
+    if args.resume:
+        # Truncate the output to the last journaled target, and skip everything that was
+        # done. Output of other parameters cannot be continued, so refuse to resume
+        # before the output is touched.
+        phash = param_hash(options)
+        if any([h != phash for _, _, h, _ in read_journal(args.journal)]):
+            parser.error('The journal was written with other search parameters; '
+                'cannot resume with these.')
+        records = compact(args.journal, args.output)
+        done = set([(k, q) for k, q, _, _ in records])
+        offset = records[-1][3] if records else 0
+        output = open(args.output, 'ab')
+        journal = Journal(args.journal, output)
+    elif args.output:
+        output = open(args.output, 'wb')
+        if args.journal:
+            phash = param_hash(options)
+            open(args.journal, 'wb').close()
+            journal = Journal(args.journal, output)
         else:
-            srsq = out['srsq']
-            duration = out['duration']
-            depth = out['depth']
-            midtime = out['midtime']
-            segstart = out['segstart']
-            segend = out['segend']
-
-            # Print output.
-            if fmt == 'encoded':
-                print "\t".join([k, q, encode_array(segstart), encode_array(segend), encode_array(srsq),
-                    encode_array(duration), encode_array(depth), encode_array(midtime)])
-            elif fmt == 'normal':
-                print "-" * 80
-                print "Kepler " + k
-                print "Quarters: " + q
-                print "-" * 80
-                print '{0: <7s} {1: <13s} {2: <10s} {3: <9s} {4: <13s}'.format('Segment',
-                    'SR^2', 'Duration', 'Depth', 'Midtime')
-                for i in xrange(len(srsq)):
-                    print '{0: <7d} {1: <13.6f} {2: <10.6f} {3: <9.6f} {4: <13.6f}'.format(i,
-                        srsq[i], duration[i], depth[i], midtime[i])
-                print "-" * 80
-                print
-                print
+            journal = None
+    else:
+        output = sys.stdout
+        journal = None
+
+    # Skip finished targets before their arrays are decoded.
+    lines = (line for line in sys.stdin if tuple(line.split('\t', 2)[:2]) not in done)
+
+    # Send the data to the algorithm. The arrays must be writable because the time offset
+    # is removed in place.
+    targets = read_mapper_output(lines, writable=True)
+
+    try:
+        while True:
+            batch = list(islice(targets, args.batch_size))
+            if not batch:
+                break
+
+            if args.batch_size == 1:
+                outs = [run_bls(time, flux, fluxerr, options) for _, _, time, flux,
+                    fluxerr in batch]
+            else:
+                outs = run_bls_batch([target[2:] for target in batch], options)
+
+            for (k, q, _, _, _), out in zip(batch, outs):
+                # Print output.
+                text = format_output(k, q, out, options['direction'], options['fmt'])
+                if text is not None:
+                    output.write(text + '\n')
+                    offset += len(text) + 1
+
+                if journal is not None:
+                    journal.record(k, q, phash, offset)
+    finally:
+        if journal is not None:
+            journal.close()
+        if output is not sys.stdout:
+            output.close()
 
 
 if __name__ == '__main__':
     main()
-
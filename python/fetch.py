@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+'''
+Concurrent HTTP downloads for the MAST loader. :class:`HTTPFetcher` keeps persistent
+(keep-alive) connections per host, limits the number of simultaneous requests to each
+host, follows redirects, and retries failed requests with exponential backoff. Use
+:func:`utils.ordered_map` to run downloads on a thread pool while still emitting results
+in input order.
+'''
+
+import time
+import socket
+import httplib
+import logging
+import threading
+from Queue import Queue, Empty
+from urlparse import urlsplit, urljoin
+
+# Basic logging configuration.
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Status codes of the redirects that are followed.
+REDIRECTS = [301, 302, 303, 307, 308]
+
+
+class HTTPFetcher(object):
+    '''
+    Thread-safe HTTP GET client with a pool of persistent connections per host.
+    '''
+
+    def __init__(self, per_host=4, retries=3, backoff=0.5, timeout=60., max_redirects=10):
+        '''
+        :param per_host: Maximum number of simultaneous requests to a single host
+        :type per_host: int
+        :param retries: Number of times a failed request is retried
+        :type retries: int
+        :param backoff: Delay before the first retry in seconds; doubled for each retry
+        :type backoff: float
+        :param timeout: Socket timeout in seconds
+        :type timeout: float
+        :param max_redirects: Maximum number of redirects followed for one request
+        :type max_redirects: int
+        '''
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+
+        self.__lock = threading.Lock()
+        self.__idle = {}
+        self.__slots = {}
+
+
+    def get(self, uri, headers=None):
+        '''
+        Downloads the given URI and returns the status code, the response headers and
+        the body. Responses with status 200 or 304 are returned; redirects are followed,
+        up to ``max_redirects`` of them, server errors and connection failures are
+        retried, and anything else raises RuntimeError.
+
+        :param uri: URL to download
+        :type uri: str
+        :param headers: Extra request headers
+        :type headers: dict
+
+        :rtype: tuple
+        '''
+        for _ in xrange(self.max_redirects + 1):
+            status, msg, body = self.__request(uri, headers)
+            if status not in REDIRECTS:
+                return status, msg, body
+
+            location = msg.get('Location')
+            if location is None:
+                raise RuntimeError('%s returned status %d without a location' % (uri,
+                    status))
+
+            # The location may be relative, or on another host or scheme, which is then
+            # given its own connections.
+            logger.debug('%s redirected to %s' % (uri, location))
+            uri = urljoin(uri, location)
+
+        raise RuntimeError('Too many redirects for %s' % uri)
+
+
+    def __request(self, uri, headers):
+        '''
+        Sends one GET request, retrying server errors and connection failures, and
+        returns the status code, the response headers and the body of a response with
+        status 200, 304 or a redirect.
+        '''
+        parts = urlsplit(uri)
+        host = (parts.scheme, parts.netloc)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+
+        for attempt in xrange(self.retries + 1):
+            if attempt > 0:
+                time.sleep(self.backoff * 2**(attempt - 1))
+
+            slot = self.__get_slot(host)
+            slot.acquire()
+
+            try:
+                conn = self.__checkout(host)
+
+                try:
+                    conn.request('GET', path, headers=headers or {})
+                    response = conn.getresponse()
+                    body = response.read()
+                except (httplib.HTTPException, socket.error) as e:
+                    # The server may have closed an idle keep-alive connection.
+                    conn.close()
+                    logger.warning('Request for %s failed: %s' % (uri, e))
+                    continue
+
+                if response.will_close:
+                    conn.close()
+                else:
+                    self.__checkin(host, conn)
+            finally:
+                slot.release()
+
+            if response.status in [200, 304] + REDIRECTS:
+                return response.status, response.msg, body
+            elif response.status < 500:
+                raise RuntimeError('%s returned status %d' % (uri, response.status))
+
+            logger.warning('%s returned status %d' % (uri, response.status))
+
+        raise RuntimeError('Cannot download %s after %d attempts' % (uri, self.retries + 1))
+
+
+    def close(self):
+        '''
+        Closes all idle connections.
+        '''
+        with self.__lock:
+            for pool in self.__idle.values():
+                while True:
+                    try:
+                        pool.get_nowait().close()
+                    except Empty:
+                        break
+
+
+    def __get_slot(self, host):
+        with self.__lock:
+            if host not in self.__slots:
+                self.__slots[host] = threading.BoundedSemaphore(self.per_host)
+                self.__idle[host] = Queue()
+            return self.__slots[host]
+
+
+    def __checkout(self, host):
+        '''
+        Returns an idle connection to the given host, or a new one if there is none.
+        '''
+        try:
+            return self.__idle[host].get_nowait()
+        except Empty:
+            scheme, netloc = host
+            cls = httplib.HTTPSConnection if scheme == 'https' else httplib.HTTPConnection
+            return cls(netloc, timeout=self.timeout)
+
+
+    def __checkin(self, host, conn):
+        self.__idle[host].put(conn)
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+
+'''
+Local on-disk cache for FITS files downloaded from MAST. Files are stored under a hash
+of their URL, so several mappers running on one node can share a single cache directory.
+Entries are revalidated against the server with ETag/Last-Modified headers when it is
+reachable, and the least recently used files are evicted once the cache grows past its
+byte budget. The sizes and use order of the files are kept in memory; the directory is
+only scanned when the cache is opened, and files other processes add afterwards join
+the index when they are read.
+'''
+
+import os
+import json
+import errno
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Basic logging configuration.
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Default byte budget of the cache; 10 GB holds roughly 20,000 long-cadence files.
+DEFAULT_CACHE_SIZE = 10 * 1024**3
+
+
+class FITSCache(object):
+    '''
+    Content-addressed, size-bounded cache of FITS files keyed by their download URL.
+    Each entry is a data file plus a small JSON metadata file holding the URL and the
+    validators returned by the server. All writes go through a temporary file in the
+    cache directory followed by an atomic rename.
+    '''
+
+    def __init__(self, cachedir, max_bytes=DEFAULT_CACHE_SIZE, revalidate=True,
+    fetcher=None):
+        '''
+        :param cachedir: Directory to store cached files in; created if necessary
+        :type cachedir: str
+        :param max_bytes: Maximum total size of the cached data files, in bytes
+        :type max_bytes: int
+        :param revalidate: Whether to ask the server if cached files are still current
+        :type revalidate: bool
+        :param fetcher: Client used for downloads; if None, urllib2 is used directly
+        :type fetcher: fetch.HTTPFetcher
+        '''
+        self.cachedir = cachedir
+        self.max_bytes = max_bytes
+        self.revalidate = revalidate
+        self.fetcher = fetcher
+        self.__lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if not os.path.isdir(cachedir):
+            try:
+                os.makedirs(cachedir)
+            except OSError as e:
+                # Another mapper may have created it in the meantime.
+                if e.errno != errno.EEXIST:
+                    raise
+
+        # Size of every cached data file, least recently used first, and their total.
+        self.__index = OrderedDict()
+        for _, size, path in sorted(self.__list_entries()):
+            self.__index[path] = size
+        self.__size = sum(self.__index.itervalues())
+
+
+    def get(self, uri):
+        '''
+        Returns the contents of the file at the given URI, from the cache if possible.
+        Raises RuntimeError if the file is neither cached nor downloadable.
+
+        :param uri: URL of the file
+        :type uri: str
+
+        :rtype: str
+        '''
+        datapath, metapath = self.__get_paths(uri)
+        meta = self.__read_meta(metapath)
+        data = self.__read_data(datapath) if meta is not None else None
+
+        if data is not None and not self.revalidate:
+            # The counters are shared by all download threads.
+            with self.__lock:
+                self.hits += 1
+            return data
+
+        headers = {}
+        if data is not None:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        try:
+            status, info, body = self._request(uri, headers)
+        except RuntimeError:
+            if data is None:
+                raise
+
+            # The server is unreachable; serve the cached copy.
+            logger.warning('Cannot revalidate %s; using cached copy' % uri)
+            with self.__lock:
+                self.hits += 1
+            return data
+
+        if status == 304 and data is not None:
+            with self.__lock:
+                self.hits += 1
+            return data
+
+        with self.__lock:
+            self.misses += 1
+        self.__store(datapath, metapath, uri, info, body)
+        return body
+
+
+    def stats(self):
+        '''
+        Returns the cache counters.
+
+        :rtype: dict
+        '''
+        with self.__lock:
+            return dict(hits=self.hits, misses=self.misses, evictions=self.evictions)
+
+
+    def _request(self, uri, headers):
+        '''
+        Performs a GET request with the given extra headers and returns the status code,
+        the response headers and the body. A 304 response is returned with an empty
+        body; any other failure raises RuntimeError.
+        '''
+        if self.fetcher is not None:
+            return self.fetcher.get(uri, headers)
+
+        import urllib2
+
+        try:
+            response = urllib2.urlopen(urllib2.Request(uri, headers=headers))
+            return response.getcode(), response.info(), response.read()
+        except urllib2.HTTPError as e:
+            if e.code == 304:
+                return 304, e.info(), ''
+            raise RuntimeError
+        except Exception:
+            raise RuntimeError
+
+
+    def __get_paths(self, uri):
+        '''
+        Returns the data and metadata paths for the given URI.
+        '''
+        key = hashlib.sha1(uri).hexdigest()
+        base = os.path.join(self.cachedir, key[:2], key)
+        return base + '.fits', base + '.json'
+
+
+    def __read_meta(self, metapath):
+        '''
+        Reads the metadata of a cached entry. Returns None if the file is missing or
+        cannot be parsed, e.g., because it is being replaced.
+        '''
+        try:
+            with open(metapath, 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+
+    def __read_data(self, datapath):
+        '''
+        Reads a cached data file and marks it as recently used. Returns None if the file
+        is missing, e.g., because another process evicted it.
+        '''
+        try:
+            with open(datapath, 'rb') as f:
+                data = f.read()
+            os.utime(datapath, None)
+        except (IOError, OSError):
+            return None
+
+        with self.__lock:
+            self.__touch(datapath, len(data))
+
+        return data
+
+
+    def __store(self, datapath, metapath, uri, info, body):
+        '''
+        Atomically writes a new entry to the cache and evicts old entries if the cache
+        has grown past its budget.
+        '''
+        meta = dict(uri=uri, size=len(body), etag=info.get('ETag') if info else None,
+            last_modified=info.get('Last-Modified') if info else None)
+
+        try:
+            self.__atomic_write(datapath, body)
+            self.__atomic_write(metapath, json.dumps(meta))
+        except (IOError, OSError) as e:
+            # A failure to cache is not a failure to download.
+            logger.warning('Cannot cache %s: %s' % (uri, e))
+            return
+
+        # The size bookkeeping is shared by all download threads.
+        with self.__lock:
+            self.__touch(datapath, len(body))
+
+            if self.__size > self.max_bytes:
+                self.__evict()
+
+
+    def __touch(self, datapath, size):
+        '''
+        Moves a data file of the given size to the most recently used end of the index,
+        replacing any earlier entry of the same file. Must be called with the lock held.
+        '''
+        self.__size += size - self.__index.pop(datapath, 0)
+        self.__index[datapath] = size
+
+
+    def __atomic_write(self, path, data):
+        dirname = os.path.dirname(path)
+
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+        fd, tmppath = tempfile.mkstemp(dir=dirname, prefix='.tmp')
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(tmppath, path)
+        except:
+            os.unlink(tmppath)
+            raise
+
+
+    def __list_entries(self):
+        '''
+        Returns a list of (mtime, size, datapath) for every cached data file found on
+        disk.
+        '''
+        entries = []
+
+        for root, _, files in os.walk(self.cachedir):
+            for name in files:
+                if not name.endswith('.fits'):
+                    continue
+
+                path = os.path.join(root, name)
+
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+
+                entries.append((st.st_mtime, st.st_size, path))
+
+        return entries
+
+
+    def __evict(self):
+        '''
+        Removes the least recently used entries of the index until the cache fits in its
+        budget. Must be called with the lock held. Files another process has evicted
+        already are simply dropped from the index.
+        '''
+        while self.__size > self.max_bytes and self.__index:
+            path, size = self.__index.popitem(last=False)
+
+            for p in [path[:-len('.fits')] + '.json', path]:
+                try:
+                    os.unlink(p)
+                except OSError:
+                    pass
+
+            self.__size -= size
+            self.evictions += 1
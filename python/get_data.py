@@ -4,72 +4,27 @@
 '''
 Kepler FITS retrieval.  This module will retrieve Kepler lightcurve FITS files based on
 a specified source.  It defines a class called DataStream that stores the relevant lightcurve
-data for one-or-many Kepler targets and one-or-many Quarters as a 64-bit encoded string to be
-passed along to other modules directly through memory.
+data for one-or-many Kepler targets and one-or-many Quarters as an encoded string (see
+:func:`utils.encode_array`) to be passed along to other modules directly through memory.
 Reference: http://www.michael-noll.com/tutorials/writing-an-hadoop-mapreduce-program-in-python/
 '''
 
 import sys
 import os
 import logging
-import urllib2
-import tempfile
-import pyfits
-import numpy as np
-from contextlib import contextmanager
+import itertools
 from argparse import ArgumentParser
-from utils import encode_array
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from utils import encode_array, decode_array, ordered_map
+from quarters import NUM_QUARTERS, LONG_QUARTER_PREFIXES, SHORT_QUARTER_PREFIXES
 
 # Basic logging configuration.
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
-
-############################################################################################
-# Define the possible timestamps in the filename for a given Quarter as a global constant.
-# This allows the software to determine what Quarter a given file came from without having
-# to read the FITS header (since these timestamps are in the file name).
-############################################################################################
-NUM_QUARTERS = 17
-
-LONG_QUARTER_PREFIXES = {'0':['2009131105131'],
-                         '1':['2009166043257'],
-                         '2':['2009259160929'],
-                         '3':['2009350155506'],
-                         '4':['2010078095331','2010009091648'],
-                         '5':['2010174085026'],
-                         '6':['2010265121752'],
-                         '7':['2010355172524'],
-                         '8':['2011073133259'],
-                         '9':['2011177032512'],
-                         '10':['2011271113734'],
-                         '11':['2012004120508'],
-                         '12':['2012088054726'],
-                         '13':['2012179063303'],
-                         '14':['2012277125453'],
-                         '15':['2013011073258'],
-                         '16':['2013098041711'],
-                         '17':['2013131215648']}
-
-SHORT_QUARTER_PREFIXES = {'0':['2009131110544'],
-                          '1':['2009166044711'],
-                          '2':['2009201121230','2009231120729','2009259162342'],
-                          '3':['2009291181958','2009322144938','2009350160919'],
-                          '4':['2010009094841','2010019161129','2010049094358','2010078100744'],
-                          '5':['2010111051353','2010140023957','2010174090439'],
-                          '6':['2010203174610','2010234115140','2010265121752'],
-                          '7':['2010296114515','2010326094124','2010355172524'],
-                          '8':['2011024051157','2011053090032','2011073133259'],
-                          '9':['2011116030358','2011145075126','2011177032512'],
-                          '10':['2011208035123','2011240104155','2011271113734'],
-                          '11':['2011303113607','2011334093404','2012004120508'],
-                          '12':['2012032013838','2012060035710','2012088054726'],
-                          '13':['2012121044856','2012151031540','2012179063303'],
-                          '14':['2012211050319','2012242122129','2012277125453'],
-                          '15':['2012310112549','2012341132017','2013011073258'],
-                          '16':['2013017113907','2013065031647','2013098041711'],
-                          '17':['2013121191144','2013131215648']}
-############################################################################################
+# Root of the Kepler lightcurve tree on MAST.
+MAST_URL = 'http://archive.stsci.edu/pub/kepler/lightcurves/'
 
 
 class DataStream:
@@ -107,34 +62,91 @@ class DataStream:
 
 class MASTDataDownloader(object):
     '''
-    Retrieves data from the MAST archive over the web.
+    Retrieves data from the MAST archive over the web. If a :class:`fits_cache.FITSCache`
+    is given, files are served from it whenever possible. With ``printout`` set, the
+    lightcurves are written to STDOUT right away; otherwise the loader is an iterator of
+    lightcurve records (see :func:`format_record`).
     '''
 
-    def __init__(self, data, printout=True):
+    def __init__(self, data, printout=True, cache=None, base_url=MAST_URL, nthreads=1,
+    fetcher=None):
+        self.data = data
+        self.cache = cache
+        self.base_url = base_url
+        self.nthreads = nthreads
+        self.fetcher = fetcher
+
+        if printout:
+            _print_records(self)
+
+
+    def __iter__(self):
+        own_fetcher = self.fetcher is None and self.nthreads > 1
+        if own_fetcher:
+            from fetch import HTTPFetcher
+            self.fetcher = HTTPFetcher()
+
+        own_cache_fetcher = self.cache is not None and self.cache.fetcher is None
+        if own_cache_fetcher:
+            self.cache.fetcher = self.fetcher
+
+        jobs = self.__get_jobs(self.data)
+
+        if self.nthreads > 1:
+            # Download on a thread pool, but keep the output in input order.
+            pool = ThreadPool(self.nthreads)
+            results = ordered_map(pool, self.__download_job, jobs, 2 * self.nthreads)
+        else:
+            pool = None
+            results = itertools.imap(self.__download_job, jobs)
+
+        try:
+            for kepler_id, quarter, suffix, p, arrays in results:
+                if arrays is not None:
+                    yield (kepler_id + '_' + suffix, "%02d" % int(quarter), p) + arrays
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+            if own_cache_fetcher:
+                self.cache.fetcher = None
+
+            if own_fetcher:
+                self.fetcher.close()
+                self.fetcher = None
+
+
+    def __get_jobs(self, data):
+        '''
+        Yields the Kepler ID, quarter, cadence and URL of every file to download.
+        '''
         for kepler_id, quarter, suffix in data:
             # Fix kepler_id missing zero-padding
             if len(kepler_id) < 9:
                 kepler_id = str("%09d" % int(kepler_id))
 
             # Now create the URLs.
-            path = self.__get_mast_path(kepler_id, quarter, suffix)
+            for p in self.__get_mast_path(kepler_id, quarter, suffix):
+                yield kepler_id, quarter, suffix, p
 
-            for p in path:
-                # Download the requested URL.
-                try:
-                    fits_stream = self.__download_file_serialize(p)
-                    tempfile, stream = self.__process_fits_object(fits_stream)
-                except RuntimeError:
-                    logging.error('Cannot download: ' + p)
-                    continue
 
-                if printout:
-                    # Write the result to STDOUT as this will be an input to a
-                    # reducer that aggregates the querters together
-                    print "\t".join([kepler_id + '_' + suffix, "%02d" % int(quarter), p, stream.dstream1,
-                        stream.dstream2, stream.dstream3])
+    def __download_job(self, job):
+        '''
+        Downloads and processes one file. Returns the job with the time, flux and flux
+        error arrays appended, or with None if the download failed.
+        '''
+        from kepler_fits import read_lightcurve_string
+        kepler_id, quarter, suffix, p = job
 
-                os.unlink(tempfile)
+        try:
+            fits_stream = self.__download_file_serialize(p)
+            arrays = read_lightcurve_string(fits_stream)
+        except RuntimeError:
+            logging.error('Cannot download: ' + p)
+            return kepler_id, quarter, suffix, p, None
+
+        return kepler_id, quarter, suffix, p, arrays
 
 
     def __download_file_serialize(self, uri):
@@ -143,6 +155,14 @@ class MASTDataDownloader(object):
         file from the backup URI. On success, returns a raw character stream. On failure,
         output is an empty string.
         '''
+        if self.cache is not None:
+            return self.cache.get(uri)
+
+        if self.fetcher is not None:
+            return self.fetcher.get(uri)[2]
+
+        import urllib2
+
         try:
             response = urllib2.urlopen(uri)
             fits_stream = response.read()
@@ -161,11 +181,11 @@ class MASTDataDownloader(object):
 
         if suffix == 'llc':
             for p in LONG_QUARTER_PREFIXES[quarter]:
-                path.append('http://archive.stsci.edu/pub/kepler/lightcurves/' + prefix + '/' + \
+                path.append(self.base_url + prefix + '/' + \
                     kepler_id + '/kplr' + kepler_id + '-' + p + '_' + suffix + '.fits')
         elif suffix == 'slc':
             for p in SHORT_QUARTER_PREFIXES[quarter]:
-                path.append('http://archive.stsci.edu/pub/kepler/lightcurves/' + prefix + '/' + \
+                path.append(self.base_url + prefix + '/' + \
                     kepler_id + '/kplr' + kepler_id + '-' + p + '_' + suffix + '.fits')
         else:
             raise ValueError('Invalid cadence key: %s' % suffix)
@@ -173,73 +193,70 @@ class MASTDataDownloader(object):
         return path
 
 
-    def __process_fits_object(self, fits_string):
-        '''
-        Process FITS file object and extract info.
-        http://stackoverflow.com/questions/11892623/python-stringio-and-compatibility-with-with-statement-context-manager
-        Returns the temporary file name and DataStream object.
-        '''
-        test = ''
-        with self.__tempinput(fits_string) as tempfilename:
-            test = tempfilename
-            fitsdata = pyfits.getdata(tempfilename)
-            bjd_trunci = float(pyfits.getval(tempfilename, 'bjdrefi', ext=1))
-            bjd_truncf = float(pyfits.getval(tempfilename, 'bjdreff', ext=1))
+class DiskDataLoader(object):
+    '''
+    Retrieves data from a disk given a specified root directory (relative or absolute).
+    The FITS files are expected to be under that directory with the pathspec
+    <root directory>/<4-digit short KepID>/<full KepID>/
+    If a :class:`manifest.Manifest` of the directory is given, files are looked up in it
+    instead of being derived from the quarter tables, and a quarter of ``*`` selects every
+    quarter that is present on disk. With ``printout`` set, the lightcurves are written to
+    STDOUT right away; otherwise the loader is an iterator of lightcurve records (see
+    :func:`format_record`).
+    '''
+    def __init__(self, data, datapath, printout=True, nworkers=1, manifest=None):
+        self.data = data
+        self.datapath = datapath
+        self.nworkers = nworkers
+        self.manifest = manifest
 
-            # Note: Times are updated to be in proper reduced barycentric Julian date,
-            # RBJD = BJD - 2400000.0
-            time = fitsdata['TIME'] + bjd_trunci + bjd_truncf - 2400000.
-            pdcflux = fitsdata['PDCSAP_FLUX']
-            pdcerror = fitsdata['PDCSAP_FLUX_ERR']
-            errorstat = fitsdata['SAP_QUALITY']
+        if printout:
+            _print_records(self)
 
-            ndx = np.where(errorstat == 0)
-            retval = DataStream(arrays=(time[ndx], pdcflux[ndx], pdcerror[ndx]))
 
-            # Fix for windows, returns the filename into main so that os.unlink can be called there
-            return test, retval
+    def __iter__(self):
+        jobs = self.__get_jobs(self.data, self.datapath, self.manifest)
 
+        if self.nworkers > 1:
+            # Read files on a process pool; results come back through a bounded reorder
+            # buffer so that the output is still in input order.
+            pool = Pool(self.nworkers)
+            results = ordered_map(pool, _read_fits_job, jobs, 4 * self.nworkers)
+        else:
+            pool = None
+            results = itertools.imap(_read_fits_job, jobs)
 
-    @contextmanager
-    def __tempinput(self, data):
-        '''
-        Handle old legacy code that absolutely demands a filename instead of streaming
-        file content.
-        '''
-        temp = tempfile.NamedTemporaryFile(delete=False)
-        temp.write(data)
-        temp.close()
-        yield temp.name
+        try:
+            for kepler_id, quarter, suffix, p, arrays in results:
+                if arrays is not None:
+                    yield (kepler_id + '_' + suffix, "%02d" % int(quarter), p) + arrays
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
 
 
-class DiskDataLoader(object):
-    '''
-    Retrieves data from a disk given a specified root directory (relative or absolute).
-    The FITS files are expected to be under that directory with the pathspec
-    <root directory>/<4-digit short KepID>/<full KepID>/
-    '''
-    def __init__(self, data, datapath, printout=True):
+    def __get_jobs(self, data, datapath, manifest=None):
+        '''
+        Yields the Kepler ID, quarter, cadence and path of every file to read.
+        '''
         for kepler_id, quarter, suffix in data:
             # Fix kepler_id missing zero-padding
             if len(kepler_id) < 9:
                 kepler_id = str("%09d" % int(kepler_id))
 
-            # Now create the URL regardless of Quarter.
-            path = self.__get_fits_path(datapath, kepler_id, quarter, suffix)
+            if manifest is not None:
+                quarters = manifest.quarters(kepler_id, suffix) if quarter == '*' else \
+                    [quarter]
 
-            for p in path:
-                # Read in the FITS file and create the DataStream object.
-                try:
-                    stream = self.__read_fits_file(p, kepler_id)
-                except RuntimeError:
-                    logging.error("Cannot read: " + p)
-                    continue
+                for q in quarters:
+                    for p in manifest.paths(kepler_id, q, suffix):
+                        yield kepler_id, q, suffix, p
+                continue
 
-                if printout:
-                    # Write the result to STDOUT as this will be an input to a
-                    # reducer that aggregates the querters together
-                    print "\t".join([kepler_id + '_' + suffix, "%02d" % int(quarter), p, stream.dstream1,
-                        stream.dstream2, stream.dstream3])
+            # Now create the URL regardless of Quarter.
+            for p in self.__get_fits_path(datapath, kepler_id, quarter, suffix):
+                yield kepler_id, quarter, suffix, p
 
 
     def __get_fits_path(self, datapath, kepler_id, quarter, suffix):
@@ -263,80 +280,315 @@ class DiskDataLoader(object):
         return path
 
 
-    def __read_fits_file(self, input_fits_file, kepler_id):
-        '''
-        Read FITS file from disk for each quarter and each object into memory.
-        '''
+class ArchiveDataLoader(object):
+    '''
+    Retrieves data from a lightcurve archive built by :mod:`archive`. Targets are looked
+    up in the archive index, and only the chunks overlapping the optional time window
+    are read. With ``printout`` set, the lightcurves are written to STDOUT right away;
+    otherwise the loader is an iterator of lightcurve records (see :func:`format_record`).
+    '''
+    def __init__(self, data, archivepath, printout=True, tmin=None, tmax=None):
+        self.data = data
+        self.archivepath = archivepath
+        self.tmin = tmin
+        self.tmax = tmax
+
+        if printout:
+            _print_records(self)
+
+
+    def __iter__(self):
+        from archive import ArchiveReader
+        reader = ArchiveReader(self.archivepath)
+        cached, lightcurves = None, {}
+
         try:
-            hdulist = pyfits.open(input_fits_file)
-        except:
-            raise RuntimeError
+            for kepler_id, quarter, suffix in self.data:
+                # Fix kepler_id missing zero-padding
+                if len(kepler_id) < 9:
+                    kepler_id = str("%09d" % int(kepler_id))
+
+                if kepler_id != cached:
+                    # The requests of a target come one after another, one per quarter
+                    # for a quarter wildcard; its block is read once for all of them.
+                    lightcurves = {}
+                    for entry in reader.entries(kepler_id):
+                        lightcurves.setdefault((entry['quarter'], entry['cadence']),
+                            []).append(entry)
+                    cached = kepler_id
+
+                for entry in lightcurves.get((int(quarter), suffix), []):
+                    arrays = reader.read(entry, tmin=self.tmin, tmax=self.tmax)
+                    if len(arrays[0]) == 0:
+                        # Nothing of this lightcurve falls in the time window.
+                        continue
+
+                    yield (kepler_id + '_' + suffix, "%02d" % int(quarter),
+                        self.archivepath + '#' + entry['source']) + arrays
+        finally:
+            reader.close()
+
+
+def _read_fits_job(job):
+    '''
+    Reads one FITS file from disk. Returns the job with the time, flux and flux error
+    arrays appended, or with None if the file cannot be read. This is a module-level
+    function so that it can be sent to worker processes.
+    '''
+    from kepler_fits import read_lightcurve_file
+    kepler_id, quarter, suffix, p = job
+
+    try:
+        arrays = read_lightcurve_file(p)
+    except RuntimeError:
+        logging.error("Cannot read: " + p)
+        return kepler_id, quarter, suffix, p, None
+
+    return kepler_id, quarter, suffix, p, arrays
+
 
-        # Otherwise we've successfully opened the FITS file, so read the data, close the FITS
-        # file, and create the DataStream object.
-        # Note: Times are updated to be in proper reduced barycentric Julian date,
-        # RBJD = BJD - 2400000.0
-        fitsdata = hdulist[1].data
-        bjd_trunci = float(hdulist[1].header['bjdrefi'])
-        bjd_truncf = float(hdulist[1].header['bjdreff'])
-        time = fitsdata['TIME'] + bjd_trunci + bjd_truncf - 2400000.
-        pdcflux = fitsdata['PDCSAP_FLUX']
-        pdcerror = fitsdata['PDCSAP_FLUX_ERR']
-        errorstat = fitsdata['SAP_QUALITY']
+def _print_records(loader):
+    '''
+    Writes every record of the given loader to STDOUT as this will be an input to a
+    reducer that aggregates the quarters together.
+    '''
+    for record in loader:
+        print format_record(record)
 
-        ndx = np.where(errorstat == 0)
-        retval = DataStream(arrays=(time[ndx], pdcflux[ndx], pdcerror[ndx]))
-        hdulist.close()
 
-        return retval
+def format_record(record):
+    '''
+    Formats one lightcurve record as a line of loader output. A record is a tuple of the
+    key (KIC ID and cadence), the zero-padded quarter, the URI the data was read from,
+    and the time, flux, and flux error arrays.
 
+    :param record: Lightcurve record, as produced by iterating over a loader
+    :type record: tuple
 
-def main(source, datapath):
+    :rtype: str
     '''
-    Get data from the specified source and optional data path.
+    key, quarter, uri, time, flux, fluxerr = record
+    stream = DataStream(arrays=(time, flux, fluxerr))
+    return "\t".join([key, quarter, uri, stream.dstream1, stream.dstream2, stream.dstream3])
 
-    :param source: Either "disk" or "mast"
-    :type source: str
-    :param datapath: If ``source`` is "disk", then the path to the files; ignored otherwise
-    :type datapath: str
+
+def sort_requests(data):
     '''
-    # Read in a list of KIC IDs and Quarter numbers to process from STDIN.
-    data = __read_input(sys.stdin)
+    Returns the requests sorted by their output key, KIC ID and cadence, so that the
+    loader emits the records of each target together. The sort is stable, so the
+    requests of one target keep their order.
 
-    # Call the correct function based on the desired source.
+    :param data: Requests of KIC ID, quarter and cadence
+    :type data: iterable
+
+    :rtype: list
+    '''
+    def key(request):
+        kepler_id, _, suffix = request
+        if len(kepler_id) < 9:
+            kepler_id = str("%09d" % int(kepler_id))
+        return kepler_id + '_' + suffix
+
+    return sorted(data, key=key)
+
+
+def get_loader(source, data, datapath, cache=None, nthreads=1, nworkers=1, tmin=None,
+tmax=None, manifest=None):
+    '''
+    Returns a loader for the specified source that iterates over lightcurve records
+    without printing them. The arguments are as for :func:`main`, except that ``cache``
+    is a :class:`fits_cache.FITSCache` or None.
+
+    :rtype: object
+    '''
     if source == 'mast':
-        ldr = MASTDataDownloader(data, printout=True)
+        return MASTDataDownloader(data, printout=False, cache=cache, nthreads=nthreads)
     elif source == 'disk':
-        ldr = DiskDataLoader(data, datapath, printout=True)
+        mfst = None
+        if manifest is not None:
+            from manifest import get_manifest
+            mfst = get_manifest(datapath, manifest or None)
+        return DiskDataLoader(data, datapath, printout=False, nworkers=nworkers,
+            manifest=mfst)
+    elif source == 'archive':
+        return ArchiveDataLoader(data, datapath, printout=False, tmin=tmin, tmax=tmax)
     else:
         raise ValueError('Invalid source parameter: %s' % source)
 
 
-def __read_input(file):
+def report_cache_stats(stats):
+    '''
+    Writes the statistics of a download cache to STDERR as Hadoop streaming counters.
+
+    :param stats: Cache counters, as returned by :meth:`fits_cache.FITSCache.stats`
+    :type stats: dict
+    '''
+    for name, value in sorted(stats.items()):
+        sys.stderr.write('reporter:counter:FITSCache,%s,%d\n' % (name, value))
+
+
+def main(source, datapath, cachedir=None, cachesize=None, nthreads=1,
+nworkers=1, tmin=None, tmax=None, manifest=None, shard=None, shard_method='hash',
+join=False):
+    '''
+    Get data from the specified source and optional data path.
+
+    :param source: Either "disk", "mast" or "archive"
+    :type source: str
+    :param datapath: If ``source`` is "disk", then the path to the files; if it is
+        "archive", the path to the archive; ignored otherwise
+    :type datapath: str
+    :param cachedir: If ``source`` is "mast", an optional directory to cache downloaded
+        files in
+    :type cachedir: str
+    :param cachesize: Maximum size of the download cache in bytes; defaults to
+        :data:`fits_cache.DEFAULT_CACHE_SIZE`
+    :type cachesize: int
+    :param nthreads: If ``source`` is "mast", the number of concurrent downloads
+    :type nthreads: int
+    :param nworkers: If ``source`` is "disk", the number of worker processes reading files
+    :type nworkers: int
+    :param tmin: If ``source`` is "archive", the start of the time window to read (RBJD)
+    :type tmin: float
+    :param tmax: If ``source`` is "archive", the end of the time window to read (RBJD)
+    :type tmax: float
+    :param manifest: If ``source`` is "disk", the path of a manifest file of the data
+        directory to look files up in, or an empty string for the default location; the
+        manifest is built if the file does not exist
+    :type manifest: str
+    :param shard: Tuple (i, N) to process only the KIC IDs of shard i out of N
+    :type shard: tuple
+    :param shard_method: How KIC IDs are assigned to shards, see :mod:`sharding`
+    :type shard_method: str
+    :param join: Join the quarters of each target before printing, and print targets in
+        the format of :mod:`join_quarters`; all requests of a target must go to the same
+        process
+    :type join: bool
+    '''
+    if source != 'disk':
+        manifest = None
+
+    # Read in a list of KIC IDs and Quarter numbers to process from STDIN. With a manifest,
+    # the quarter wildcard is resolved against the files that actually exist.
+    data = read_input(sys.stdin, expand=manifest is None)
+    if shard is not None:
+        from sharding import shard_requests
+        data = shard_requests(data, shard[0], shard[1], shard_method)
+
+    cache = None
+    if source == 'mast' and cachedir is not None:
+        from fits_cache import FITSCache, DEFAULT_CACHE_SIZE
+        if cachesize is None:
+            cachesize = DEFAULT_CACHE_SIZE
+        cache = FITSCache(cachedir, cachesize)
+
+    if join:
+        # Map-side join: load the requests of each target together, and stitch the
+        # quarters of one target at a time instead of printing them for a sort step.
+        from join_quarters import group_quarters, join_targets, format_target
+        loader = get_loader(source, sort_requests(data), datapath, cache=cache,
+            nthreads=nthreads, nworkers=nworkers, tmin=tmin, tmax=tmax, manifest=manifest)
+
+        for target in join_targets(group_quarters(loader)):
+            print format_target(target)
+    else:
+        # Call the correct function based on the desired source.
+        _print_records(get_loader(source, data, datapath, cache=cache, nthreads=nthreads,
+            nworkers=nworkers, tmin=tmin, tmax=tmax, manifest=manifest))
+
+    if cache is not None:
+        report_cache_stats(cache.stats())
+
+
+def read_input(file, expand=True):
+    '''
+    Reads requests of the form "KIC ID, quarter, cadence" from the given file, one per
+    line, and yields them as lists. A quarter of ``*`` is expanded to all quarters in the
+    quarter tables unless ``expand`` is False.
+
+    :param file: File to read; usually stdin
+    :type file: file
+    :param expand: Whether to expand the quarter wildcard
+    :type expand: bool
+
+    :rtype: generator
+    '''
     for line in file:
         # Split the line into words
         s = line.split()
 
         # Only yield if this was a valid line (allows for blank lines in STDIN)
         if len(s) == 3:
-            if s[1] == '*':
+            if s[1] == '*' and expand:
                 for i in xrange(NUM_QUARTERS):
                     yield [s[0], str(i), s[2]]
             else:
                 yield s
 
 
-if __name__ == "__main__":
-    # Set up the command line argument parser.
-    parser = ArgumentParser(description="Retrieve Kepler lightcurve data given a set of Kepler "
-        "IDs and Quarter numbers from STDIN.")
-    parser.add_argument("source", action="store", choices=['mast','disk'],
+def init_parser(parser=None):
+    '''
+    Set up an argument parser for the data source options, or add them to the given
+    parser. Returns the parser object.
+
+    :param parser: Parser to add the options to
+    :type parser: argparse.ArgumentParser
+
+    :rtype: argparse.ArgumentParser
+    '''
+    from fits_cache import DEFAULT_CACHE_SIZE
+    from sharding import SHARD_METHODS, parse_shard
+
+    if parser is None:
+        parser = ArgumentParser(description="Retrieve Kepler lightcurve data given a set of "
+            "Kepler IDs and Quarter numbers from STDIN.")
+
+    parser.add_argument("source", action="store", choices=['mast','disk','archive'],
         help="Select the source where Kepler FITS files should be retrieved.")
     parser.add_argument("datapath", action="store", nargs='?', default=os.curdir+os.sep,
         help="(Root) path to the Kepler lightcurve data, such that root is the path part "
-            "<root>/<nnnn>/<nnnnnnnnn>/.  Defaults to the current working directory.")
+            "<root>/<nnnn>/<nnnnnnnnn>/, or the archive directory for the archive "
+            "source.  Defaults to the current working directory.")
+    parser.add_argument("--cache-dir", action="store", dest="cachedir", default=None,
+        help="[Optional] Directory in which to cache files downloaded from MAST.")
+    parser.add_argument("--cache-size", action="store", type=float, dest="cachesize",
+        default=DEFAULT_CACHE_SIZE / 1024.**2, help="[Optional] Maximum size of the "
+            "download cache in megabytes.")
+    parser.add_argument("--threads", action="store", type=int, dest="nthreads", default=4,
+        help="[Optional] Number of concurrent downloads from MAST.")
+    parser.add_argument("--workers", action="store", type=int, dest="nworkers", default=1,
+        help="[Optional] Number of worker processes reading FITS files from disk.")
+    parser.add_argument("--tmin", action="store", type=float, dest="tmin", default=None,
+        help="[Optional] Only read data at or after this time (RBJD) from an archive.")
+    parser.add_argument("--tmax", action="store", type=float, dest="tmax", default=None,
+        help="[Optional] Only read data at or before this time (RBJD) from an archive.")
+    parser.add_argument("--manifest", action="store", nargs='?', const='', dest="manifest",
+        default=None, help="[Optional] Look files up in a manifest of the data directory "
+            "instead of the quarter tables, building it if necessary. Defaults to "
+            ".manifest.json in the data directory.")
+    parser.add_argument("--shard", action="store", type=parse_shard, dest="shard",
+        default=None, help="[Optional] Only process the KIC IDs of shard i out of N, "
+            "given as i/N with 0 <= i < N.")
+    parser.add_argument("--shard-by", action="store", choices=SHARD_METHODS,
+        dest="shard_method", default='hash', help="[Optional] Assign KIC IDs to shards "
+            "by a stable hash, or by estimated cost. Defaults to hash.")
+
+    return parser
+
+
+if __name__ == "__main__":
+    # Set up the command line argument parser.
+    parser = init_parser()
+    parser.add_argument("--join", action="store_true", dest="join", default=False,
+        help="[Optional] Join the quarters of each target here and print the output of "
+            "join_quarters.py, so that no sort and join steps are needed. All requests of "
+            "a KIC ID must be given to the same process.")
     args = parser.parse_args()
 
     # Note: The trailing separator is not necessary anymore because of os.path.join modification
-    main(args.source, os.path.normpath(args.datapath))
+    main(args.source, os.path.normpath(args.datapath), cachedir=args.cachedir,
+        cachesize=int(args.cachesize * 1024**2), nthreads=args.nthreads,
+        nworkers=args.nworkers, tmin=args.tmin, tmax=args.tmax,
+        manifest=args.manifest, shard=args.shard, shard_method=args.shard_method,
+        join=args.join)
 
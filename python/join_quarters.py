@@ -11,37 +11,161 @@ import logging
 import numpy as np
 from itertools import groupby
 from operator import itemgetter
-from utils import read_mapper_output, encode_list
+from utils import read_mapper_output, encode_array
 
 # Basic logging configuration.
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 
-if __name__ == '__main__':
-    # input comes from STDIN (standard input)
-    data = read_mapper_output(sys.stdin, uri=True)
+def stitch_quarters(quarters):
+    '''
+    Stitches the quarters of one target into single time, flux and flux error arrays in
+    time order. The output arrays are allocated once. If the quarters do not overlap, which
+    is the usual case, they are copied in place one after another; otherwise they are
+    merged straight into the output, each cadence going to its place among the cadences
+    of the other quarters, so that the earliest quarter wins between cadences with the
+    same time as in a stable sort. A quarter that is not in time order itself is sorted
+    before it is merged. Cadences with non-finite times and duplicate cadences are
+    dropped. Each input quarter is released as soon as it has been copied. The output is
+    float64 whatever the input types.
+
+    :param quarters: List of (time, flux, flux error) tuples, one per quarter; emptied
+        by this function
+    :type quarters: list
+
+    :rtype: tuple
+    '''
+    finite = [np.isfinite(t) for t, _, _ in quarters]
+    counts = [int(np.count_nonzero(m)) for m in finite]
+    n = sum(counts)
+    out = [np.empty((n,), dtype='float64') for _ in xrange(3)]
+
+    # Take the quarters in order of their first finite cadence.
+    order = sorted([i for i in xrange(len(quarters)) if counts[i] > 0],
+        key=lambda i: quarters[i][0][np.argmax(finite[i])])
+
+    # The finite times of each quarter in time order, and the order that puts them in
+    # time order if they are not already.
+    times, perms = [], []
+    for i in order:
+        t = quarters[i][0]
+        if counts[i] < len(t):
+            t = t[finite[i]]
+
+        perm = None
+        if np.any(t[1:] < t[:-1]):
+            perm = np.argsort(t, kind='mergesort')
+            t = t.take(perm)
+
+        times.append(t)
+        perms.append(perm)
+
+    overlap = any(perm is not None for perm in perms) or \
+        any(times[k][0] <= times[k-1][-1] for k in xrange(1, len(times)))
+    pos = 0
+
+    for k, i in enumerate(order):
+        columns, mask, m, perm = quarters[i], finite[i], counts[i], perms[k]
+        quarters[i] = None
+
+        if overlap:
+            # Each cadence goes after the earlier cadences of the other quarters and after
+            # the cadences of earlier quarters with the same time.
+            where = np.arange(m)
+            for j, t in enumerate(times):
+                if j != k:
+                    side = 'right' if j < k else 'left'
+                    where += np.searchsorted(t, times[k], side=side)
+
+        # Assignment converts columns of other types, e.g. single-precision fluxes read
+        # straight from FITS files, to float64.
+        for c, column in zip(out, columns):
+            if m < len(mask):
+                column = column[mask]
+            if perm is not None:
+                column = column.take(perm)
+
+            if overlap:
+                c[where] = column
+            else:
+                c[pos:pos+m] = column
+
+        pos += m
+
+    del quarters[:]
+    del times[:]
+
+    keep = np.empty((n,), dtype='bool')
+    keep[:1] = True
+    np.not_equal(out[0][1:], out[0][:-1], out=keep[1:])
+
+    if not keep.all():
+        out = [c.compress(keep) for c in out]
 
+    return tuple(out)
+
+
+def group_quarters(records):
+    '''
+    Takes loader records grouped by key and yields them in the order ``sort`` puts the
+    corresponding lines in, i.e., sorted by quarter and URI within each target, with the
+    URI dropped. Only one target is held in memory at a time.
+
+    :param records: Lightcurve records, as produced by iterating over a loader
+    :type records: iterable
+
+    :rtype: generator
+    '''
+    for _, group in groupby(records, itemgetter(0)):
+        for key, quarter, _, time, flux, fluxerr in sorted(group, key=itemgetter(1, 2)):
+            yield key, quarter, time, flux, fluxerr
+
+
+def join_targets(records):
+    '''
+    Joins the quarters of each target. The records are tuples of KIC ID, quarter, time,
+    flux and flux error, grouped by KIC ID; for each target, the KIC ID, the list of
+    quarters as a string, and the stitched arrays (see :func:`stitch_quarters`) are
+    yielded.
+
+    :param records: Iterable of quarter records, grouped by KIC ID
+    :type records: iterable
+
+    :rtype: generator
+    '''
     # groupby groups multiple quarters together for each Kepler ID
     #   current_kic is current Kepler ID
     #   group - iterator yielding all ["&lt;current_word&gt;", "&lt;count&gt;"] items
 
-    for current_kic, group in groupby(data, itemgetter(0)):
-        try:
-            all_quarters = [[q, time, flux, eflux] for _, q, time, flux, eflux in group]
-            concatenated_time = list()
-            concatenated_flux = list()
-            concatenated_eflux = list()
-
-            for _, t, f, e in all_quarters:
-                concatenated_time.extend(t)
-                concatenated_flux.extend(f)
-                concatenated_eflux.extend(e)
-
-            all_q = [q for q, _, _, _ in all_quarters]
-            print '\t'.join([str(current_kic), str(all_q), encode_list(concatenated_time),
-                encode_list(concatenated_flux), encode_list(concatenated_eflux)])
-        except ValueError:
-            # count was not a number, so silently discard this item
-            pass
+    for current_kic, group in groupby(records, itemgetter(0)):
+        all_q = []
+        quarters = []
+        for _, q, time, flux, eflux in group:
+            all_q.append(q)
+            quarters.append((time, flux, eflux))
+
+        time, flux, eflux = stitch_quarters(quarters)
+        yield str(current_kic), str(all_q), time, flux, eflux
+
+
+def format_target(target):
+    '''
+    Formats one joined target, as yielded by :func:`join_targets`, as a line of output.
+
+    :param target: Joined target
+    :type target: tuple
+
+    :rtype: str
+    '''
+    current_kic, all_q, time, flux, eflux = target
+    return '\t'.join([current_kic, all_q, encode_array(time), encode_array(flux),
+        encode_array(eflux)])
+
+
+if __name__ == '__main__':
+    # input comes from STDIN (standard input)
+    data = read_mapper_output(sys.stdin, uri=True)
 
+    for target in join_targets(data):
+        print format_target(target)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Completion journal for long runs of :mod:`drive_bls_pulse`. For every finished target,
+a line with the KIC ID, the quarters, a hash of the search parameters, and the offset of
+the end of the target's output in the output file is appended to the journal:
+
+    kic<TAB>quarters<TAB>paramhash<TAB>offset
+
+Journal lines are written in batches. Before each batch, the output file is flushed and
+synced to disk, and the batch is synced right after it is written. The journal
+therefore never refers to output that is not on disk, and after a crash the output is
+valid up to the offset of the last journal line. :func:`compact` truncates the output
+to that offset and drops a partially written last journal line, so that a run can be
+resumed by skipping the targets in the journal.
+'''
+
+import os
+import time
+import hashlib
+import logging
+from argparse import ArgumentParser
+
+# Basic logging configuration.
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Default number of records and seconds between syncs.
+SYNC_RECORDS = 100
+SYNC_SECONDS = 5.
+
+# Search options that determine the output of a target.
+PARAM_KEYS = ['segment', 'mindur', 'maxdur', 'nbins', 'direction', 'mode', 'fmt']
+
+
+def param_hash(options, keys=PARAM_KEYS):
+    '''
+    Returns a short hash of the search options that determine the output of a target.
+
+    :param options: Search options, as returned by :func:`drive_bls_pulse.read_options`
+    :type options: dict
+    :param keys: Options to include
+    :type keys: list
+
+    :rtype: str
+    '''
+    return hashlib.md5(repr([(k, options[k]) for k in keys])).hexdigest()[:16]
+
+
+class Journal(object):
+    '''
+    Append-only writer of a completion journal.
+    '''
+
+    def __init__(self, path, output, sync_records=SYNC_RECORDS, sync_seconds=SYNC_SECONDS):
+        '''
+        :param path: Journal file; appended to if it exists
+        :type path: str
+        :param output: Output file the journal refers to
+        :type output: file
+        :param sync_records: Maximum number of records between syncs
+        :type sync_records: int
+        :param sync_seconds: Maximum number of seconds between syncs
+        :type sync_seconds: float
+        '''
+        self.output = output
+        self.sync_records = sync_records
+        self.sync_seconds = sync_seconds
+
+        self.__file = open(path, 'ab')
+        self.__pending = []
+        self.__last_sync = time.time()
+
+
+    def record(self, kepler_id, quarters, phash, offset):
+        '''
+        Records that the output of a target ends at ``offset`` in the output file. The
+        record is written with the next sync.
+
+        :param kepler_id: KIC ID
+        :type kepler_id: str
+        :param quarters: Quarters, as listed by the join step
+        :type quarters: str
+        :param phash: Hash of the search parameters, see :func:`param_hash`
+        :type phash: str
+        :param offset: Offset of the end of the target's output
+        :type offset: int
+        '''
+        self.__pending.append('\t'.join([kepler_id, quarters, phash, str(offset)]) + '\n')
+
+        if len(self.__pending) >= self.sync_records or \
+        time.time() - self.__last_sync >= self.sync_seconds:
+            self.sync()
+
+
+    def sync(self):
+        '''
+        Syncs the output file, then writes and syncs the pending records.
+        '''
+        if self.__pending:
+            _fsync(self.output)
+            self.__file.write(''.join(self.__pending))
+            _fsync(self.__file)
+            self.__pending = []
+
+        self.__last_sync = time.time()
+
+
+    def close(self):
+        '''
+        Writes the pending records and closes the journal.
+        '''
+        self.sync()
+        self.__file.close()
+
+
+def _fsync(f):
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def read_journal(path):
+    '''
+    Returns the records of a journal as a list of (KIC ID, quarters, parameter hash,
+    offset) tuples. Reading stops at the first incomplete or malformed line, which is
+    what a crash during a write leaves behind. A missing journal has no records.
+
+    :param path: Journal file
+    :type path: str
+
+    :rtype: list
+    '''
+    records = []
+
+    if not os.path.isfile(path):
+        return records
+
+    with open(path, 'rb') as f:
+        for line in f:
+            parts = line.split('\t')
+
+            if not line.endswith('\n') or len(parts) != 4 or not parts[3].strip().isdigit():
+                break
+
+            records.append((parts[0], parts[1], parts[2], int(parts[3])))
+
+    return records
+
+
+def compact(journal_path, output_path):
+    '''
+    Repairs an output file and its journal after an interrupted run. The journal is cut
+    at its first incomplete line or at the first record whose offset lies beyond the
+    end of the output, and the output is truncated to the offset of the last remaining
+    record. Returns the remaining records.
+
+    :param journal_path: Journal file
+    :type journal_path: str
+    :param output_path: Output file
+    :type output_path: str
+
+    :rtype: list
+    '''
+    records = read_journal(journal_path)
+    size = os.path.getsize(output_path) if os.path.isfile(output_path) else 0
+
+    end = 0
+    for i, record in enumerate(records):
+        if record[3] < end or record[3] > size:
+            logger.warning('Journal record %d refers to missing output; dropping the '
+                'rest of the journal' % i)
+            records = records[:i]
+            break
+        end = record[3]
+
+    if size > end:
+        with open(output_path, 'r+b') as f:
+            f.truncate(end)
+            _fsync(f)
+
+    # Rewrite the journal without any partial last line.
+    tmppath = journal_path + '.tmp'
+    with open(tmppath, 'wb') as f:
+        for record in records:
+            f.write('\t'.join([record[0], record[1], record[2], str(record[3])]) + '\n')
+        _fsync(f)
+    os.rename(tmppath, journal_path)
+
+    return records
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Repair the output of an interrupted run of '
+        'drive_bls_pulse.py: truncate the output to the last journaled target and drop '
+        'a partially written journal line.')
+    parser.add_argument('journal', action='store', help='Journal file.')
+    parser.add_argument('output', action='store', help='Output file.')
+    args = parser.parse_args()
+
+    size = os.path.getsize(args.output) if os.path.isfile(args.output) else 0
+    records = compact(args.journal, args.output)
+    print '%d targets completed; output truncated from %d to %d bytes' % (len(records),
+        size, records[-1][3] if records else 0)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+'''
+Extraction of Kepler lightcurves from FITS files. Both data loaders in :mod:`get_data`
+use these functions, which open each file exactly once, read the header once, and copy
+only the columns that the pipeline needs out of the binary table. PyFITS takes longer
+to import than NumPy, so it is imported by the readers on first use rather than with
+this module.
+'''
+
+import numpy as np
+from cStringIO import StringIO
+
+# Offset subtracted from BJD to obtain reduced barycentric Julian date.
+RBJD_OFFSET = 2400000.
+
+
+def read_lightcurve_file(path, keywords=None):
+    '''
+    Reads the lightcurve from the FITS file at the given path, which is memory-mapped
+    rather than read into memory. Raises RuntimeError if the file cannot be read. If
+    ``keywords`` is given, a dictionary with the values of those keywords in the primary
+    header is returned as a fourth element.
+
+    :param path: Path to the FITS file
+    :type path: str
+    :param keywords: Primary header keywords to return
+    :type keywords: list
+
+    :rtype: tuple
+    '''
+    import pyfits
+
+    try:
+        hdulist = pyfits.open(path, memmap=True)
+    except Exception:
+        raise RuntimeError
+
+    return __extract(hdulist, keywords)
+
+
+def read_lightcurve_string(data):
+    '''
+    Reads the lightcurve from the contents of a FITS file held in memory, e.g., as
+    downloaded from MAST. Raises RuntimeError if the data cannot be parsed.
+
+    :param data: Contents of the FITS file
+    :type data: str
+
+    :rtype: tuple
+    '''
+    import pyfits
+
+    try:
+        hdulist = pyfits.open(StringIO(data))
+    except Exception:
+        raise RuntimeError
+
+    return __extract(hdulist)
+
+
+def __extract(hdulist, keywords=None):
+    '''
+    Returns the time, PDC flux, and PDC flux error of every cadence without quality
+    flags as C-contiguous native-endian arrays, and closes the HDU list. Times are
+    converted to reduced barycentric Julian date, RBJD = BJD - 2400000.0.
+    '''
+    try:
+        header = hdulist[1].header
+        table = hdulist[1].data
+        bjd_trunci = float(header['bjdrefi'])
+        bjd_truncf = float(header['bjdreff'])
+
+        if keywords is not None:
+            meta = dict([(k, hdulist[0].header.get(k)) for k in keywords])
+
+        good = (table.field('SAP_QUALITY') == 0)
+        ngood = np.count_nonzero(good)
+
+        # Copy the good cadences of each column straight into native-endian arrays of the
+        # column's type; the mask is applied without building an index array.
+        time, pdcflux, pdcerror = [__compress(good, ngood, table.field(name))
+            for name in ['TIME', 'PDCSAP_FLUX', 'PDCSAP_FLUX_ERR']]
+    except Exception:
+        raise RuntimeError
+    finally:
+        hdulist.close()
+
+    time += bjd_trunci
+    time += bjd_truncf
+    time -= RBJD_OFFSET
+
+    if keywords is not None:
+        return time, pdcflux, pdcerror, meta
+
+    return time, pdcflux, pdcerror
+
+
+def __compress(mask, n, column):
+    '''
+    Returns the elements of ``column`` selected by ``mask``, which has ``n`` true values,
+    as a new native-endian array.
+    '''
+    out = np.empty((n,), dtype=column.dtype.newbyteorder('='))
+    return np.compress(mask, column, out=out)
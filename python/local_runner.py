@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Multi-core local runner. Reads a list of KIC IDs and quarter numbers from STDIN, like
+:mod:`get_data`, groups the requests by target, and hands the targets to worker
+processes through a bounded queue. Each worker runs the stages of :mod:`pipeline`
+(ingest, stitch and BLS) on the targets it takes, and sends the formatted output back
+through a second bounded queue; the runner writes it to STDOUT in the format of
+:mod:`drive_bls_pulse`, one target at a time in order of completion. Because workers
+take a new target whenever they finish one, slow targets do not hold up the others;
+targets are handed out most expensive first, as estimated by :mod:`cost`, so that the
+slowest targets do not start last and extend the run.
+The throughput of every worker is reported on STDERR at the end of the run.
+'''
+
+import os
+import sys
+import time
+import logging
+import threading
+import traceback
+import multiprocessing
+from Queue import Empty
+from argparse import ArgumentParser
+from get_data import init_parser as init_source_parser, get_loader, read_input, \
+    report_cache_stats
+from fits_cache import FITSCache
+from manifest import get_manifest
+from cost import longest_first
+from sharding import shard_requests
+from join_quarters import join_targets
+from pipeline import group_quarters, bls_stage
+from drive_bls_pulse import init_parser as init_bls_parser, read_options, format_output
+
+# Basic logging configuration.
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Message types sent from the workers to the runner.
+RESULT = 0
+DONE = 1
+ERROR = 2
+
+# Seconds the runner waits for a message before it checks that the workers are alive.
+POLL_INTERVAL = 1.
+
+
+def group_requests(data):
+    '''
+    Groups requests by target, i.e., by KIC ID and cadence, in order of first
+    appearance. Returns a list of lists of requests.
+
+    :param data: Requests of KIC ID, quarter and cadence
+    :type data: iterable
+
+    :rtype: list
+    '''
+    groups = {}
+    order = []
+
+    for kepler_id, quarter, suffix in data:
+        # Fix kepler_id missing zero-padding
+        if len(kepler_id) < 9:
+            kepler_id = str("%09d" % int(kepler_id))
+
+        key = (kepler_id, suffix)
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+
+        groups[key].append([kepler_id, quarter, suffix])
+
+    return [groups[key] for key in order]
+
+
+def run(tasks, config, nworkers, output=sys.stdout):
+    '''
+    Runs the given targets on ``nworkers`` worker processes and writes the output of
+    each target to ``output`` as soon as it is done. Returns a list with the statistics
+    of each worker: the number of targets, the number of output records, the elapsed
+    time in seconds, and the download cache counters. Raises RuntimeError if a worker
+    fails, or dies without reporting, e.g., when it is killed for running out of memory.
+
+    :param tasks: Targets to run, each a list of requests, as returned by
+        :func:`group_requests`
+    :type tasks: iterable
+    :param config: Worker configuration; the keyword arguments of
+        :func:`get_data.get_loader` except ``cache``, plus ``options``, the search
+        options, and optionally ``cachedir`` and ``cachesize``
+    :type config: dict
+    :param nworkers: Number of worker processes
+    :type nworkers: int
+    :param output: File to write the output to
+    :type output: file
+
+    :rtype: list
+    '''
+    # Both queues are bounded, so neither the task list nor the results pile up in
+    # memory when one side is faster than the other.
+    task_queue = multiprocessing.Queue(2 * nworkers)
+    result_queue = multiprocessing.Queue(4 * nworkers)
+
+    workers = [multiprocessing.Process(target=_worker, args=(i, task_queue, result_queue,
+        config)) for i in xrange(nworkers)]
+    for w in workers:
+        w.daemon = True
+        w.start()
+
+    # Feed the tasks from a separate thread, so that the results are drained while the
+    # task queue is full.
+    feeder = threading.Thread(target=__feed, args=(tasks, task_queue, nworkers))
+    feeder.daemon = True
+    feeder.start()
+
+    stats = [None] * nworkers
+    finished = 0
+
+    try:
+        while finished < nworkers:
+            try:
+                wid, kind, payload = result_queue.get(timeout=POLL_INTERVAL)
+            except Empty:
+                __check_workers(workers, stats, result_queue)
+                continue
+
+            if kind == RESULT:
+                output.write(payload + '\n')
+            elif kind == DONE:
+                stats[wid] = payload
+                finished += 1
+            else:
+                raise RuntimeError('Worker %d failed:\n%s' % (wid, payload))
+    finally:
+        if finished < nworkers:
+            for w in workers:
+                w.terminate()
+
+        for w in workers:
+            w.join()
+
+    return stats
+
+
+def __check_workers(workers, stats, result_queue):
+    '''
+    Raises RuntimeError if a worker that has not sent its statistics is no longer alive.
+    A worker flushes its messages before it exits, so if the result queue is empty, the
+    statistics of a dead worker will not come.
+    '''
+    for wid, w in enumerate(workers):
+        if stats[wid] is None and not w.is_alive() and result_queue.empty():
+            raise RuntimeError('Worker %d died with exit code %s before finishing its '
+                'tasks' % (wid, w.exitcode))
+
+
+def __feed(tasks, task_queue, nworkers):
+    for task in tasks:
+        task_queue.put(task)
+
+    # One sentinel per worker.
+    for _ in xrange(nworkers):
+        task_queue.put(None)
+
+
+def __take_requests(task_queue, counter):
+    '''
+    Yields the requests of the tasks in the queue until a sentinel is read, counting
+    the tasks.
+    '''
+    while True:
+        task = task_queue.get()
+        if task is None:
+            return
+
+        counter[0] += 1
+        for request in task:
+            yield request
+
+
+def _worker(wid, task_queue, result_queue, config):
+    '''
+    Worker process. Runs the pipeline stages over the tasks in ``task_queue`` and puts
+    the formatted output of every target on ``result_queue``, followed by the worker's
+    statistics.
+    '''
+    start = time.time()
+    counter = [0]
+    nrecords = 0
+
+    try:
+        config = dict(config)
+        options = config.pop('options')
+        cachedir = config.pop('cachedir', None)
+        cachesize = config.pop('cachesize', None)
+
+        cache = FITSCache(cachedir, cachesize) if cachedir is not None else None
+
+        loader = get_loader(data=__take_requests(task_queue, counter), cache=cache,
+            **config)
+
+        for k, q, out in bls_stage(join_targets(group_quarters(loader)), options):
+            text = format_output(k, q, out, options['direction'], options['fmt'])
+            nrecords += 1
+
+            if text is not None:
+                result_queue.put((wid, RESULT, text))
+
+        cache_stats = cache.stats() if cache is not None else {}
+        result_queue.put((wid, DONE, (counter[0], nrecords, time.time() - start,
+            cache_stats)))
+    except Exception:
+        result_queue.put((wid, ERROR, traceback.format_exc()))
+
+
+def report_throughput(stats, file=sys.stderr):
+    '''
+    Writes a table of the throughput of every worker.
+
+    :param stats: Worker statistics, as returned by :func:`run`
+    :type stats: list
+    :param file: File to write the table to
+    :type file: file
+    '''
+    file.write('{0: >7s} {1: >9s} {2: >9s} {3: >10s} {4: >10s}\n'.format('Worker',
+        'Targets', 'Records', 'Time (s)', 'Targets/s'))
+
+    for i, (ntargets, nrecords, elapsed, _) in enumerate(stats):
+        file.write('{0: >7d} {1: >9d} {2: >9d} {3: >10.2f} {4: >10.2f}\n'.format(i,
+            ntargets, nrecords, elapsed, ntargets / elapsed if elapsed > 0. else 0.))
+
+
+def main():
+    '''
+    Main function for this module. Parses all command line arguments, reads in the
+    requests from STDIN, and runs them on the worker processes.
+    '''
+    # The runner's --workers option, the number of worker processes, replaces the one
+    # of get_data.py.
+    parser = ArgumentParser(description="Retrieve Kepler lightcurve data given a set of "
+        "Kepler IDs and Quarter numbers from STDIN, and run the BLS pulse search on it "
+        "on several worker processes.", conflict_handler='resolve')
+    init_source_parser(parser)
+    init_bls_parser(parser=parser)
+    parser.add_argument("--workers", action="store", type=int, dest="nworkers",
+        default=multiprocessing.cpu_count(), help="[Optional] Number of worker "
+            "processes. Defaults to the number of CPUs.")
+    parser.add_argument("--schedule", action="store", choices=['cost', 'input'],
+        dest="schedule", default='cost', help="[Optional] Run the targets with the "
+            "highest estimated cost first, or in input order. Defaults to cost.")
+    args = parser.parse_args()
+    options = read_options(parser, args)
+
+    datapath = os.path.normpath(args.datapath)
+    manifest = args.manifest if args.source == 'disk' else None
+    files = None
+    if manifest is not None:
+        # Build the manifest once, before the workers would race to build it.
+        files = get_manifest(datapath, manifest or None)
+
+    data = read_input(sys.stdin, expand=manifest is None)
+    if args.shard is not None:
+        data = shard_requests(data, args.shard[0], args.shard[1], args.shard_method,
+            options, files)
+
+    tasks = group_requests(data)
+    if args.schedule == 'cost':
+        tasks = longest_first(tasks, options, files)
+
+    config = dict(source=args.source, datapath=datapath, nthreads=args.nthreads,
+        nworkers=1, tmin=args.tmin, tmax=args.tmax, manifest=manifest, options=options)
+    if args.source == 'mast' and args.cachedir is not None:
+        # Workers share the cache directory, each within the full byte budget.
+        config.update(cachedir=args.cachedir, cachesize=int(args.cachesize * 1024**2))
+
+    stats = run(tasks, config, max(args.nworkers, 1))
+    sys.stdout.flush()
+
+    report_throughput(stats)
+
+    if args.source == 'mast' and args.cachedir is not None:
+        totals = {}
+        for _, _, _, cache_stats in stats:
+            for name, value in cache_stats.items():
+                totals[name] = totals.get(name, 0) + value
+        report_cache_stats(totals)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        sys.stderr.write(str(e) + '\n')
+        sys.exit(1)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Manifest of the lightcurve files in a local Kepler data tree. The tree is walked once,
+and the KIC ID, cadence, quarter and size of every file are recorded, so the disk loader
+can resolve requests (including the ``*`` quarter wildcard) with dictionary lookups
+instead of trying to open every file name the quarter tables allow. Quarters are taken
+from the timestamp in each file name; files whose timestamps are not in the tables have
+their quarter read from the FITS header once, when the manifest is built.
+'''
+
+import os
+import re
+import json
+import logging
+from argparse import ArgumentParser
+from quarters import find_quarter, timestamp_order
+
+# Basic logging configuration.
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+MANIFEST_VERSION = 1
+
+# Name of the manifest file in the root of the data tree, unless given explicitly.
+MANIFEST_FILE = '.manifest.json'
+
+FITS_NAME = re.compile(r'^kplr(\d{9})-(\d{13})_(llc|slc)\.fits$')
+
+
+class Manifest(object):
+    '''
+    Maps KIC ID, cadence and quarter to the files on disk. Quarters are keys without
+    zero-padding, e.g. ``'3'``; paths are relative to the data root.
+    '''
+
+    def __init__(self, datapath, files):
+        '''
+        :param datapath: Root of the data tree
+        :type datapath: str
+        :param files: Nested dictionary ``{kic: {cadence: {quarter: [[path, size]]}}}``
+        :type files: dict
+        '''
+        self.datapath = datapath
+        self.files = files
+
+
+    def quarters(self, kepler_id, cadence):
+        '''
+        Returns the quarters available for the given target and cadence, in ascending
+        order.
+
+        :param kepler_id: Zero-padded KIC ID
+        :type kepler_id: str
+        :param cadence: Cadence identifier, ``llc`` or ``slc``
+        :type cadence: str
+
+        :rtype: list
+        '''
+        return sorted(self.files.get(kepler_id, {}).get(cadence, {}).keys(), key=int)
+
+
+    def paths(self, kepler_id, quarter, cadence):
+        '''
+        Returns the full paths of the files for the given target, quarter and cadence, or
+        an empty list if there are none.
+
+        :param kepler_id: Zero-padded KIC ID
+        :type kepler_id: str
+        :param quarter: Quarter number
+        :type quarter: str
+        :param cadence: Cadence identifier, ``llc`` or ``slc``
+        :type cadence: str
+
+        :rtype: list
+        '''
+        entries = self.files.get(kepler_id, {}).get(cadence, {}).get(str(int(quarter)), [])
+        return [os.path.join(self.datapath, p) for p, _ in entries]
+
+
+    def save(self, path):
+        '''
+        Writes the manifest to the given file atomically.
+
+        :param path: File to write
+        :type path: str
+        '''
+        tmppath = path + '.tmp%d' % os.getpid()
+        with open(tmppath, 'w') as f:
+            json.dump(dict(version=MANIFEST_VERSION, files=self.files), f)
+        os.rename(tmppath, path)
+
+
+    @classmethod
+    def load(cls, datapath, path):
+        '''
+        Reads a manifest of the tree at ``datapath`` from the given file.
+
+        :param datapath: Root of the data tree
+        :type datapath: str
+        :param path: File to read
+        :type path: str
+
+        :rtype: Manifest
+        '''
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+
+        if manifest['version'] != MANIFEST_VERSION:
+            raise ValueError('Unsupported manifest version: %s' % manifest['version'])
+
+        return cls(datapath, manifest['files'])
+
+
+def find_fits_files(datapath):
+    '''
+    Yields the KIC ID, timestamp, cadence and path of every lightcurve file in a tree laid
+    out as ``<root>/<nnnn>/<kic>/kplr<kic>-<timestamp>_<cadence>.fits``, grouped by KIC ID
+    and sorted by file name within a target.
+
+    :param datapath: Root of the data tree
+    :type datapath: str
+
+    :rtype: generator
+    '''
+    for prefix in sorted(os.listdir(datapath)):
+        prefixdir = os.path.join(datapath, prefix)
+        if not os.path.isdir(prefixdir):
+            continue
+
+        for kepler_id in sorted(os.listdir(prefixdir)):
+            kicdir = os.path.join(prefixdir, kepler_id)
+            if not os.path.isdir(kicdir):
+                continue
+
+            for name in sorted(os.listdir(kicdir)):
+                m = FITS_NAME.match(name)
+                if m is not None and m.group(1) == kepler_id:
+                    yield kepler_id, m.group(2), m.group(3), os.path.join(kicdir, name)
+
+
+def build_manifest(datapath):
+    '''
+    Walks the data tree once and returns its manifest.
+
+    :param datapath: Root of the data tree
+    :type datapath: str
+
+    :rtype: Manifest
+    '''
+    files = {}
+    entries = []
+
+    for kepler_id, timestamp, cadence, path in find_fits_files(datapath):
+        quarter = find_quarter(timestamp, cadence)
+        order = timestamp_order(timestamp, cadence)
+
+        if quarter is None:
+            # This timestamp is not in the tables; fall back to the FITS header.
+            import pyfits
+
+            try:
+                quarter = str(int(pyfits.getval(path, 'QUARTER', ext=0)))
+            except Exception:
+                logging.error('Cannot determine quarter of: ' + path)
+                continue
+
+        entries.append((kepler_id, cadence, quarter, order, timestamp,
+            os.path.relpath(path, datapath), os.path.getsize(path)))
+
+    # Within a quarter, keep the order of the quarter tables so that the output matches
+    # a lookup through the tables; unknown timestamps go last.
+    entries.sort(key=lambda e: (e[0], e[1], int(e[2]), e[3] is None, e[3], e[4]))
+
+    for kepler_id, cadence, quarter, _, _, relpath, size in entries:
+        files.setdefault(kepler_id, {}).setdefault(cadence, {}).setdefault(quarter,
+            []).append([relpath, size])
+
+    return Manifest(datapath, files)
+
+
+def get_manifest(datapath, path=None, rebuild=False):
+    '''
+    Returns the manifest of the given data tree, reading it from ``path`` (by default
+    ``.manifest.json`` in the root of the tree) if it exists. Otherwise the manifest is
+    built and, if possible, saved to ``path`` for later runs.
+
+    :param datapath: Root of the data tree
+    :type datapath: str
+    :param path: Manifest file
+    :type path: str
+    :param rebuild: Whether to rebuild the manifest even if the file exists
+    :type rebuild: bool
+
+    :rtype: Manifest
+    '''
+    if path is None:
+        path = os.path.join(datapath, MANIFEST_FILE)
+
+    if not rebuild and os.path.isfile(path):
+        return Manifest.load(datapath, path)
+
+    manifest = build_manifest(datapath)
+
+    try:
+        manifest.save(path)
+    except (IOError, OSError) as e:
+        logger.warning('Cannot save manifest to %s: %s' % (path, e))
+
+    return manifest
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Build the manifest of a local Kepler data tree.')
+    parser.add_argument('datapath', action='store', help='(Root) path to the Kepler '
+        'lightcurve data, such that root is the path part <root>/<nnnn>/<nnnnnnnnn>/.')
+    parser.add_argument('-o', '--output', action='store', dest='output', default=None,
+        help='[Optional] Manifest file to write. Defaults to %s in the data root.' %
+            MANIFEST_FILE)
+    args = parser.parse_args()
+
+    get_manifest(os.path.normpath(args.datapath), args.output, rebuild=True)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+In-process pipeline. Runs the same stages as the shell pipeline
+``get_data.py | sort | join_quarters.py | drive_bls_pulse.py`` as chained generators
+that pass NumPy arrays in memory, with no text encoding or extra processes between the
+stages. The output is identical to that of the shell pipeline. Each stage is the one the
+corresponding script runs, so the scripts are the text (Hadoop streaming) adapters
+around the stages:
+
+* load -- :func:`get_data.get_loader`, iterating over lightcurve records;
+* sort -- :func:`get_data.sort_requests` and :func:`join_quarters.group_quarters`,
+  which order the records as ``sort`` would, one target at a time;
+* join -- :func:`join_quarters.join_targets`;
+* search -- :func:`bls_stage`, running :func:`drive_bls_pulse.run_bls` per target.
+'''
+
+import sys
+import os
+import logging
+from argparse import ArgumentParser
+from get_data import init_parser as init_source_parser, get_loader, read_input, \
+    report_cache_stats, sort_requests
+from fits_cache import FITSCache
+from sharding import shard_requests
+from join_quarters import group_quarters, join_targets
+from drive_bls_pulse import init_parser as init_bls_parser, read_options, run_bls, \
+    format_output
+
+# Basic logging configuration.
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def bls_stage(targets, options):
+    '''
+    Runs the BLS pulse search on every joined target and yields the KIC ID, the
+    quarters, and the search output.
+
+    :param targets: Joined targets, as produced by :func:`join_quarters.join_targets`
+    :type targets: iterable
+    :param options: Search options, as returned by :func:`drive_bls_pulse.read_options`
+    :type options: dict
+
+    :rtype: generator
+    '''
+    for k, q, time, flux, fluxerr in targets:
+        yield k, q, run_bls(time, flux, fluxerr, options)
+
+
+def run_pipeline(source, data, datapath, options, cache=None, nthreads=1, nworkers=1,
+tmin=None, tmax=None, manifest=None):
+    '''
+    Chains all stages and yields the KIC ID, quarters, and search output of every
+    target. The arguments are as for :func:`get_data.get_loader`, plus the search
+    options.
+
+    :rtype: generator
+    '''
+    loader = get_loader(source, sort_requests(data), datapath, cache=cache,
+        nthreads=nthreads, nworkers=nworkers, tmin=tmin, tmax=tmax, manifest=manifest)
+
+    return bls_stage(join_targets(group_quarters(loader)), options)
+
+
+def main():
+    '''
+    Main function for this module. Reads in a list of KIC IDs and quarter numbers from
+    STDIN, and prints the search output in the format of :mod:`drive_bls_pulse`.
+    '''
+    parser = ArgumentParser(description="Retrieve Kepler lightcurve data given a set of "
+        "Kepler IDs and Quarter numbers from STDIN, and run the BLS pulse search on it "
+        "in a single process.")
+    init_source_parser(parser)
+    init_bls_parser(parser=parser)
+    args = parser.parse_args()
+    options = read_options(parser, args)
+
+    manifest = args.manifest if args.source == 'disk' else None
+    data = read_input(sys.stdin, expand=manifest is None)
+    if args.shard is not None:
+        data = shard_requests(data, args.shard[0], args.shard[1], args.shard_method)
+
+    cache = FITSCache(args.cachedir, int(args.cachesize * 1024**2)) if \
+        args.source == 'mast' and args.cachedir is not None else None
+
+    for k, q, out in run_pipeline(args.source, data, os.path.normpath(args.datapath),
+    options, cache=cache, nthreads=args.nthreads, nworkers=args.nworkers, tmin=args.tmin,
+    tmax=args.tmax, manifest=manifest):
+        text = format_output(k, q, out, options['direction'], options['fmt'])
+        if text is not None:
+            print text
+
+    if cache is not None:
+        report_cache_stats(cache.stats())
+
+
+if __name__ == '__main__':
+    main()
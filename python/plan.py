@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Run planner. Reads a list of KIC IDs and quarter numbers from STDIN, like
+:mod:`get_data`, and the search options of :mod:`drive_bls_pulse` (including its
+configuration file), and estimates what a run over the targets will take before it is
+launched:
+
+* CPU time, from the cost model of :mod:`cost`, scaled by a short calibration run of
+  the search on this machine;
+* peak memory per task, which is the memory of the Python process plus, for the
+  largest target, the copies of its lightcurve and the ``nsegments x nbins`` binned
+  segments and result matrices that :func:`bls_pulse_cython.bls_pulse` allocates;
+* the size of the output.
+
+Targets whose task would need more than ``--memory-limit`` megabytes are listed, and the
+planner then exits with an error. Searching long targets in blocks (see :mod:`blocks`)
+bounds the result matrices; ``--block-segments`` plans such a run.
+'''
+
+import sys
+import time
+import resource
+import logging
+import numpy as np
+from argparse import ArgumentParser
+from get_data import read_input
+from manifest import get_manifest
+from local_runner import group_requests
+from cost import SAMPLES_PER_DAY, DEFAULT_QUARTER_DAYS, search_cost, target_size
+from drive_bls_pulse import DEFAULTS, init_parser, read_options, run_bls, format_output
+
+# Basic logging configuration.
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Time, flux and flux error are held as float64 as read, as stitched, and decoded from
+# the text line that carries them between stages.
+LIGHTCURVE_BYTES = 3 * 8 * 3
+
+# Default per-task memory limit (MB).
+DEFAULT_MEMORY_LIMIT = 2048.
+
+# Output size without the key and quarters, by number of segments, compound search and
+# output format (see output_bytes).
+OUTPUT_BYTES = {}
+
+
+def calibrate(options, ndays=DEFAULT_QUARTER_DAYS):
+    '''
+    Times the search on synthetic long- and short-cadence lightcurves of ``ndays`` days
+    and returns the ratio of the measured to the estimated time, by which the estimates
+    of :func:`cost.search_cost` are scaled on this machine.
+
+    :param options: Search options, as returned by :func:`drive_bls_pulse.read_options`
+    :type options: dict
+    :param ndays: Length of the lightcurves (days)
+    :type ndays: float
+
+    :rtype: float
+    '''
+    np.random.seed(0)
+    measured = 0.
+    estimated = 0.
+
+    for per_day in [SAMPLES_PER_DAY['llc'], SAMPLES_PER_DAY['slc']]:
+        t = np.arange(0., ndays, 1. / per_day)
+        flux = 1. + 0.001 * np.random.randn(len(t))
+        fluxerr = np.ones_like(t) * 0.001
+
+        start = time.time()
+        run_bls(t, flux, fluxerr, dict(options, profile=False))
+        measured += time.time() - start
+        estimated += search_cost(len(t), ndays, options)
+
+    return measured / estimated
+
+
+def base_memory():
+    '''
+    Returns the peak memory of this process so far in bytes, i.e., of a Python process
+    with the pipeline modules loaded.
+
+    :rtype: int
+    '''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def target_memory(nsamples, nsegments, options, block_segments=None):
+    '''
+    Returns the memory in bytes that searching a target needs on top of the process
+    itself: the copies of the lightcurve, the binned time, flux, flux error and sample
+    counts of every segment, and the result matrices of the search plus one scratch
+    copy for maximizing over the bins. With ``block_segments``, the whole
+    lightcurve is only held by the split stage, and the search holds one block.
+
+    :param nsamples: Number of samples
+    :type nsamples: float
+    :param nsegments: Number of segments
+    :type nsegments: int
+    :param options: Search options, as returned by :func:`drive_bls_pulse.read_options`
+    :type options: dict
+    :param block_segments: Number of segments per block, if the target is split
+    :type block_segments: int
+
+    :rtype: float
+    '''
+    # Result matrices, the scratch copy, and the four rows of binned data.
+    nmatrices = (8 if options['direction'] == 2 else 4) + 1 + 4
+
+    if block_segments is None or block_segments >= nsegments:
+        return nsamples * LIGHTCURVE_BYTES + nmatrices * nsegments * \
+            options['nbins'] * 8.
+
+    search = nsamples * block_segments / float(nsegments) * LIGHTCURVE_BYTES + \
+        nmatrices * block_segments * options['nbins'] * 8.
+    return max(nsamples * LIGHTCURVE_BYTES, search)
+
+
+def output_bytes(k, q, nsegments, options):
+    '''
+    Returns the size in bytes of the output of a target, as written by
+    :func:`drive_bls_pulse.format_output`. The output of each number of segments is
+    formatted once and its size kept in :data:`OUTPUT_BYTES`.
+
+    :param k: KIC ID
+    :type k: str
+    :param q: Quarters, as listed by the join step
+    :type q: str
+    :param nsegments: Number of segments
+    :type nsegments: int
+    :param options: Search options, as returned by :func:`drive_bls_pulse.read_options`
+    :type options: dict
+
+    :rtype: int
+    '''
+    direction, fmt = options['direction'], options['fmt']
+    key = (nsegments, direction == 2, fmt)
+
+    if key not in OUTPUT_BYTES:
+        zeros = np.zeros((nsegments,), dtype='float64')
+        names = ['srsq_dip', 'duration_dip', 'depth_dip', 'midtime_dip', 'srsq_blip',
+            'duration_blip', 'depth_blip', 'midtime_blip'] if direction == 2 else \
+            ['srsq', 'duration', 'depth', 'midtime']
+        out = dict([(name, zeros) for name in ['segstart', 'segend'] + names])
+        text = format_output('', '', out, direction, fmt)
+        OUTPUT_BYTES[key] = len(text) + 1 if text is not None else 0
+
+    size = OUTPUT_BYTES[key]
+    return size + len(k) + len(q) if size else 0
+
+
+def plan_targets(tasks, options, manifest=None, factor=1., block_segments=None):
+    '''
+    Returns the estimates for every target as tuples of the key (KIC ID and cadence),
+    the CPU time in seconds, the memory in bytes on top of the process, and the output
+    size in bytes.
+
+    :param tasks: Targets, each a list of requests, as returned by
+        :func:`local_runner.group_requests`
+    :type tasks: list
+    :param options: Search options, as returned by :func:`drive_bls_pulse.read_options`
+    :type options: dict
+    :param manifest: Manifest of the data tree
+    :type manifest: manifest.Manifest
+    :param factor: Calibration factor of the CPU time, see :func:`calibrate`
+    :type factor: float
+    :param block_segments: Number of segments per block, if targets are split
+    :type block_segments: int
+
+    :rtype: list
+    '''
+    estimates = []
+
+    for task in tasks:
+        kepler_id, _, suffix = task[0]
+        key = kepler_id + '_' + suffix
+        nsamples, ndays = target_size(task, manifest)
+
+        if nsamples == 0:
+            estimates.append((key, 0., 0., 0))
+            continue
+
+        nsegments = int(np.floor(ndays / options['segment']) + 1)
+        quarters = str(["%02d" % int(q) for _, q, _ in task if q != '*'])
+
+        estimates.append((key, factor * search_cost(nsamples, ndays, options),
+            target_memory(nsamples, nsegments, options, block_segments),
+            output_bytes(key, quarters, nsegments, options)))
+
+    return estimates
+
+
+def report(estimates, base, limit, nworkers=None, factor=None, file=sys.stdout):
+    '''
+    Writes a summary of the estimates. Returns the keys of the targets whose tasks
+    would exceed the memory limit.
+
+    :param estimates: Estimates, as returned by :func:`plan_targets`
+    :type estimates: list
+    :param base: Memory of the process itself (bytes)
+    :type base: float
+    :param limit: Memory limit per task (bytes)
+    :type limit: float
+    :param nworkers: Number of workers to estimate the wall time for
+    :type nworkers: int
+    :param factor: Calibration factor, to report
+    :type factor: float
+    :param file: File to write the summary to
+    :type file: file
+
+    :rtype: list
+    '''
+    mb = 1024.**2
+    cpu = sum([e[1] for e in estimates])
+    largest = max(estimates, key=lambda e: e[2]) if estimates else ('-', 0., 0., 0)
+    longest = max(estimates, key=lambda e: e[1]) if estimates else ('-', 0., 0., 0)
+    over = [e[0] for e in estimates if base + e[2] > limit]
+
+    file.write('{0: <26s} {1:d}\n'.format('Targets:', len(estimates)))
+    if factor is not None:
+        file.write('{0: <26s} {1:.2f}\n'.format('Calibration factor:', factor))
+    file.write('{0: <26s} {1:.3f} CPU-hours\n'.format('Estimated CPU time:', cpu / 3600.))
+    file.write('{0: <26s} {1:.1f} s ({2})\n'.format('Longest target:', longest[1],
+        longest[0]))
+    if nworkers:
+        file.write('{0: <26s} {1:.3f} hours\n'.format('Wall time on %d workers:' %
+            nworkers, max(cpu / nworkers, longest[1]) / 3600.))
+    file.write('{0: <26s} {1:.1f} MB ({2}; process {3:.1f} MB)\n'.format(
+        'Peak memory per task:', (base + largest[2]) / mb, largest[0], base / mb))
+    file.write('{0: <26s} {1:.1f} MB\n'.format('Output:', sum([e[3] for e in
+        estimates]) / mb))
+
+    for key in over:
+        file.write('Exceeds the memory limit of {0:.0f} MB: {1}\n'.format(limit / mb, key))
+
+    return over
+
+
+def main():
+    '''
+    Main function for this module. Parses all command line arguments, reads in the
+    requests from STDIN, and writes the estimates to STDOUT.
+    '''
+    parser = ArgumentParser(description="Estimate the CPU time, memory and output size "
+        "of a run over a set of Kepler IDs and Quarter numbers from STDIN.")
+    init_parser(DEFAULTS, parser)
+    parser.add_argument("--datapath", action="store", dest="datapath", default=None,
+        help="[Optional] Root of a local data tree; with --manifest, the sizes of its "
+            "files are used instead of full quarters.")
+    parser.add_argument("--manifest", action="store", nargs='?', const='', dest="manifest",
+        default=None, help="[Optional] Manifest of the data tree, built if necessary. "
+            "Defaults to .manifest.json in the data directory.")
+    parser.add_argument("--memory-limit", action="store", type=float, dest="limit",
+        default=DEFAULT_MEMORY_LIMIT, help="[Optional] Memory limit per task in "
+            "megabytes.")
+    parser.add_argument("--workers", action="store", type=int, dest="nworkers",
+        default=None, help="[Optional] Also estimate the wall time on this many workers.")
+    parser.add_argument("--block-segments", action="store", type=int,
+        dest="block_segments", default=None, help="[Optional] Plan a run that searches "
+            "targets in blocks of this many segments.")
+    parser.add_argument("--no-calibrate", action="store_false", dest="calibrate",
+        default=True, help="[Optional] Use the cost model without a calibration run.")
+    args = parser.parse_args()
+    options = read_options(parser, args, DEFAULTS)
+
+    if args.manifest is not None and args.datapath is None:
+        parser.error('A manifest requires --datapath.')
+
+    manifest = get_manifest(args.datapath, args.manifest or None) if \
+        args.manifest is not None else None
+    tasks = group_requests(read_input(sys.stdin, expand=manifest is None))
+
+    base = base_memory()
+    factor = calibrate(options) if args.calibrate else None
+
+    estimates = plan_targets(tasks, options, manifest, factor or 1., args.block_segments)
+    over = report(estimates, base, args.limit * 1024.**2, args.nworkers, factor)
+
+    if over:
+        raise RuntimeError('%d target(s) exceed the memory limit' % len(over))
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        sys.stderr.write(str(e) + '\n')
+        sys.exit(1)
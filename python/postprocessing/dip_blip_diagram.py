@@ -85,21 +85,16 @@ def main(file_data, file_pipeline):
         _, _, segstart, segend, _, duration_dip, depth_dip, midtime_dip, \
             _, duration_blip, depth_blip, midtime_blip = out2
 
-        # Save the data in NumPy arrays.
-        time = np.array(time)
-        flux = np.array(flux)
-        fluxerr = np.array(fluxerr)
-
-        # Filter out NaNs in pipeline output and save parameters as arrays.
-        ndx = np.where(np.isfinite(depth_dip))
-        segstart = np.array(segstart)[ndx]
-        segend = np.array(segend)[ndx]
-        duration_dip = np.array(duration_dip)[ndx]
-        depth_dip = np.absolute(np.array(depth_dip)[ndx])
-        midtime_dip = np.array(midtime_dip)[ndx]
-        duration_blip = np.array(duration_blip)[ndx]
-        depth_blip = np.absolute(np.array(depth_blip)[ndx])
-        midtime_blip = np.array(midtime_blip)[ndx]
+        # Filter out NaNs in pipeline output.
+        ndx = np.isfinite(depth_dip)
+        segstart = segstart[ndx]
+        segend = segend[ndx]
+        duration_dip = duration_dip[ndx]
+        depth_dip = np.absolute(depth_dip[ndx])
+        midtime_dip = midtime_dip[ndx]
+        duration_blip = duration_blip[ndx]
+        depth_blip = np.absolute(depth_blip[ndx])
+        midtime_blip = midtime_blip[ndx]
 
         # This is needed for the plot interaction.
         data = np.column_stack((depth_dip,depth_blip))
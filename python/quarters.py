@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+'''
+Kepler quarters and the timestamps that appear in the names of the lightcurve files of
+each quarter.
+'''
+
+############################################################################################
+# Define the possible timestamps in the filename for a given Quarter as a global constant.
+# This allows the software to determine what Quarter a given file came from without having
+# to read the FITS header (since these timestamps are in the file name).
+############################################################################################
+NUM_QUARTERS = 17
+
+LONG_QUARTER_PREFIXES = {'0':['2009131105131'],
+                         '1':['2009166043257'],
+                         '2':['2009259160929'],
+                         '3':['2009350155506'],
+                         '4':['2010078095331','2010009091648'],
+                         '5':['2010174085026'],
+                         '6':['2010265121752'],
+                         '7':['2010355172524'],
+                         '8':['2011073133259'],
+                         '9':['2011177032512'],
+                         '10':['2011271113734'],
+                         '11':['2012004120508'],
+                         '12':['2012088054726'],
+                         '13':['2012179063303'],
+                         '14':['2012277125453'],
+                         '15':['2013011073258'],
+                         '16':['2013098041711'],
+                         '17':['2013131215648']}
+
+SHORT_QUARTER_PREFIXES = {'0':['2009131110544'],
+                          '1':['2009166044711'],
+                          '2':['2009201121230','2009231120729','2009259162342'],
+                          '3':['2009291181958','2009322144938','2009350160919'],
+                          '4':['2010009094841','2010019161129','2010049094358','2010078100744'],
+                          '5':['2010111051353','2010140023957','2010174090439'],
+                          '6':['2010203174610','2010234115140','2010265121752'],
+                          '7':['2010296114515','2010326094124','2010355172524'],
+                          '8':['2011024051157','2011053090032','2011073133259'],
+                          '9':['2011116030358','2011145075126','2011177032512'],
+                          '10':['2011208035123','2011240104155','2011271113734'],
+                          '11':['2011303113607','2011334093404','2012004120508'],
+                          '12':['2012032013838','2012060035710','2012088054726'],
+                          '13':['2012121044856','2012151031540','2012179063303'],
+                          '14':['2012211050319','2012242122129','2012277125453'],
+                          '15':['2012310112549','2012341132017','2013011073258'],
+                          '16':['2013017113907','2013065031647','2013098041711'],
+                          '17':['2013121191144','2013131215648']}
+############################################################################################
+
+
+def find_quarter(timestamp, cadence):
+    '''
+    Returns the quarter, as a string, of the file with the given timestamp and cadence,
+    or None if the timestamp is not in the tables.
+
+    :param timestamp: Timestamp from the file name
+    :type timestamp: str
+    :param cadence: Cadence identifier, ``llc`` or ``slc``
+    :type cadence: str
+
+    :rtype: str
+    '''
+    return __TIMESTAMP_QUARTERS.get((timestamp, cadence))
+
+
+def timestamp_order(timestamp, cadence):
+    '''
+    Returns the position of the given timestamp within its quarter's table entry, which
+    is the order in which the loaders read the files of a quarter, or None if the
+    timestamp is not in the tables.
+
+    :param timestamp: Timestamp from the file name
+    :type timestamp: str
+    :param cadence: Cadence identifier, ``llc`` or ``slc``
+    :type cadence: str
+
+    :rtype: int
+    '''
+    quarter = find_quarter(timestamp, cadence)
+    if quarter is None:
+        return None
+
+    table = LONG_QUARTER_PREFIXES if cadence == 'llc' else SHORT_QUARTER_PREFIXES
+    return table[quarter].index(timestamp)
+
+
+__TIMESTAMP_QUARTERS = dict([((t, 'llc'), q) for q, ts in LONG_QUARTER_PREFIXES.items()
+    for t in ts] + [((t, 'slc'), q) for q, ts in SHORT_QUARTER_PREFIXES.items() for t in ts])
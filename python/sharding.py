@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+'''
+Deterministic sharding of target lists. Several mapper processes or hosts can each be
+given the same list of requests and a shard ``i/N``; every process then keeps only the
+KIC IDs assigned to shard ``i``, with no coordination between the processes. All
+requests of a KIC ID go to the same shard. Two assignments are available:
+
+* ``hash`` assigns each KIC ID by a CRC-32 of its zero-padded form. It streams, and the
+  shard of a target never depends on the rest of the list.
+* ``cost`` reads the whole list, estimates the cost of searching each KIC ID with the
+  model of :mod:`cost`, and assigns the most expensive targets first, each to the
+  shard with the least total cost so far. Ties are broken by KIC ID and shard index, so
+  every process computes the same assignment.
+'''
+
+import zlib
+import heapq
+import argparse
+from cost import target_cost
+from drive_bls_pulse import DEFAULTS
+
+SHARD_METHODS = ['hash', 'cost']
+
+# Search options to estimate costs with when the search options are not known, as in
+# get_data.py: the defaults of drive_bls_pulse.py with a one-day trial segment.
+COST_OPTIONS = dict(segment=1., nbins=int(DEFAULTS['n_bins']),
+    mindur=float(DEFAULTS['min_duration']), maxdur=float(DEFAULTS['max_duration']))
+
+
+def parse_shard(s):
+    '''
+    Parses a shard specification ``i/N``, where ``0 <= i < N``, for use as an argparse
+    type. Returns the tuple (i, N).
+
+    :param s: Shard specification
+    :type s: str
+
+    :rtype: tuple
+    '''
+    try:
+        index, nshards = [int(x) for x in s.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('Shard must be given as i/N: %s' % s)
+
+    if nshards <= 0 or not 0 <= index < nshards:
+        raise argparse.ArgumentTypeError('Shard index must be in [0, N): %s' % s)
+
+    return index, nshards
+
+
+def shard_of(kepler_id, nshards):
+    '''
+    Returns the hash-assigned shard of the given KIC ID.
+
+    :param kepler_id: KIC ID, with or without zero-padding
+    :type kepler_id: str
+    :param nshards: Number of shards
+    :type nshards: int
+
+    :rtype: int
+    '''
+    return (zlib.crc32("%09d" % int(kepler_id)) & 0xffffffff) % nshards
+
+
+def estimate_cost(requests, options=None, manifest=None):
+    '''
+    Returns the estimated cost of searching one target, see :func:`cost.target_cost`.
+
+    :param requests: Requests of KIC ID, quarter and cadence of the target
+    :type requests: list
+    :param options: Search options, as returned by :func:`drive_bls_pulse.read_options`;
+        defaults to :data:`COST_OPTIONS`
+    :type options: dict
+    :param manifest: Manifest of the data tree
+    :type manifest: manifest.Manifest
+
+    :rtype: float
+    '''
+    return target_cost(requests, options or COST_OPTIONS, manifest)
+
+
+def assign_by_cost(costs, nshards):
+    '''
+    Assigns KIC IDs to shards, longest first, each to the shard with the least total
+    cost so far. Returns a dictionary from KIC ID to shard.
+
+    :param costs: Estimated cost of each zero-padded KIC ID
+    :type costs: dict
+    :param nshards: Number of shards
+    :type nshards: int
+
+    :rtype: dict
+    '''
+    loads = [(0., i) for i in xrange(nshards)]
+    assignment = {}
+
+    for kepler_id in sorted(costs, key=lambda k: (-costs[k], k)):
+        load, i = heapq.heappop(loads)
+        assignment[kepler_id] = i
+        heapq.heappush(loads, (load + costs[kepler_id], i))
+
+    return assignment
+
+
+def shard_requests(data, index, nshards, method='hash', options=None, manifest=None):
+    '''
+    Yields the requests of KIC IDs that belong to the given shard, in input order. The
+    search options and manifest, if given, refine the cost estimates of the ``cost``
+    method.
+
+    :param data: Requests of KIC ID, quarter and cadence
+    :type data: iterable
+    :param index: Shard to keep
+    :type index: int
+    :param nshards: Number of shards
+    :type nshards: int
+    :param method: Assignment method, ``hash`` or ``cost``
+    :type method: str
+    :param options: Search options, as returned by :func:`drive_bls_pulse.read_options`
+    :type options: dict
+    :param manifest: Manifest of the data tree
+    :type manifest: manifest.Manifest
+
+    :rtype: generator
+    '''
+    if method == 'hash':
+        for request in data:
+            if shard_of(request[0], nshards) == index:
+                yield request
+    elif method == 'cost':
+        data = list(data)
+        targets = {}
+
+        for request in data:
+            targets.setdefault("%09d" % int(request[0]), []).append(request)
+
+        costs = dict([(kepler_id, estimate_cost(requests, options, manifest))
+            for kepler_id, requests in targets.iteritems()])
+        assignment = assign_by_cost(costs, nshards)
+
+        for request in data:
+            if assignment["%09d" % int(request[0])] == index:
+                yield request
+    else:
+        raise ValueError('Invalid sharding method: %s' % method)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Import-time report of the command line entry points. Streaming tasks are short-lived,
+so the time an entry point takes to import its modules is paid again by every task.
+Each entry point is imported in a fresh interpreter, as a task would import it, with
+``__import__`` wrapped to time every module loaded on the way; the time of a module
+excludes the modules it imports in turn, and is summed per top-level package. The
+report lists the median import time of each entry point over several runs, its
+heaviest packages, and the startup time of the interpreter itself. Entry points over
+their budget are listed, and the command then exits with an error::
+
+    python startup.py
+    python startup.py drive_bls_pulse --repeat 10 --budget 120
+'''
+
+import os
+import sys
+import subprocess
+from time import time as now
+from ast import literal_eval
+from argparse import ArgumentParser
+
+# Import-time budgets of the entry points (ms). NumPy alone takes most of these.
+STARTUP_BUDGETS = {'get_data':200., 'join_quarters':160., 'drive_bls_pulse':160.,
+    'bls_client':60.}
+
+# Entry points in the order they are reported.
+ENTRY_POINTS = ['get_data', 'join_quarters', 'drive_bls_pulse', 'bls_client']
+
+# Run in the fresh interpreter. It only uses modules the interpreter has loaded at
+# startup, so that none of the modules of the entry point are loaded before timing.
+CHILD_CODE = '''
+import sys, time, __builtin__
+_import = __builtin__.__import__
+_stack = [0.]
+_times = {}
+def _timed(name, *args, **kwargs):
+    before = len(sys.modules)
+    _stack.append(0.)
+    start = time.time()
+    try:
+        module = _import(name, *args, **kwargs)
+    finally:
+        elapsed = time.time() - start
+        inner = _stack.pop()
+        _stack[-1] += elapsed
+    if len(sys.modules) != before:
+        key = module.__name__.split('.')[0]
+        _times[key] = _times.get(key, 0.) + elapsed - inner
+    return module
+__builtin__.__import__ = _timed
+start = time.time()
+import %s
+total = time.time() - start
+__builtin__.__import__ = _import
+sys.stdout.write(repr((total, _times)))
+'''
+
+
+def interpreter_startup(repeat=5):
+    '''
+    Returns the median wall time in seconds of starting and stopping the interpreter.
+
+    :param repeat: Number of runs
+    :type repeat: int
+
+    :rtype: float
+    '''
+    times = []
+
+    for _ in xrange(repeat):
+        start = now()
+        subprocess.check_call([sys.executable, '-c', 'pass'])
+        times.append(now() - start)
+
+    return sorted(times)[len(times) // 2]
+
+
+def import_time(module, repeat=5):
+    '''
+    Imports a module in ``repeat`` fresh interpreters and returns the median import time
+    in seconds, and a dictionary of the time spent loading each top-level package in
+    that run. Raises RuntimeError if the module cannot be imported.
+
+    :param module: Name of the module
+    :type module: str
+    :param repeat: Number of runs
+    :type repeat: int
+
+    :rtype: tuple
+    '''
+    runs = []
+    cwd = os.path.dirname(os.path.abspath(__file__))
+
+    for _ in xrange(repeat):
+        proc = subprocess.Popen([sys.executable, '-W', 'ignore', '-c', CHILD_CODE %
+            module], cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+        if proc.returncode != 0:
+            raise RuntimeError('Cannot import %s:\n%s' % (module, err))
+        runs.append(literal_eval(out))
+
+    return sorted(runs, key=lambda run: run[0])[len(runs) // 2]
+
+
+def report(results, interpreter, budgets, top=4, file=sys.stdout):
+    '''
+    Writes the import times of the entry points. Returns the entry points over their
+    budget.
+
+    :param results: Pairs of entry point and its result of :func:`import_time`
+    :type results: list
+    :param interpreter: Startup time of the interpreter (s)
+    :type interpreter: float
+    :param budgets: Budget of each entry point (ms)
+    :type budgets: dict
+    :param top: Number of packages to list per entry point
+    :type top: int
+    :param file: File to write the report to
+    :type file: file
+
+    :rtype: list
+    '''
+    over = []
+
+    file.write('{0: <18s} {1: >11s} {2: >11s}  {3}\n'.format('Entry point', 'Import (ms)',
+        'Budget (ms)', 'Heaviest imports (ms)'))
+
+    for module, (total, times) in results:
+        budget = budgets.get(module)
+        heaviest = sorted(times.items(), key=lambda item: -item[1])[:top]
+        file.write('{0: <18s} {1: >11.1f} {2: >11s}  {3}\n'.format(module, total * 1000.,
+            '%.1f' % budget if budget is not None else '-', ', '.join(['%s %.1f' %
+            (name, t * 1000.) for name, t in heaviest])))
+
+        if budget is not None and total * 1000. > budget:
+            over.append(module)
+
+    file.write('Interpreter startup: {0:.1f} ms\n'.format(interpreter * 1000.))
+    for module in over:
+        file.write('Over budget: {0}\n'.format(module))
+
+    return over
+
+
+def main():
+    '''
+    Main function for this module. Parses the command line arguments, times the entry
+    points and writes the report to STDOUT.
+    '''
+    parser = ArgumentParser(description="Report the import time of the command line "
+        "entry points.")
+    parser.add_argument('modules', action='store', nargs='*', default=ENTRY_POINTS,
+        help='[Optional] Entry points to time. Defaults to all of them.')
+    parser.add_argument('--repeat', action='store', type=int, dest='repeat', default=5,
+        help='[Optional] Number of runs per entry point; the median is reported.')
+    parser.add_argument('--budget', action='store', type=float, dest='budget',
+        default=None, help='[Optional] Budget in milliseconds for all entry points, '
+            'instead of the default budget of each.')
+    parser.add_argument('--top', action='store', type=int, dest='top', default=4,
+        help='[Optional] Number of packages to list per entry point.')
+    args = parser.parse_args()
+
+    budgets = dict([(m, args.budget) for m in args.modules]) if args.budget is not None \
+        else STARTUP_BUDGETS
+    results = [(m, import_time(m, args.repeat)) for m in args.modules]
+    over = report(results, interpreter_startup(args.repeat), budgets, args.top)
+
+    if over:
+        raise RuntimeError('%d entry point(s) over budget' % len(over))
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        sys.stderr.write(str(e) + '\n')
+        sys.exit(1)
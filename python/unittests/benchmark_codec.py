@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Measures encode/decode throughput of the array codec in :mod:`utils` against the legacy
+JSON + zlib + base64 path, in megabytes of float64 data per second.
+'''
+
+import json
+import zlib
+import base64
+import numpy as np
+from time import clock
+from utils import encode_array, decode_array
+
+
+def __legacy_encode(arr):
+    return base64.b64encode(zlib.compress(json.dumps(arr.tolist())))
+
+
+def __legacy_decode(s):
+    return np.array(json.loads(zlib.decompress(base64.b64decode(s))), dtype='float64')
+
+
+def __throughput(func, arg, nbytes, ntrials):
+    start = clock()
+    for _ in xrange(ntrials):
+        out = func(arg)
+    end = clock()
+
+    return nbytes * ntrials / (end - start) / 1e6, out
+
+
+def main():
+    # Roughly one long-cadence quarter, one short-cadence month and a stitched
+    # short-cadence target.
+    sizes = [4400, 44000, 1500000]
+    ntrials = 5
+
+    np.random.seed(4)
+
+    codecs = [('legacy', __legacy_encode, __legacy_decode),
+        ('binary', encode_array, decode_array),
+        ('binary+zlib', lambda a: encode_array(a, compress=True), decode_array)]
+
+    print '{0: <12s} {1: >9s} {2: >14s} {3: >14s} {4: >12s}'.format('Codec', 'Samples',
+        'Encode (MB/s)', 'Decode (MB/s)', 'Size ratio')
+
+    for n in sizes:
+        arr = np.cumsum(np.random.normal(size=(n,)))
+
+        for name, encode, decode in codecs:
+            enc, s = __throughput(encode, arr, arr.nbytes, ntrials)
+            dec, _ = __throughput(decode, s, arr.nbytes, ntrials)
+            print '{0: <12s} {1: >9d} {2: >14.1f} {3: >14.1f} {4: >12.3f}'.format(name, n,
+                enc, dec, float(len(s)) / arr.nbytes)
+
+
+if __name__ == '__main__':
+    main()
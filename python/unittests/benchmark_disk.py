@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Measures the throughput of the disk loader in files per second for increasing numbers
+of worker processes. A temporary data tree is populated with links to the bundled FITS
+file, so the files are served from the page cache and the benchmark measures CPU
+scaling rather than disk bandwidth.
+
+Workers send the arrays of each file back to the parent process, which encodes them;
+the time of that pickle round trip and of the encoding are reported per file first.
+'''
+
+import sys
+import cPickle
+import shutil
+import tempfile
+import multiprocessing
+from time import time
+from cStringIO import StringIO
+from argparse import ArgumentParser
+from fits_server import FITS_FILE, make_fits_tree
+from get_data import DiskDataLoader, format_record
+from kepler_fits import read_lightcurve_file
+
+
+def __record_costs(path, repeat=20):
+    '''
+    Returns the time in seconds of sending the arrays of one file from a worker to the
+    parent process, as the process pool pickles them, and of encoding them.
+    '''
+    arrays = read_lightcurve_file(path)
+    arrays = tuple([a.copy() for a in arrays])
+
+    start = time()
+    for _ in xrange(repeat):
+        cPickle.loads(cPickle.dumps(arrays, cPickle.HIGHEST_PROTOCOL))
+    pickling = (time() - start) / repeat
+
+    start = time()
+    for _ in xrange(repeat):
+        format_record(('000000001_llc', '03', path) + arrays)
+    encoding = (time() - start) / repeat
+
+    return pickling, encoding
+
+
+def main(nfiles):
+    root = tempfile.mkdtemp()
+
+    try:
+        data = [['%09d' % (i + 1), '3', 'llc'] for i in xrange(nfiles)]
+        make_fits_tree(root, [kepler_id for kepler_id, _, _ in data])
+        workers = [1, 2, 4, 8, 16, 32]
+        workers = [w for w in workers if w <= 2 * multiprocessing.cpu_count()]
+
+        pickling, encoding = __record_costs(FITS_FILE)
+        print 'Pickle round trip: {0:.2f} ms per file; encoding: {1:.2f} ms per ' \
+            'file'.format(pickling * 1000., encoding * 1000.)
+
+        print '{0: >8s} {1: >12s} {2: >12s}'.format('Workers', 'Time (s)', 'Files/s')
+
+        for n in workers:
+            stdout = sys.stdout
+            sys.stdout = StringIO()
+
+            try:
+                start = time()
+                DiskDataLoader(iter(data), root, nworkers=n)
+                end = time()
+            finally:
+                sys.stdout = stdout
+
+            print '{0: >8d} {1: >12.2f} {2: >12.1f}'.format(n, end - start,
+                nfiles / (end - start))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-n', '--nfiles', help='Number of files to read',
+        default=200, dest='nfiles', type=int)
+    args = parser.parse_args()
+
+    main(args.nfiles)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Measures the throughput of the MAST downloader against the local HTTP stand-in, which
+serves the bundled FITS file with injected latency, for increasing numbers of download
+threads. No network access is needed.
+'''
+
+import sys
+from time import time
+from cStringIO import StringIO
+from argparse import ArgumentParser
+from fits_server import FITSServer
+from get_data import MASTDataDownloader
+from fetch import HTTPFetcher
+
+
+def main(latency, nfiles):
+    # Short-cadence quarters have three files each.
+    data = [['%09d' % i, '5', 'slc'] for i in xrange(nfiles // 3)]
+    threads = [1, 2, 4, 8, 16, 32]
+
+    print '{0: >8s} {1: >12s} {2: >12s}'.format('Threads', 'Time (s)', 'Files/s')
+
+    for n in threads:
+        with FITSServer(latency=latency) as server:
+            stdout = sys.stdout
+            sys.stdout = StringIO()
+
+            try:
+                start = time()
+                # Lift the per-host limit so that only the thread count matters.
+                fetcher = HTTPFetcher(per_host=n)
+                MASTDataDownloader(iter(data), base_url=server.url, nthreads=n,
+                    fetcher=fetcher)
+                end = time()
+                fetcher.close()
+            finally:
+                sys.stdout = stdout
+
+            nrequests = len(server.requests)
+
+        print '{0: >8d} {1: >12.2f} {2: >12.1f}'.format(n, end - start,
+            nrequests / (end - start))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-l', '--latency', help='Latency per request (seconds)',
+        default=0.2, dest='latency', type=float)
+    parser.add_argument('-n', '--nfiles', help='Number of files to download',
+        default=64, dest='nfiles', type=int)
+    args = parser.parse_args()
+
+    main(args.latency, args.nfiles)
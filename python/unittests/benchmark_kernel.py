@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Compares the search kernels of :mod:`bls_pulse_cython` as the duration range grows. The
+exhaustive kernel extends the events from each start bin one bin at a time, so it does
+work in proportion to the maximum duration, and works out the flux sum, sample count
+and extreme flux of the first minimum-duration bins of each event again for every
+start bin. The sliding kernel takes the sample count from prefix sums and the extreme
+flux from a sliding window, and only adds up the flux bin by bin, so that its output
+stays identical; it saves time as the minimum duration grows. The pruned kernel bounds
+the best event from each start bin, and skips the start bins that cannot beat the best
+event found so far. The search time per segment is reported for each kernel over a
+range of maximum durations, and then of minimum durations with the range held fixed,
+along with the share of start bins the pruned kernel skipped and whether the outputs
+of all kernels are identical::
+
+    python -m unittests.benchmark_kernel --nbins 1000 --direction -1
+'''
+
+import numpy as np
+from time import time as now
+from argparse import ArgumentParser
+from bls_pulse_cython import bls_pulse
+
+np.seterr(all='ignore')
+
+KERNELS = ['exhaustive', 'sliding', 'pruned']
+
+
+def __make_lightcurve(ndays):
+    # Short cadence, so that every bin is filled; the flux is relative, as detrending
+    # leaves it.
+    np.random.seed(4)
+    time = np.arange(0., ndays, 1. / 1440.)
+    flux = 0.0005 * np.random.randn(len(time))
+    flux[np.abs(np.mod(time, 3.1) - 1.) < 0.05] -= 0.005
+    fluxerr = np.ones_like(time) * 0.0005
+    return time, flux, fluxerr
+
+
+def __time_kernels(time, flux, fluxerr, nbins, segsize, mindur, maxdur, direction,
+        repeat):
+    times, outs = [], []
+
+    for kernel in KERNELS:
+        best = None
+        for _ in xrange(repeat):
+            start = now()
+            out = bls_pulse(time.copy(), flux, fluxerr, nbins, segsize, mindur, maxdur,
+                detrend_order=0, direction=direction, kernel=kernel)
+            elapsed = now() - start
+            best = elapsed if best is None else min(best, elapsed)
+        times.append(best)
+        outs.append(out)
+
+    skipped = np.sum(outs[2].pop('pruned')) / float(len(outs[2]['segstart']) * nbins)
+    identical = all([out[name].tostring() == outs[0][name].tostring() for out in outs[1:]
+        for name in outs[0]])
+    return times, skipped, identical
+
+
+def main():
+    parser = ArgumentParser(description="Time the search kernels of bls_pulse_cython.")
+    parser.add_argument('--nbins', action='store', type=int, dest='nbins', default=1000,
+        help='[Optional] Number of bins per segment.')
+    parser.add_argument('--segment', action='store', type=float, dest='segment',
+        default=2., help='[Optional] Trial segment (days).')
+    parser.add_argument('--days', action='store', type=float, dest='days', default=20.,
+        help='[Optional] Length of the lightcurve (days).')
+    parser.add_argument('--repeat', action='store', type=int, dest='repeat', default=3,
+        help='[Optional] Number of runs per point; the fastest is reported.')
+    parser.add_argument('--direction', action='store', type=int, dest='direction',
+        default=2, help='[Optional] Signal direction to search for.')
+    args = parser.parse_args()
+
+    time, flux, fluxerr = __make_lightcurve(args.days)
+    nsegments = np.floor(args.days / args.segment) + 1
+    binsize = args.segment / args.nbins
+
+    header = '{0: <10s} {1: <10s} {2: >15s} {3: >12s} {4: >12s} {5: >11s} ' \
+        '{6: >12s}'.format('Min (bins)', 'Max (bins)', 'Exhaustive (ms)', 'Sliding (ms)',
+        'Pruned (ms)', 'Skipped (%)', 'Identical')
+    row = '{0: <10d} {1: <10d} {2: >15.3f} {3: >12.3f} {4: >12.3f} {5: >11.1f} ' \
+        '{6: >12s}'
+
+    cases = [(0.01, m) for m in [0.05, 0.1, 0.25, 0.5, 1.]] + \
+        [(m, m + 0.25) for m in [0.05, 0.1, 0.25, 0.5, 0.75]]
+
+    print header
+    for mindur, maxdur in cases:
+        times, skipped, identical = __time_kernels(time, flux, fluxerr, args.nbins,
+            args.segment, mindur, maxdur, args.direction, args.repeat)
+        print row.format(int(np.floor(mindur / binsize)), int(np.ceil(maxdur / binsize)),
+            *([t / nsegments * 1000. for t in times] + [skipped * 100., 'yes' if
+            identical else 'no']))
+
+
+if __name__ == '__main__':
+    main()
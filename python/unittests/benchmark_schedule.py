@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Measures how well the cost model of :mod:`cost` balances a skewed target list. The BLS
+pulse search is timed on synthetic lightcurves of a mix of long- and short-cadence
+targets with different numbers of quarters, and the measured times are used to
+simulate
+
+* local execution on several workers, with the targets handed out in input order or
+  most expensive first (:func:`cost.longest_first`), and
+* Hadoop reducers, with the targets partitioned by a hash of the KIC ID or assigned by
+  estimated cost (:func:`sharding.assign_by_cost`).
+
+The makespan is reported relative to a perfect split of the total time.
+'''
+
+import heapq
+import random
+import numpy as np
+from time import time as now
+from argparse import ArgumentParser
+from drive_bls_pulse import run_bls
+from sharding import assign_by_cost
+from cost import SAMPLES_PER_DAY, DEFAULT_QUARTER_DAYS, target_cost, longest_first, \
+    partition_of
+
+np.seterr(all='ignore')
+
+OPTIONS = dict(segment=2., mindur=0.02, maxdur=0.5, nbins=1000, direction=2,
+    mode='cython', profile=False)
+
+
+def __make_tasks(ntargets):
+    random.seed(11)
+    tasks = []
+
+    for i in xrange(ntargets):
+        kepler_id = '%09d' % (i + 1)
+        suffix = 'slc' if random.random() < 0.05 else 'llc'
+        nquarters = random.choice([1, 1, 2, 4, 8, 15]) if suffix == 'llc' else \
+            random.randint(1, 3)
+        quarters = random.sample(xrange(2, 17), nquarters)
+        tasks.append([[kepler_id, str(q), suffix] for q in quarters])
+
+    return tasks
+
+
+def __time_task(task):
+    ndays = DEFAULT_QUARTER_DAYS * len(task)
+    time = np.arange(0., ndays, 1. / SAMPLES_PER_DAY[task[0][2]])
+    flux = 1. + 0.001 * np.random.randn(len(time))
+    fluxerr = np.ones_like(time) * 0.001
+
+    start = now()
+    run_bls(time, flux, fluxerr, OPTIONS)
+    return now() - start
+
+
+def __makespan(times, nworkers):
+    # Every worker takes the next target as soon as it is free.
+    workers = [0.] * nworkers
+    for t in times:
+        heapq.heappush(workers, heapq.heappop(workers) + t)
+    return max(workers)
+
+
+def main(ntargets, nworkers):
+    tasks = __make_tasks(ntargets)
+
+    print 'Timing %d targets ...' % ntargets
+    measured = dict([(task[0][0], __time_task(task)) for task in tasks])
+    estimated = dict([(task[0][0], target_cost(task, OPTIONS)) for task in tasks])
+    ideal = sum(measured.values()) / nworkers
+
+    keys = sorted(measured)
+    print 'Correlation of estimated and measured times: %.3f' % np.corrcoef(
+        [estimated[k] for k in keys], [measured[k] for k in keys])[0, 1]
+    print 'Total time: %.2f s; longest target: %.2f s' % (sum(measured.values()),
+        max(measured.values()))
+    print
+    print '{0: <24s} {1: >12s} {2: >12s}'.format('%d workers' % nworkers, 'Makespan (s)',
+        'vs. ideal')
+
+    for name, order in [('Local, input order', tasks),
+    ('Local, longest first', longest_first(tasks, OPTIONS))]:
+        makespan = __makespan([measured[task[0][0]] for task in order], nworkers)
+        print '{0: <24s} {1: >12.2f} {2: >12.3f}'.format(name, makespan, makespan / ideal)
+
+    assignment = assign_by_cost(estimated, nworkers)
+    for name, reducer in [('Reducers, hash', lambda k: partition_of(k, nworkers)),
+    ('Reducers, cost', lambda k: assignment[k])]:
+        loads = [0.] * nworkers
+        for k in keys:
+            loads[reducer(k)] += measured[k]
+        print '{0: <24s} {1: >12.2f} {2: >12.3f}'.format(name, max(loads),
+            max(loads) / ideal)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-n', '--ntargets', help='Number of targets', default=200,
+        dest='ntargets', type=int)
+    parser.add_argument('-w', '--workers', help='Number of workers or reducers',
+        default=16, dest='nworkers', type=int)
+    args = parser.parse_args()
+
+    main(args.ntargets, args.nworkers)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+'''
+Local HTTP stand-in for the MAST archive, used by the download tests and benchmarks.
+Every request for a path ending in ``.fits`` is answered with the bundled Kepler
+lightcurve file, with ETag/Last-Modified validators so conditional requests can be
+exercised. The server speaks HTTP/1.1 with keep-alive, handles each connection on its own
+thread, and can inject latency, transient failures and redirects.
+'''
+
+import os
+import time
+import threading
+import SocketServer
+import BaseHTTPServer
+from email.utils import formatdate
+
+FITS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+    'kplr011138155-2009350155506_llc.fits')
+
+
+def make_fits_tree(root, kepler_ids, timestamp='2009350155506', cadence='llc'):
+    '''
+    Populates ``root`` with links to the bundled FITS file, laid out like the MAST
+    archive, for each of the given KIC IDs. By default the files are named like the
+    quarter 3 long-cadence file that the bundled file is.
+    '''
+    for kepler_id in kepler_ids:
+        dirname = os.path.join(root, kepler_id[0:4], kepler_id)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        os.symlink(os.path.abspath(FITS_FILE), os.path.join(dirname, 'kplr' + kepler_id +
+            '-' + timestamp + '_' + cadence + '.fits'))
+
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class _FITSRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections.append(self.client_address)
+
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.path)
+        time.sleep(server.latency)
+
+        if len(server.requests) <= server.fail_first:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if server.redirect is not None or self.path.startswith('/moved/'):
+            # Redirect to the same path on another server, or to the path without its
+            # first part on this one.
+            location = server.redirect + self.path[1:] if server.redirect is not None \
+                else self.path[len('/moved'):]
+            self.send_response(301)
+            self.send_header('Location', location)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if not self.path.endswith('.fits'):
+            self.send_error(404)
+            return
+
+        if self.headers.get('If-None-Match') == server.etag:
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/fits')
+        self.send_header('Content-Length', str(len(server.data)))
+        self.send_header('ETag', server.etag)
+        self.send_header('Last-Modified', server.last_modified)
+        self.end_headers()
+        self.wfile.write(server.data)
+
+
+    def log_message(self, format, *args):
+        # Keep the test output clean.
+        pass
+
+
+class FITSServer(object):
+    '''
+    Serves the bundled FITS file on a free localhost port from a background thread.
+    Use as a context manager; ``url`` is the base URL to pass to the downloader,
+    ``requests`` lists every path that was requested and ``connections`` every TCP
+    connection that was accepted. Each response is delayed by ``latency`` seconds, and
+    the first ``fail_first`` requests are answered with status 503. Requests for paths
+    under ``/moved/`` are redirected to the path without that part, and if ``redirect``
+    is set to the base URL of another server, every request is redirected to it.
+    '''
+
+    def __init__(self, fits_file=FITS_FILE, latency=0., fail_first=0, redirect=None):
+        self.httpd = _ThreadingHTTPServer(('127.0.0.1', 0), _FITSRequestHandler)
+        self.httpd.requests = []
+        self.httpd.connections = []
+        self.httpd.latency = latency
+        self.httpd.fail_first = fail_first
+        self.httpd.redirect = redirect
+
+        with open(fits_file, 'rb') as f:
+            self.httpd.data = f.read()
+
+        self.httpd.etag = '"%x"' % hash(self.httpd.data)
+        self.httpd.last_modified = formatdate(os.path.getmtime(fits_file), usegmt=True)
+
+        self.url = 'http://127.0.0.1:%d/' % self.httpd.server_address[1]
+        self.requests = self.httpd.requests
+        self.connections = self.httpd.connections
+        self.thread = None
+
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+
+    def __enter__(self):
+        self.start()
+        return self
+
+
+    def __exit__(self, *args):
+        self.stop()
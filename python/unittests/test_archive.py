@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+from cStringIO import StringIO
+import archive
+import get_data
+from archive import build_archive, ArchiveReader
+from fits_server import make_fits_tree, FITS_FILE
+from get_data import ArchiveDataLoader, DiskDataLoader
+from kepler_fits import read_lightcurve_file
+
+
+def __capture(func, *args, **kwargs):
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+
+    try:
+        func(*args, **kwargs)
+        return sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+
+
+def __write_without_quarter(root, kepler_id):
+    import pyfits
+
+    dirname = os.path.join(root, kepler_id[0:4], kepler_id)
+    os.makedirs(dirname)
+    hdulist = pyfits.open(FITS_FILE)
+    del hdulist[0].header['QUARTER']
+    hdulist.writeto(os.path.join(dirname, 'kplr%s-2009350155506_llc.fits' % kepler_id))
+    hdulist.close()
+
+
+class _CountingReader(ArchiveReader):
+    lookups = 0
+
+    def entries(self, kepler_id):
+        _CountingReader.lookups += 1
+        return ArchiveReader.entries(self, kepler_id)
+
+
+def main():
+    root = tempfile.mkdtemp()
+
+    try:
+        kepler_ids = ['011138155', '001234567', '011446443']
+        make_fits_tree(root + '/data', kepler_ids)
+        make_fits_tree(root + '/data', kepler_ids[:1], timestamp='2009350160919',
+            cadence='slc')
+        __write_without_quarter(root + '/data', '000000002')
+
+        print 'TEST_ARCHIVE: Building archive ...'
+        n = build_archive(root + '/data', root + '/archive', chunk_size=500)
+        if n != 4:
+            raise RuntimeError('Archived %d files instead of 4' % n)
+
+        reader = ArchiveReader(root + '/archive')
+        expected = read_lightcurve_file(FITS_FILE)
+
+        print 'TEST_ARCHIVE: Full lightcurves are restored ...'
+        for kepler_id in kepler_ids:
+            for entry in reader.entries(kepler_id):
+                for a, b in zip(reader.read(entry), expected):
+                    if a.dtype != b.dtype or not np.array_equal(a.view(np.uint8),
+                    b.view(np.uint8)):
+                        raise RuntimeError('Lightcurve of %s was not restored' % kepler_id)
+
+        print 'TEST_ARCHIVE: Time windows are restored ...'
+        tmin, tmax = np.percentile(expected[0], [37., 52.])
+        entry = reader.entries(kepler_ids[0])[0]
+        mask = (expected[0] >= tmin) & (expected[0] <= tmax)
+        for a, b in zip(reader.read(entry, tmin=tmin, tmax=tmax), expected):
+            if not np.array_equal(a, b[mask]):
+                raise RuntimeError('Time window was not restored')
+
+        if reader.entries('000000001') != [] or reader.entries('000000002') != []:
+            raise RuntimeError('Found a target that is not in the archive')
+        reader.close()
+
+        print 'TEST_ARCHIVE: Archive source matches disk source ...'
+        data = [[k, '3', 'llc'] for k in kepler_ids] + [['11138155', '3', 'slc']]
+        out1 = __capture(ArchiveDataLoader, iter(data), root + '/archive').splitlines()
+        out2 = __capture(DiskDataLoader, iter(data), root + '/data').splitlines()
+        if len(out1) != 4 or [l.split('\t')[3:] for l in out1] != \
+        [l.split('\t')[3:] for l in out2]:
+            raise RuntimeError('Archive output differs from disk output')
+
+        print 'TEST_ARCHIVE: Target blocks are read once per target ...'
+        data = list(get_data.read_input(StringIO('11138155\t*\tllc\n11138155\t3\tslc\n'
+            '11446443\t*\tllc\n')))
+        archive.ArchiveReader = _CountingReader
+        try:
+            out = __capture(ArchiveDataLoader, iter(data), root + '/archive')
+        finally:
+            archive.ArchiveReader = ArchiveReader
+        if len(out.splitlines()) != 3 or _CountingReader.lookups != 2:
+            raise RuntimeError('Read %d records with %d lookups' % (len(out.splitlines()),
+                _CountingReader.lookups))
+    finally:
+        shutil.rmtree(root)
+
+    print 'Test complete; archive round trip is exact'
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        print e
+        sys.exit(1)
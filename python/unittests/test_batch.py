@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import subprocess
+import numpy as np
+from utils import encode_array
+from bls_pulse_cython import bls_pulse, bls_pulse_batch
+
+BLS_ARGS = ['-p', '2', '-b', '100', '-m', '0.02', '--mode', 'cython', '--direction', '2']
+
+
+def __make_lightcurves(ntargets):
+    '''
+    Returns lightcurves of different lengths and start times, with missing fluxes and,
+    in one of them, a gap of empty segments.
+    '''
+    np.random.seed(5)
+    lightcurves = []
+
+    for i in xrange(ntargets):
+        time = np.arange(54950. + 0.37 * i, 54956. + 1.5 * i, 0.0204)
+        if i == 2:
+            time = time[(time < 54952.) | (time > 54956.5)]
+        flux = 1. + 0.001 * np.random.randn(len(time))
+        flux[np.random.randint(0, len(time), 20)] = np.nan
+        lightcurves.append((time, flux, np.ones_like(time) * 0.001))
+
+    return lightcurves
+
+
+def __drive(args, stdin):
+    with open(os.devnull, 'w') as devnull:
+        proc = subprocess.Popen([sys.executable, 'drive_bls_pulse.py'] + BLS_ARGS + args,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=devnull)
+        out = proc.communicate(stdin)[0]
+
+    if proc.returncode != 0:
+        raise RuntimeError('drive_bls_pulse.py %s failed' % ' '.join(args))
+
+    return out
+
+
+def main():
+    lightcurves = __make_lightcurves(6)
+    offsets = np.cumsum([0] + [len(lc[0]) for lc in lightcurves])
+    time, flux, fluxerr = [np.concatenate(arrays) for arrays in zip(*lightcurves)]
+    packed_time = time.copy()
+
+    for direction in [2, 1, -1, 0]:
+        for detrend_order in [3, 0]:
+            for nthreads in [1, 3]:
+                print 'TEST_BATCH: Direction %d, detrending order %d, %d threads ...' % \
+                    (direction, detrend_order, nthreads)
+                out = bls_pulse_batch(time, flux, fluxerr, offsets, 100, 2., 0.02, 0.5,
+                    detrend_order=detrend_order, direction=direction, nthreads=nthreads)
+                segments = out.pop('offsets')
+
+                for i, (t, f, e) in enumerate(lightcurves):
+                    expected = bls_pulse(t.copy(), f, e, 100, 2., 0.02, 0.5,
+                        detrend_order=detrend_order, direction=direction)
+                    for name in expected:
+                        if expected[name].tostring() != \
+                        out[name][segments[i]:segments[i+1]].tostring():
+                            raise RuntimeError('%s of lightcurve %d differs from '
+                                'bls_pulse' % (name, i))
+
+    if time.tostring() != packed_time.tostring():
+        raise RuntimeError('The batch search modified its input')
+
+    print 'TEST_BATCH: Driver ...'
+    lines = ''.join(['\t'.join(['%09d_llc' % (i + 1), str(['03']), encode_array(t),
+        encode_array(f), encode_array(e)]) + '\n' for i, (t, f, e) in
+        enumerate(lightcurves)])
+    expected = __drive([], lines)
+    for size in ['4', '16']:
+        if __drive(['--batch-size', size], lines) != expected:
+            raise RuntimeError('Driver output in batches of %s differs' % size)
+
+    print 'Test complete; the batch search is identical to searching one lightcurve at a time'
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        print e
+        sys.exit(1)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import numpy as np
+import bls_pulse_cython
+
+SEGMENT = 1.5
+NBINS = 40
+
+bin_lightcurve = getattr(bls_pulse_cython, '__bin_lightcurve')
+
+
+def __reference(time, flux, fluxerr, first_segment, nsegments):
+    '''
+    Bins the segments one at a time with NumPy, splitting them where a scan of the
+    lightcurve would.
+    '''
+    binned = np.zeros((nsegments, 4, NBINS))
+    binsize = SEGMENT / NBINS
+
+    for k in xrange(nsegments):
+        n = first_segment + k
+        start = float(n) * SEGMENT
+        lo = np.searchsorted(time, float(n - 1) * SEGMENT + SEGMENT)
+        hi = np.searchsorted(time, start + SEGMENT)
+        sel = np.arange(lo, hi)[np.isfinite(flux[lo:hi])]
+        j = np.clip(np.floor((time[sel] - start) / binsize).astype(int), 0, NBINS - 1)
+
+        for row, values in enumerate([time[sel], flux[sel], fluxerr[sel],
+        np.ones(len(sel))]):
+            for i, v in zip(j, values):
+                binned[k,row,i] += v
+
+    with np.errstate(invalid='ignore'):
+        binned[:,:3] /= binned[:,3:]
+
+    return binned
+
+
+def main():
+    np.random.seed(2)
+    time = np.arange(0., 20., 0.0204)
+    time = time[(time < 6.) | (time > 11.)]
+    flux = 1. + 0.001 * np.random.randn(len(time))
+    fluxerr = np.ones_like(time) * 0.001
+    flux[np.random.randint(0, len(time), 50)] = np.nan
+
+    # Missing fluxes at the end of the lightcurve used to be read past.
+    flux[-20:] = np.nan
+
+    cases = [('Whole lightcurve', 0, int(np.floor(time[-1] / SEGMENT)) + 1),
+        ('Block', 3, 5), ('Empty block', 5, 2)]
+
+    for name, first, count in cases:
+        print 'TEST_BINNING: %s ...' % name
+        binned, segstart, segend = bin_lightcurve(time, flux, fluxerr, NBINS, SEGMENT,
+            first, count)
+        expected = __reference(time, flux, fluxerr, first, count)
+
+        if not np.allclose(binned, expected, rtol=1e-12, atol=0., equal_nan=True):
+            raise RuntimeError('%s: binned segments differ from the reference' % name)
+        if not np.all(segstart == np.arange(first, first + count) * SEGMENT) or \
+        not np.all(segend == segstart + SEGMENT):
+            raise RuntimeError('%s: wrong segment start or end times' % name)
+
+    print 'Test complete; the lightcurve binning matches the reference'
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        print e
+        sys.exit(1)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import subprocess
+import numpy as np
+from utils import encode_array
+from blocks import split_target, search_blocks, merge_blocks
+from drive_bls_pulse import run_bls, format_output
+
+SEGMENT = 2.
+
+BLS_ARGS = ['-p', str(SEGMENT), '-b', '200', '-m', '0.02', '--mode', 'cython']
+
+
+def __make_lightcurve():
+    '''
+    Returns a lightcurve of 40 segments with transits, missing fluxes, and a gap of
+    several segments.
+    '''
+    np.random.seed(5)
+    time = np.arange(54950.3, 55030., 0.0204)
+    time = time[(time < 54970.) | (time > 54981.)]
+    flux = 1. + 0.0005 * np.random.randn(len(time))
+    flux[np.abs(np.mod(time - 54950., 3.1) - 1.) < 0.05] -= 0.005
+    flux[np.random.randint(0, len(time), 50)] = np.nan
+    fluxerr = np.ones_like(time) * 0.0005
+    return time, flux, fluxerr
+
+
+def __run(command, stdin):
+    with open(os.devnull, 'w') as devnull:
+        proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=devnull, env=dict(os.environ, LC_ALL='C'))
+        out = proc.communicate(stdin)[0]
+
+    if proc.returncode != 0:
+        raise RuntimeError('%s failed' % ' '.join(command))
+
+    return out
+
+
+def main():
+    time, flux, fluxerr = __make_lightcurve()
+
+    for direction in [2, 1, -1, 0]:
+        options = dict(segment=SEGMENT, mindur=0.02, maxdur=0.5, nbins=200,
+            direction=direction, mode='cython', fmt='encoded', profile=False)
+        expected = format_output('001234567_llc', "['03']", run_bls(time.copy(), flux,
+            fluxerr, options), direction, 'encoded')
+
+        for block_segments in [1, 3, 8, 100]:
+            print 'TEST_BLOCKS: Direction %d, blocks of %d segments ...' % (direction,
+                block_segments)
+            blocks = list(split_target('001234567_llc', "['03']", time, flux, fluxerr,
+                SEGMENT, block_segments))
+            # Merge the results out of order.
+            results = list(search_blocks(blocks, options))[::-1]
+            merged = list(merge_blocks(results, SEGMENT, direction))
+
+            if len(merged) != 1:
+                raise RuntimeError('Expected one merged target, got %d' % len(merged))
+            if format_output(merged[0][0], merged[0][1], merged[0][2], direction,
+            'encoded') != expected:
+                raise RuntimeError('Merged output differs from an unsplit search')
+
+    print 'TEST_BLOCKS: Streaming stages ...'
+    lines = '\t'.join(['001234567_llc', "['03']", encode_array(time), encode_array(flux),
+        encode_array(fluxerr)]) + '\n'
+    args = BLS_ARGS + ['--direction', '2']
+    expected = __run([sys.executable, 'drive_bls_pulse.py'] + args, lines)
+
+    out = __run([sys.executable, 'blocks.py', 'split', '--block-segments', '4'] + args,
+        lines)
+    out = __run([sys.executable, 'blocks.py', 'search'] + args, __run(['sort'], out))
+    out = __run([sys.executable, 'blocks.py', 'merge'] + args, __run(['sort'], out))
+
+    if out != expected:
+        raise RuntimeError('Streaming stages differ from drive_bls_pulse.py')
+
+    print 'Test complete; split searches match unsplit searches'
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        print e
+        sys.exit(1)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import zlib
+import base64
+import numpy as np
+from cStringIO import StringIO
+from utils import encode_array, encode_list, decode_array, read_mapper_output
+
+
+def __legacy_encode(arr):
+    # This is how records were written before the binary codec was introduced.
+    return base64.b64encode(zlib.compress(json.dumps(arr.tolist())))
+
+
+def main():
+    np.random.seed(4)
+
+    cases = [np.random.normal(size=(1000,)), np.random.normal(size=(3,4)),
+        np.arange(10, dtype='int32'), np.array([np.nan, np.inf, -0.]),
+        np.empty((0,), dtype='float64'), np.random.normal(size=(7,)).astype('>f8')]
+
+    for i, arr in enumerate(cases):
+        print 'TEST_CODEC: Test case', i + 1, 'of', len(cases), '...'
+
+        for compress in [False, True]:
+            s = encode_array(arr, compress=compress)
+
+            if '\t' in s or '\n' in s:
+                raise RuntimeError('Encoded string is not tab-safe')
+
+            out = decode_array(s)
+
+            if out.shape != arr.shape or out.dtype != arr.dtype.newbyteorder('<') or \
+            not np.array_equal(out.view(np.uint8), np.ascontiguousarray(arr,
+            dtype=out.dtype).view(np.uint8)):
+                raise RuntimeError('Round trip failed (compress=%s)' % compress)
+
+    print 'TEST_CODEC: Legacy records ...'
+    arr = np.random.normal(size=(100,))
+    if not np.array_equal(decode_array(__legacy_encode(arr)), arr):
+        raise RuntimeError('Legacy record did not decode')
+    if not np.array_equal(decode_array(encode_list(arr.tolist())), arr):
+        raise RuntimeError('List round trip failed')
+
+    print 'TEST_CODEC: Mixed mapper output ...'
+    line = '\t'.join(['011138155_llc', '03', 'uri', encode_array(arr),
+        __legacy_encode(arr), encode_array(arr, compress=True)])
+    for _, _, time, flux, fluxerr in read_mapper_output(StringIO(line + '\n'), uri=True):
+        if not (np.array_equal(time, arr) and np.array_equal(flux, arr) and
+        np.array_equal(fluxerr, arr)):
+            raise RuntimeError('Mapper output did not decode')
+
+    print 'TEST_CODEC: Zero-copy decoding ...'
+    s = encode_array(arr)
+    if decode_array(s).flags.writeable or not decode_array(s, writable=True).flags.writeable:
+        raise RuntimeError('Decoded arrays have the wrong writeable flag')
+    for out in read_mapper_output(StringIO(line + '\n'), uri=True, writable=True).next()[2:]:
+        if out.dtype != np.float64 or not out.flags.c_contiguous or not out.flags.writeable:
+            raise RuntimeError('Mapper output is not a writable C-contiguous float64 array')
+
+    print 'Test complete; all records decoded correctly'
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        print e
+        sys.exit(1)
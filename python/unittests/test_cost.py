@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import shutil
+import random
+import tempfile
+from fits_server import make_fits_tree
+from manifest import build_manifest
+from sharding import assign_by_cost
+from cost import java_hash, partition_of, partition_labels, target_size, target_cost, \
+    longest_first
+
+OPTIONS = dict(segment=2., mindur=0.02, maxdur=0.5, nbins=1000)
+
+
+def __make_tasks():
+    random.seed(7)
+    tasks = []
+
+    for i in xrange(500):
+        kepler_id = '%09d' % (i + 1)
+        # A few bright short-cadence targets among many faint ones.
+        suffix = 'slc' if i % 50 == 0 else 'llc'
+        quarters = random.sample(xrange(1, 17), random.randint(1, 16))
+        tasks.append([[kepler_id, str(q), suffix] for q in quarters])
+
+    return tasks
+
+
+def main():
+    print 'TEST_COST: Labels hash like KeyFieldBasedPartitioner ...'
+    # Values of String.hashCode() in Java.
+    if java_hash('hello') != 99162322 or java_hash('polygenelubricants') != -2**31:
+        raise RuntimeError('Hash differs from Java')
+
+    for nreducers in [1, 7, 64]:
+        labels = partition_labels(nreducers)
+        if [partition_of(label, nreducers) for label in labels] != range(nreducers):
+            raise RuntimeError('Labels are not partitioned to their reducers')
+
+    print 'TEST_COST: Costs grow with the data and the search ...'
+    one = [['11138155', '3', 'llc']]
+    if not target_cost(one, OPTIONS) < target_cost(one + [['11138155', '4', 'llc']],
+    OPTIONS) < target_cost([['11138155', '3', 'slc']], OPTIONS):
+        raise RuntimeError('Costs do not grow with the number of samples')
+    if not target_cost(one, dict(OPTIONS, maxdur=0.1)) < target_cost(one, OPTIONS):
+        raise RuntimeError('Costs do not grow with the trial durations')
+
+    tasks = __make_tasks()
+    ordered = longest_first(tasks, OPTIONS)
+    costs = [target_cost(task, OPTIONS) for task in ordered]
+    if costs != sorted(costs, reverse=True) or \
+    sorted(map(tuple, map(tuple, ordered))) != sorted(map(tuple, map(tuple, tasks))):
+        raise RuntimeError('Targets are not ordered by decreasing cost')
+
+    print 'TEST_COST: Sizes from a manifest ...'
+    root = tempfile.mkdtemp()
+    try:
+        make_fits_tree(root, ['011138155'])
+        make_fits_tree(root, ['011138155'], timestamp='2010078095331')
+        nsamples, _ = target_size([['11138155', '*', 'llc']], build_manifest(root))
+        # The bundled file holds 4370 samples, padded to whole FITS blocks.
+        if abs(nsamples / (2 * 4370.) - 1.) > 0.01:
+            raise RuntimeError('Wrong number of samples: %f' % nsamples)
+    finally:
+        shutil.rmtree(root)
+
+    print 'TEST_COST: Cost-based reducers are balanced ...'
+    nreducers = 16
+    costs = dict([(task[0][0], target_cost(task, OPTIONS)) for task in tasks])
+    assignment = assign_by_cost(costs, nreducers)
+    loads = [0.] * nreducers
+    hashed = [0.] * nreducers
+    for kepler_id, cost in costs.items():
+        loads[assignment[kepler_id]] += cost
+        hashed[partition_of(kepler_id, nreducers)] += cost
+
+    mean = sum(costs.values()) / nreducers
+    print 'TEST_COST: Largest reducer is %.3f (hash: %.3f) times the mean cost' % (
+        max(loads) / mean, max(hashed) / mean)
+    if max(loads) / mean > 1.05 or max(loads) > max(hashed):
+        raise RuntimeError('Cost-based reducers are not balanced')
+
+    print 'Test complete; costs order and balance the targets'
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        print e
+        sys.exit(1)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+import numpy as np
+from utils import encode_array
+
+BLS_ARGS = ['-p', '2', '-b', '100', '-m', '0.02', '--mode', 'cython', '--direction', '2']
+
+
+def __make_input(ntargets):
+    np.random.seed(3)
+    lines = []
+
+    for i in xrange(ntargets):
+        time = np.arange(54950., 54960., 0.0204)
+        flux = 1. + 0.001 * np.random.randn(len(time))
+        fluxerr = np.ones_like(time) * 0.001
+        lines.append('\t'.join(['%09d_llc' % (i + 1), str(['03']), encode_array(time),
+            encode_array(flux), encode_array(fluxerr)]))
+
+    return '\n'.join(lines) + '\n'
+
+
+def __run(script, args, stdin):
+    proc = subprocess.Popen([sys.executable, script] + args, stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate(stdin)
+    return proc.returncode, out, err
+
+
+def __start_daemon(path):
+    daemon = subprocess.Popen([sys.executable, 'bls_daemon.py', '--socket', path])
+
+    for _ in xrange(100):
+        if os.path.exists(path):
+            return daemon
+        time.sleep(0.1)
+
+    daemon.kill()
+    raise RuntimeError('The daemon did not start')
+
+
+def main():
+    root = tempfile.mkdtemp()
+    path = os.path.join(root, 'bls.sock')
+    client = ['--daemon-socket', path] + BLS_ARGS
+
+    try:
+        data = __make_input(20)
+        expected = __run('drive_bls_pulse.py', BLS_ARGS, data)[1]
+
+        print 'TEST_DAEMON: Client without a daemon ...'
+        status, out, _ = __run('bls_client.py', client, data)
+        if status != 0 or out != expected:
+            raise RuntimeError('In-process output differs from drive_bls_pulse.py')
+
+        daemon = __start_daemon(path)
+        try:
+            print 'TEST_DAEMON: Client with a daemon ...'
+            status, out, _ = __run('bls_client.py', client, data)
+            if status != 0 or out != expected:
+                raise RuntimeError('Daemon output differs from drive_bls_pulse.py')
+
+            print 'TEST_DAEMON: Concurrent clients ...'
+            with open(os.devnull, 'w') as devnull:
+                procs = [subprocess.Popen([sys.executable, 'bls_client.py'] + client,
+                    stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=devnull) for _ in
+                    xrange(4)]
+                for proc in procs:
+                    if proc.communicate(data)[0] != expected or proc.returncode != 0:
+                        raise RuntimeError('Concurrent output differs from '
+                            'drive_bls_pulse.py')
+
+            print 'TEST_DAEMON: Output file ...'
+            status, out, _ = __run('bls_client.py', client + ['-o', os.path.join(root,
+                'out.txt')], data)
+            with open(os.path.join(root, 'out.txt'), 'rb') as f:
+                if status != 0 or out != '' or f.read() != expected:
+                    raise RuntimeError('Daemon output file differs from drive_bls_pulse.py')
+
+            print 'TEST_DAEMON: Errors ...'
+            status, out, err = __run('bls_client.py', ['--daemon-socket', path, '-b',
+                '100'], data)
+            if status != 2 or 'No trial segment' not in err:
+                raise RuntimeError('Usage error was not passed on: %d %r' % (status, err))
+            status, out, err = __run('bls_client.py', BLS_ARGS + ['--daemon-socket'], data)
+            if status != 2 or 'expected one argument' not in err:
+                raise RuntimeError('Missing socket path was not reported: %d %r' % (status,
+                    err))
+            status, out, err = __run('bls_client.py', client, 'not a lightcurve\n')
+            if status != 1 or 'Traceback' not in err:
+                raise RuntimeError('Failure was not passed on: %d %r' % (status, err))
+        finally:
+            daemon.terminate()
+            daemon.wait()
+
+        if os.path.exists(path):
+            raise RuntimeError('The daemon did not remove its socket')
+    finally:
+        shutil.rmtree(root)
+
+    print 'Test complete; the client matches drive_bls_pulse.py with and without a daemon'
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        print e
+        sys.exit(1)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+from fits_server import make_fits_tree
+
+
+def __make_tree(root):
+    '''
+    Returns the requests for a tree of links to the bundled FITS file, with requests for
+    missing files and for an unreadable file mixed in, the keys of the records that must
+    be written, in order, and the number of requests that cannot be read.
+    '''
+    kepler_ids = ['%09d' % (i + 1) for i in xrange(12)]
+    make_fits_tree(root, kepler_ids)
+
+    dirname = os.path.join(root, '0000', '000000099')
+    os.makedirs(dirname)
+    with open(os.path.join(dirname, 'kplr000000099-2009350155506_llc.fits'), 'wb') as f:
+        f.write('SIMPLE  =                    T' + '\0' * 100)
+
+    requests, keys, nbad = [], [], 0
+    for i, kepler_id in enumerate(kepler_ids):
+        requests.append('%s\t3\tllc' % kepler_id)
+        keys.append(kepler_id + '_llc')
+        if i % 4 == 1:
+            requests.append('%09d\t3\tllc' % (50 + i))
+            nbad += 1
+        if i % 5 == 2:
+            requests.append('000000099\t3\tllc')
+            nbad += 1
+
+    return '\n'.join(requests) + '\n', keys, nbad
+
+
+def __run(root, requests, nworkers):
+    proc = subprocess.Popen([sys.executable, 'get_data.py', 'disk', root, '--workers',
+        str(nworkers)], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    out, err = proc.communicate(requests)
+    if proc.returncode != 0:
+        raise RuntimeError('get_data.py with %d workers failed:\n%s' % (nworkers, err))
+    return out, err.count('Cannot read')
+
+
+def main():
+    root = tempfile.mkdtemp()
+
+    try:
+        requests, keys, nbad = __make_tree(root)
+
+        print 'TEST_DISK_WORKERS: One worker ...'
+        expected, errors = __run(root, requests, 1)
+        if [line.split('\t')[0] for line in expected.splitlines()] != keys:
+            raise RuntimeError('Records are missing or out of order')
+        if errors != nbad:
+            raise RuntimeError('Reported %d unreadable files instead of %d' % (errors,
+                nbad))
+
+        print 'TEST_DISK_WORKERS: Three workers ...'
+        out, errors = __run(root, requests, 3)
+        if out != expected:
+            raise RuntimeError('Output with 3 workers differs from one worker')
+        if errors != nbad:
+            raise RuntimeError('Reported %d unreadable files with 3 workers' % errors)
+    finally:
+        shutil.rmtree(root)
+
+    print 'Test complete; the worker processes write the same records in the same order'
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        print e
+        sys.exit(1)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import shutil
+import tempfile
+from cStringIO import StringIO
+from multiprocessing.pool import ThreadPool
+from fetch import HTTPFetcher
+from fits_cache import FITSCache
+from fits_server import FITSServer
+from get_data import MASTDataDownloader
+from utils import ordered_map
+
+
+def __run_downloader(server, data, nthreads, cache=None):
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+
+    try:
+        MASTDataDownloader(iter(data), base_url=server.url, nthreads=nthreads,
+            cache=cache)
+        return sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+
+
+def main():
+    print 'TEST_FETCH: Results are emitted in input order ...'
+    pool = ThreadPool(8)
+    out = list(ordered_map(pool, lambda x: x * x, xrange(100), 4))
+    pool.close()
+    if out != [x * x for x in xrange(100)]:
+        raise RuntimeError('ordered_map changed the order of the results')
+
+    with FITSServer(latency=0.01) as server:
+        print 'TEST_FETCH: Connections are reused ...'
+        fetcher = HTTPFetcher(per_host=2)
+        pool = ThreadPool(8)
+        urls = [server.url + '%d_llc.fits' % i for i in xrange(20)]
+        bodies = list(ordered_map(pool, lambda u: fetcher.get(u)[2], urls, 8))
+        pool.close()
+        fetcher.close()
+        if any([b != server.httpd.data for b in bodies]):
+            raise RuntimeError('Downloaded data does not match')
+        if len(server.connections) > 2:
+            raise RuntimeError('Opened %d connections for 2 slots' %
+                len(server.connections))
+
+        print 'TEST_FETCH: Missing files are not retried ...'
+        try:
+            fetcher.get(server.url + 'missing')
+        except RuntimeError:
+            pass
+        else:
+            raise RuntimeError('Missing file did not raise an error')
+
+    with FITSServer(fail_first=2) as server:
+        print 'TEST_FETCH: Server errors are retried ...'
+        fetcher = HTTPFetcher(retries=2, backoff=0.01)
+        body = fetcher.get(server.url + 'x_llc.fits')[2]
+        fetcher.close()
+        if body != server.httpd.data:
+            raise RuntimeError('Retried download does not match')
+
+    with FITSServer() as server, FITSServer(redirect=server.url) as mirror:
+        print 'TEST_FETCH: Redirects are followed ...'
+        fetcher = HTTPFetcher()
+        for url in [server.url + 'moved/x_llc.fits', mirror.url + 'moved/x_llc.fits']:
+            status, _, body = fetcher.get(url)
+            if status != 200 or body != server.httpd.data:
+                raise RuntimeError('Redirected download of %s does not match' % url)
+        if server.requests[-2:] != ['/moved/x_llc.fits', '/x_llc.fits']:
+            raise RuntimeError('Redirects were not followed: %s' % server.requests)
+
+        print 'TEST_FETCH: Redirect loops are cut off ...'
+        server.httpd.redirect = mirror.url
+        before = len(server.requests) + len(mirror.requests)
+        fetcher.close()
+        fetcher = HTTPFetcher(max_redirects=3)
+        try:
+            fetcher.get(server.url + 'x_llc.fits')
+        except RuntimeError:
+            pass
+        else:
+            raise RuntimeError('Redirect loop did not raise an error')
+        requests = len(server.requests) + len(mirror.requests) - before
+        if requests != 4:
+            raise RuntimeError('Sent %d requests for 3 redirects' % requests)
+        fetcher.close()
+
+    with FITSServer() as server:
+        print 'TEST_FETCH: Concurrent downloader output matches serial output ...'
+        data = [['11138155', '3', 'llc'], ['11138155', '4', 'slc'],
+            ['11446443', '2', 'llc']]
+        expected = __run_downloader(server, data, 1)
+        if __run_downloader(server, data, 8) != expected:
+            raise RuntimeError('Concurrent output differs from serial output')
+
+        print 'TEST_FETCH: The downloader detaches its fetcher from the cache ...'
+        cachedir = tempfile.mkdtemp()
+        try:
+            cache = FITSCache(cachedir)
+            if __run_downloader(server, data, 8, cache) != expected:
+                raise RuntimeError('Cached output differs from serial output')
+            if cache.fetcher is not None:
+                raise RuntimeError('The cache still holds the closed fetcher')
+        finally:
+            shutil.rmtree(cachedir)
+
+    print 'Test complete; downloads behave as expected'
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        print e
+        sys.exit(1)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import shutil
+import tempfile
+from multiprocessing.pool import ThreadPool
+from fetch import HTTPFetcher
+from fits_cache import FITSCache
+from fits_server import FITSServer
+
+
+def main():
+    cachedir = tempfile.mkdtemp()
+
+    try:
+        with FITSServer() as server:
+            size = len(server.httpd.data)
+            uri1 = server.url + 'a/kplr-1_llc.fits'
+            uri2 = server.url + 'b/kplr-2_llc.fits'
+
+            print 'TEST_FITS_CACHE: First download is a miss ...'
+            cache = FITSCache(cachedir, max_bytes=size)
+            data = cache.get(uri1)
+            if data != server.httpd.data or cache.stats() != dict(hits=0, misses=1,
+            evictions=0):
+                raise RuntimeError('Unexpected result of first download: %s' %
+                    cache.stats())
+
+            print 'TEST_FITS_CACHE: Second download is revalidated ...'
+            cache = FITSCache(cachedir, max_bytes=size)
+            if cache.get(uri1) != data or cache.hits != 1 or cache.misses != 0:
+                raise RuntimeError('Cached file was not reused: %s' % cache.stats())
+
+            print 'TEST_FITS_CACHE: Least recently used file is evicted ...'
+            cache.get(uri2)
+            if cache.evictions != 1:
+                raise RuntimeError('Cache did not evict: %s' % cache.stats())
+
+            nrequests = len(server.requests)
+            cache.revalidate = False
+            cache.get(uri2)
+            if len(server.requests) != nrequests or cache.hits != 2:
+                raise RuntimeError('Evicted the wrong file: %s' % cache.stats())
+
+            print 'TEST_FITS_CACHE: Reads update the use order without a rescan ...'
+            cache = FITSCache(tempfile.mkdtemp(dir=cachedir), max_bytes=2 * size,
+                revalidate=False)
+            uri3, uri4, uri5 = [server.url + 'd/kplr-%d_llc.fits' % i for i in xrange(3)]
+            walk = os.walk
+            os.walk = None
+            try:
+                cache.get(uri3)
+                cache.get(uri4)
+                cache.get(uri3)
+                cache.get(uri5)
+            finally:
+                os.walk = walk
+            nrequests = len(server.requests)
+            cache.get(uri3)
+            if cache.evictions != 1 or len(server.requests) != nrequests:
+                raise RuntimeError('Evicted the wrong file: %s' % cache.stats())
+
+            print 'TEST_FITS_CACHE: Counters add up over download threads ...'
+            cache = FITSCache(tempfile.mkdtemp(dir=cachedir), max_bytes=4 * size)
+            cache.fetcher = HTTPFetcher()
+            uris = [server.url + 'c/kplr-%d_llc.fits' % (i % 4) for i in xrange(400)]
+            interval = sys.getcheckinterval()
+            sys.setcheckinterval(1)
+            pool = ThreadPool(8)
+            try:
+                pool.map(cache.get, uris)
+            finally:
+                pool.close()
+                sys.setcheckinterval(interval)
+                cache.fetcher.close()
+            stats = cache.stats()
+            if stats['hits'] + stats['misses'] != len(uris) or stats['misses'] < 4:
+                raise RuntimeError('Counters do not add up: %s' % stats)
+
+        print 'TEST_FITS_CACHE: Cached file is served offline ...'
+        cache = FITSCache(cachedir, max_bytes=size)
+        if cache.get(uri2) != data or cache.hits != 1:
+            raise RuntimeError('Cached file was not served offline: %s' % cache.stats())
+
+        try:
+            cache.get(uri1)
+        except RuntimeError:
+            pass
+        else:
+            raise RuntimeError('Evicted file was served offline')
+    finally:
+        shutil.rmtree(cachedir)
+
+    print 'Test complete; cache behaves as expected'
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        print e
+        sys.exit(1)
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import numpy as np
+from join_quarters import stitch_quarters
+
+
+def __quarter(time):
+    time = np.asarray(time, dtype='float64')
+    return time, time * 10., time * 100.
+
+
+def __check(quarters, expected, name):
+    result = stitch_quarters(quarters)
+
+    if quarters != []:
+        raise RuntimeError('%s: input quarters were not released' % name)
+
+    expected = np.asarray(expected, dtype='float64')
+    for column, factor in zip(result, [1., 10., 100.]):
+        if column.dtype != np.float64 or not np.array_equal(column, expected * factor):
+            raise RuntimeError('%s: got %s instead of %s' % (name, result[0], expected))
+
+
+def main():
+    print 'TEST_JOIN_QUARTERS: Disjoint quarters are concatenated ...'
+    __check([__quarter([1., 2., 3.]), __quarter([4., 5.])], [1., 2., 3., 4., 5.],
+        'disjoint')
+
+    print 'TEST_JOIN_QUARTERS: Quarters are put in time order ...'
+    __check([__quarter([4., 5.]), __quarter([]), __quarter([1., 2., 3.])],
+        [1., 2., 3., 4., 5.], 'out of order')
+
+    print 'TEST_JOIN_QUARTERS: Overlapping quarters are merged ...'
+    __check([__quarter([1., 3., 5., 7.]), __quarter([2., 4., 6., 8.])],
+        [1., 2., 3., 4., 5., 6., 7., 8.], 'overlapping')
+
+    print 'TEST_JOIN_QUARTERS: Duplicate cadences and non-finite times are dropped ...'
+    first, second = __quarter([1., np.nan, 3., 4.]), __quarter([3., 4., np.inf, 5.])
+    # The earlier quarter wins among duplicates.
+    second[1][:2] = -1.
+    __check([first, second], [1., 3., 4., 5.], 'duplicates')
+
+    print 'TEST_JOIN_QUARTERS: Unsorted quarters are sorted ...'
+    __check([__quarter([3., 1., 2.])], [1., 2., 3.], 'unsorted')
+
+    print 'TEST_JOIN_QUARTERS: Empty input ...'
+    __check([], [], 'empty')
+
+    print 'Test complete; quarters are stitched in time order'
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        print e
+        sys.exit(1)
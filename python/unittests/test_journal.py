@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import numpy as np
+from utils import encode_array
+from journal import read_journal, compact
+
+BLS_ARGS = ['-p', '2', '-b', '100', '-m', '0.02', '--mode', 'cython', '--direction', '2']
+
+
+def __make_input(ntargets):
+    np.random.seed(2)
+    lines = []
+
+    for i in xrange(ntargets):
+        time = np.arange(54950., 54960., 0.0204)
+        flux = 1. + 0.001 * np.random.randn(len(time))
+        fluxerr = np.ones_like(time) * 0.001
+        lines.append('\t'.join(['%09d_llc' % (i + 1), str(['03']), encode_array(time),
+            encode_array(flux), encode_array(fluxerr)]))
+
+    return '\n'.join(lines) + '\n'
+
+
+def __drive(args, stdin):
+    with open(os.devnull, 'w') as devnull:
+        proc = subprocess.Popen([sys.executable, 'drive_bls_pulse.py'] + BLS_ARGS + args,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=devnull)
+        out = proc.communicate(stdin)[0]
+
+    if proc.returncode != 0:
+        raise RuntimeError('drive_bls_pulse.py %s failed' % ' '.join(args))
+
+    return out
+
+
+def __read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def main():
+    root = tempfile.mkdtemp()
+    output, journal = os.path.join(root, 'out.txt'), os.path.join(root, 'journal.txt')
+
+    try:
+        data = __make_input(5)
+        expected = __drive([], data)
+
+        print 'TEST_JOURNAL: Journaled run ...'
+        __drive(['-o', output, '--journal', journal], data)
+        records = read_journal(journal)
+        if __read(output) != expected:
+            raise RuntimeError('Journaled output differs from STDOUT output')
+        if len(records) != 5 or records[-1][3] != len(expected):
+            raise RuntimeError('Wrong journal records: %s' % records)
+
+        print 'TEST_JOURNAL: Compaction after a crash ...'
+        # Two targets were journaled, the third was partly written, and the journal line
+        # of the third was torn.
+        with open(output, 'r+b') as f:
+            f.truncate(records[2][3] - 10)
+        with open(journal, 'r+b') as f:
+            f.truncate(len(''.join(__read(journal).splitlines(True)[:2])) + 7)
+
+        kept = compact(journal, output)
+        if kept != records[:2] or len(__read(output)) != records[1][3]:
+            raise RuntimeError('Compaction did not truncate to the last journaled target')
+
+        print 'TEST_JOURNAL: Resumed run ...'
+        # Break the output again; resuming compacts it first.
+        with open(output, 'ab') as f:
+            f.write('garbage')
+        __drive(['-o', output, '--journal', journal, '--resume'], data)
+        if __read(output) != expected:
+            raise RuntimeError('Resumed output differs from an uninterrupted run')
+        if read_journal(journal) != records:
+            raise RuntimeError('Resumed journal differs from an uninterrupted run')
+
+        print 'TEST_JOURNAL: Resumed run with other parameters ...'
+        try:
+            __drive(['-o', output, '--journal', journal, '--resume', '-b', '50'], data)
+        except RuntimeError:
+            pass
+        else:
+            raise RuntimeError('Resumed a run with other parameters')
+        if __read(output) != expected or read_journal(journal) != records:
+            raise RuntimeError('Refused resume changed the output or the journal')
+    finally:
+        shutil.rmtree(root)
+
+    print 'Test complete; interrupted runs resume correctly'
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        print e
+        sys.exit(1)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import subprocess
+import numpy as np
+from utils import encode_array
+from bls_pulse_cython import bls_pulse, bls_pulse_batch
+
+ARGS = (300, 2., 0.1, 0.6)
+
+# Minimum durations of 15 and 105 bins, so that the sliding kernel runs both its own
+# search and the exhaustive one below its threshold.
+SLIDING_ARGS = [ARGS, (300, 2., 0.7, 1.2)]
+
+
+def __make_lightcurve():
+    np.random.seed(9)
+    time = np.arange(54950.3, 54976., 0.0102)
+    time = time[(time < 54960.) | (time > 54963.)]
+    flux = 1. + 0.0005 * np.random.randn(len(time))
+    flux[np.abs(np.mod(time - 54950., 3.1) - 1.) < 0.08] -= 0.004
+    flux[np.abs(np.mod(time - 54951., 4.3) - 1.) < 0.05] += 0.003
+    flux[np.random.randint(0, len(time), 200)] = np.nan
+    fluxerr = np.ones_like(time) * 0.0005
+    return time, flux, fluxerr
+
+
+def __compare(expected, out):
+    if sorted(out) != sorted(expected):
+        return 'The output'
+    for name in expected:
+        if expected[name].tostring() != out[name].tostring():
+            return name
+    return None
+
+
+def main():
+    time, flux, fluxerr = __make_lightcurve()
+
+    for direction in [2, 1, -1, 0]:
+        for detrend_order in [3, 0]:
+            print 'TEST_KERNEL: Direction %d, detrending order %d ...' % (direction,
+                detrend_order)
+            expected = bls_pulse(time.copy(), flux, fluxerr, *ARGS, direction=direction,
+                detrend_order=detrend_order)
+            for args in SLIDING_ARGS:
+                reference = bls_pulse(time.copy(), flux, fluxerr, *args,
+                    direction=direction, detrend_order=detrend_order)
+                for nthreads in [1, 3]:
+                    out = bls_pulse(time.copy(), flux, fluxerr, *args,
+                        direction=direction, detrend_order=detrend_order, kernel='sliding',
+                        nthreads=nthreads)
+                    name = __compare(reference, out)
+                    if name is not None:
+                        raise RuntimeError('%s of the sliding kernel on %d threads differs '
+                            'from the exhaustive kernel' % (name, nthreads))
+
+            for nthreads in [1, 3]:
+                out = bls_pulse(time.copy(), flux, fluxerr, *ARGS, direction=direction,
+                    detrend_order=detrend_order, kernel='pruned', nthreads=nthreads)
+                pruned = out.pop('pruned')
+                name = __compare(expected, out)
+                if name is not None:
+                    raise RuntimeError('%s of the pruned kernel on %d threads differs '
+                        'from the exhaustive kernel' % (name, nthreads))
+                # Without detrending the flux is not centred on zero, and the bounds
+                # are too loose to prune any start bin.
+                if len(pruned) != len(expected['segstart']) or np.any(pruned < 0) or \
+                        (detrend_order > 0 and np.all(pruned == 0)):
+                    raise RuntimeError('Wrong numbers of pruned start bins: %s' % pruned)
+
+    print 'TEST_KERNEL: Batch ...'
+    offsets = np.array([0, len(time) // 2, len(time)])
+    expected = bls_pulse_batch(time.copy(), flux, fluxerr, offsets, *ARGS, direction=2)
+    out = bls_pulse_batch(time.copy(), flux, fluxerr, offsets, *ARGS, direction=2,
+        kernel='pruned', nthreads=2)
+    if len(out.pop('pruned')) != len(expected['segstart']) or any([out[name].tostring() !=
+            expected[name].tostring() for name in expected]):
+        raise RuntimeError('The batched pruned kernel differs from the exhaustive kernel')
+
+    print 'TEST_KERNEL: Invalid kernel ...'
+    try:
+        bls_pulse(time.copy(), flux, fluxerr, *ARGS, kernel='fastest')
+    except ValueError:
+        pass
+    else:
+        raise RuntimeError('An invalid kernel was accepted')
+
+    print 'TEST_KERNEL: Driver ...'
+    line = '\t'.join(['001234567_llc', str(['03']), encode_array(time), encode_array(flux),
+        encode_array(fluxerr)]) + '\n'
+    outs = []
+    for kernel in ['exhaustive', 'sliding']:
+        with open(os.devnull, 'w') as devnull:
+            proc = subprocess.Popen([sys.executable, 'drive_bls_pulse.py', '-p', '2', '-b',
+                '300', '-m', '0.7', '-d', '1.2', '--mode', 'cython', '--kernel', kernel,
+                '-f', 'normal'], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=devnull)
+            outs.append(proc.communicate(line)[0])
+        if proc.returncode != 0 or 'Kepler 001234567_llc' not in outs[-1]:
+            raise RuntimeError('Driver failed with the %s kernel' % kernel)
+    if outs[0] != outs[1]:
+        raise RuntimeError('Driver output of the sliding kernel differs')
+
+    print 'Test complete; the sliding and pruned kernels are identical to the exhaustive ' \
+        'kernel'
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        print e
+        sys.exit(1)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import signal
+import shutil
+import tempfile
+import subprocess
+from cStringIO import StringIO
+import local_runner
+from fits_server import make_fits_tree
+from local_runner import group_requests
+from drive_bls_pulse import init_parser, read_options
+
+KEPLER_IDS = ['011138155', '001234567', '011446443', '002222222', '003333333']
+
+BLS_ARGS = ['-p', '2', '-b', '200', '-m', '0.02', '--mode', 'cython', '--direction', '2']
+
+
+def __run(command, stdin):
+    with open(os.devnull, 'w') as devnull:
+        proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=devnull)
+        out = proc.communicate(stdin)[0]
+
+    if proc.returncode != 0:
+        raise RuntimeError('%s failed' % ' '.join(command))
+
+    return out
+
+
+def __killed_stage(*args):
+    # Stands in for a worker killed by the OOM killer before it reports anything.
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+def __timeout(signum, frame):
+    raise RuntimeError('The runner hangs when a worker is killed')
+
+
+def __run_killed(root):
+    parser = init_parser()
+    options = read_options(parser, parser.parse_args(BLS_ARGS))
+    config = dict(source='disk', datapath=root, nthreads=1, nworkers=1, tmin=None,
+        tmax=None, manifest=None, options=options)
+    tasks = [[[k, '3', 'llc']] for k in KEPLER_IDS]
+
+    bls_stage = local_runner.bls_stage
+    local_runner.bls_stage = __killed_stage
+    handler = signal.signal(signal.SIGALRM, __timeout)
+    signal.alarm(60)
+
+    try:
+        local_runner.run(tasks, config, 2, output=StringIO())
+    except RuntimeError as e:
+        if 'died' not in str(e):
+            raise
+    else:
+        raise RuntimeError('The runner did not fail when its workers were killed')
+    finally:
+        signal.alarm(0)
+        signal.signal(signal.SIGALRM, handler)
+        local_runner.bls_stage = bls_stage
+
+
+def main():
+    print 'TEST_LOCAL_RUNNER: Requests are grouped by target ...'
+    groups = group_requests([['11138155', '3', 'llc'], ['1234567', '3', 'llc'],
+        ['011138155', '4', 'llc'], ['11138155', '3', 'slc']])
+    if groups != [[['011138155', '3', 'llc'], ['011138155', '4', 'llc']],
+    [['001234567', '3', 'llc']], [['011138155', '3', 'slc']]]:
+        raise RuntimeError('Wrong grouping: %s' % groups)
+
+    root = tempfile.mkdtemp()
+
+    try:
+        make_fits_tree(root, KEPLER_IDS)
+        make_fits_tree(root, KEPLER_IDS[:2], timestamp='2010078095331')
+        requests = ''.join(['%s 3 llc\n%s 4 llc\n' % (k, k) for k in KEPLER_IDS])
+
+        expected = __run([sys.executable, 'pipeline.py', 'disk', root] + BLS_ARGS,
+            requests)
+
+        for nworkers, schedule in [(1, 'cost'), (3, 'cost'), (3, 'input')]:
+            print 'TEST_LOCAL_RUNNER: %d worker(s), %s order ...' % (nworkers, schedule)
+            out = __run([sys.executable, 'local_runner.py', 'disk', root, '--workers',
+                str(nworkers), '--schedule', schedule] + BLS_ARGS, requests)
+
+            if len(out.splitlines()) != len(KEPLER_IDS):
+                raise RuntimeError('Expected %d targets, got %d' % (len(KEPLER_IDS),
+                    len(out.splitlines())))
+            if sorted(out.splitlines()) != sorted(expected.splitlines()):
+                raise RuntimeError('Runner output differs from pipeline output')
+
+        print 'TEST_LOCAL_RUNNER: Killed workers are reported ...'
+        __run_killed(root)
+    finally:
+        shutil.rmtree(root)
+
+    print 'Test complete; runner output matches the pipeline'
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        print e
+        sys.exit(1)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import shutil
+import tempfile
+from cStringIO import StringIO
+from fits_server import make_fits_tree
+from get_data import DiskDataLoader
+from manifest import build_manifest, get_manifest, Manifest, MANIFEST_FILE
+
+
+def __capture(func, *args, **kwargs):
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+
+    try:
+        func(*args, **kwargs)
+        return sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+
+
+def main():
+    root = tempfile.mkdtemp()
+
+    try:
+        kepler_ids = ['011138155', '001234567']
+        make_fits_tree(root, kepler_ids)
+        make_fits_tree(root, kepler_ids[:1], timestamp='2009350160919', cadence='slc')
+        # A quarter 17 file, which the '*' expansion of the quarter tables never reaches,
+        # and a file whose timestamp is in no table; its quarter comes from the header.
+        make_fits_tree(root, kepler_ids[:1], timestamp='2013131215648')
+        make_fits_tree(root, kepler_ids[:1], timestamp='2009999999999')
+
+        print 'TEST_MANIFEST: Building manifest ...'
+        manifest = build_manifest(root)
+
+        if manifest.quarters(kepler_ids[0], 'llc') != ['3', '17']:
+            raise RuntimeError('Wrong quarters: %s' % manifest.quarters(kepler_ids[0], 'llc'))
+        if manifest.quarters(kepler_ids[0], 'slc') != ['3'] or \
+        manifest.quarters(kepler_ids[1], 'slc') != []:
+            raise RuntimeError('Wrong short-cadence quarters')
+
+        names = [os.path.basename(p) for p in manifest.paths(kepler_ids[0], '03', 'llc')]
+        if names != ['kplr011138155-2009350155506_llc.fits',
+        'kplr011138155-2009999999999_llc.fits']:
+            raise RuntimeError('Wrong files for quarter 3: %s' % names)
+
+        print 'TEST_MANIFEST: Saving and loading ...'
+        get_manifest(root)
+        if not os.path.isfile(os.path.join(root, MANIFEST_FILE)):
+            raise RuntimeError('Manifest was not saved')
+        if Manifest.load(root, os.path.join(root, MANIFEST_FILE)).files != manifest.files:
+            raise RuntimeError('Manifest did not survive a round trip')
+
+        print 'TEST_MANIFEST: Disk loader resolves quarters through the manifest ...'
+        data = [[kepler_ids[0], '*', 'llc'], ['1234567', '3', 'llc'], [kepler_ids[1], '4',
+            'llc']]
+        out = __capture(DiskDataLoader, iter(data), root, manifest=manifest).splitlines()
+        keys = [tuple(l.split('\t')[:2]) for l in out]
+        if keys != [('011138155_llc', '03'), ('011138155_llc', '03'),
+        ('011138155_llc', '17'), ('001234567_llc', '03')]:
+            raise RuntimeError('Wrong disk loader output: %s' % keys)
+
+        out2 = __capture(DiskDataLoader, iter(data[1:]), root).splitlines()
+        if out2 != out[3:]:
+            raise RuntimeError('Manifest lookup differs from quarter table lookup')
+    finally:
+        shutil.rmtree(root)
+
+    print 'Test complete; manifest lookups are correct'
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        print e
+        sys.exit(1)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+from fits_server import make_fits_tree
+
+KEPLER_IDS = ['011138155', '001234567', '011446443']
+
+BLS_ARGS = ['--segment', '2', '--nbins', '200', '--mindur', '0.02', '--direction', '2']
+
+MRJOB = os.path.join(os.pardir, 'hadoop-mrjob', 'bls_pulse_mrjob.py')
+
+
+def __run(command, stdin):
+    with open(os.devnull, 'w') as devnull:
+        proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=devnull)
+        out = proc.communicate(stdin)[0]
+
+    if proc.returncode != 0:
+        raise RuntimeError('%s failed' % ' '.join(command))
+
+    return out
+
+
+def main():
+    root = tempfile.mkdtemp()
+
+    try:
+        make_fits_tree(root, KEPLER_IDS)
+        make_fits_tree(root, KEPLER_IDS[:2], timestamp='2010078095331')
+        requests = ''.join(['%s 3 llc\n%s 4 llc\n' % (k, k) for k in KEPLER_IDS])
+
+        expected = __run([sys.executable, 'pipeline.py', 'disk', root, '-p', '2', '-b',
+            '200', '-m', '0.02', '--mode', 'cython', '--direction', '2'], requests)
+
+        # With a map-side join, all requests of a KIC ID must be in the same split.
+        for runner, args, stdin in [('inline', [], requests), ('local', [], requests),
+        ('local', ['--map-join'], ''.join(['%s * llc\n' % k for k in KEPLER_IDS])),
+        ('local', ['--block-segments', '2'], requests),
+        ('local', ['--balance-reducers', '2'], requests)]:
+            print 'TEST_MRJOB: %s runner %s...' % (runner, ' '.join(args + ['']))
+            out = __run([sys.executable, MRJOB, '-r', runner, '--source', 'disk',
+                '--datapath', root] + BLS_ARGS + args, stdin)
+
+            if len(out.splitlines()) != len(KEPLER_IDS):
+                raise RuntimeError('Expected %d targets, got %d' % (len(KEPLER_IDS),
+                    len(out.splitlines())))
+            if sorted(out.splitlines()) != sorted(expected.splitlines()):
+                raise RuntimeError('Job output differs from pipeline output')
+    finally:
+        shutil.rmtree(root)
+
+    print 'Test complete; job output matches the pipeline'
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        print e
+        sys.exit(1)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+from fits_server import make_fits_tree
+
+# Requests with the quarters of one target split over non-adjacent lines, so that the
+# sort step matters.
+REQUESTS = '11138155 3 llc\n1234567 3 llc\n11138155 4 llc\n11138155 3 slc\n'
+
+BLS_ARGS = ['-p', '2', '-b', '200', '-m', '0.02', '--mode', 'cython']
+
+
+def __run(command, stdin):
+    with open(os.devnull, 'w') as devnull:
+        proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=devnull, env=dict(os.environ, LC_ALL='C'))
+        out = proc.communicate(stdin)[0]
+
+    if proc.returncode != 0:
+        raise RuntimeError('%s failed' % ' '.join(command))
+
+    return out
+
+
+def __shell_pipeline(datapath, args):
+    out = __run([sys.executable, 'get_data.py', 'disk', datapath], REQUESTS)
+    out = __run(['sort'], out)
+    out = __run([sys.executable, 'join_quarters.py'], out)
+    return __run([sys.executable, 'drive_bls_pulse.py'] + args, out)
+
+
+def main():
+    root = tempfile.mkdtemp()
+
+    try:
+        make_fits_tree(root, ['011138155', '001234567'])
+        make_fits_tree(root, ['011138155'], timestamp='2010078095331')
+        make_fits_tree(root, ['011138155'], timestamp='2009350160919', cadence='slc')
+
+        for direction, fmt in [('2', 'encoded'), ('-1', 'encoded'), ('2', 'normal')]:
+            print 'TEST_PIPELINE: Direction %s, %s output ...' % (direction, fmt)
+            args = BLS_ARGS + ['--direction', direction, '-f', fmt]
+            expected = __shell_pipeline(root, args)
+            out = __run([sys.executable, 'pipeline.py', 'disk', root] + args, REQUESTS)
+
+            if not expected:
+                raise RuntimeError('Shell pipeline produced no output')
+            if out != expected:
+                raise RuntimeError('Pipeline output differs from shell pipeline output')
+
+            out = __run([sys.executable, 'get_data.py', 'disk', root, '--join'], REQUESTS)
+            out = __run([sys.executable, 'drive_bls_pulse.py'] + args, out)
+            if out != expected:
+                raise RuntimeError('Map-side join output differs from shell pipeline output')
+    finally:
+        shutil.rmtree(root)
+
+    print 'Test complete; pipeline output matches the shell pipeline'
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        print e
+        sys.exit(1)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import subprocess
+import numpy as np
+from drive_bls_pulse import run_bls, format_output
+from plan import target_memory, output_bytes, plan_targets
+
+OPTIONS = dict(segment=2., mindur=0.02, maxdur=0.5, nbins=200, direction=2,
+    mode='cython', fmt='encoded', profile=False)
+
+BLS_ARGS = ['-p', '2', '-b', '2000', '--direction', '2', '--mode', 'cython',
+    '--no-calibrate']
+
+
+def __plan(args, stdin):
+    with open(os.devnull, 'w') as devnull:
+        proc = subprocess.Popen([sys.executable, 'plan.py'] + BLS_ARGS + args,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=devnull)
+        out = proc.communicate(stdin)[0]
+
+    return proc.returncode, out
+
+
+def main():
+    print 'TEST_PLAN: Output size matches the output ...'
+    np.random.seed(3)
+    time = np.arange(54950., 54980., 0.0204)
+    flux = 1. + 0.001 * np.random.randn(len(time))
+    fluxerr = np.ones_like(time) * 0.001
+
+    for direction in [2, 1]:
+        for fmt in ['encoded', 'normal']:
+            options = dict(OPTIONS, direction=direction, fmt=fmt)
+            out = run_bls(time.copy(), flux, fluxerr, options)
+            text = format_output('011138155_llc', "['03']", out, direction, fmt)
+            if output_bytes('011138155_llc', "['03']", len(out['segstart']),
+            options) != len(text) + 1:
+                raise RuntimeError('Wrong output size for direction %d, %s output' % (
+                    direction, fmt))
+
+    print 'TEST_PLAN: Memory grows with the result matrices ...'
+    small = target_memory(1e5, 100, OPTIONS)
+    if not small < target_memory(1e5, 100, dict(OPTIONS, nbins=400)) or \
+    not target_memory(1e5, 100, dict(OPTIONS, direction=1)) < small:
+        raise RuntimeError('Memory does not grow with the result matrices')
+    if not target_memory(1e5, 100, OPTIONS, block_segments=10) < small:
+        raise RuntimeError('Blocks do not bound the memory')
+
+    estimates = plan_targets([[['011138155', '3', 'llc']], [['011138155', '3', 'slc'],
+        ['011138155', '4', 'slc']]], OPTIONS)
+    if [e[0] for e in estimates] != ['011138155_llc', '011138155_slc'] or \
+    not estimates[0][1] < estimates[1][1] or not estimates[0][2] < estimates[1][2]:
+        raise RuntimeError('Wrong estimates: %s' % estimates)
+
+    print 'TEST_PLAN: Memory limit ...'
+    requests = '11138155 3 llc\n11138155 * slc\n'
+    code, out = __plan([], requests)
+    if code != 0 or 'CPU-hours' not in out:
+        raise RuntimeError('Planner failed')
+
+    code, out = __plan(['--memory-limit', '100'], requests)
+    if code == 0 or 'memory limit of 100 MB: 011138155_slc' not in out or \
+    '011138155_llc\n' in out:
+        raise RuntimeError('Target over the memory limit was not flagged')
+
+    print 'Test complete; plans match the search'
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        print e
+        sys.exit(1)
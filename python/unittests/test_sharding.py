@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import random
+from sharding import shard_requests, shard_of, estimate_cost
+
+NSHARDS = 8
+
+
+def __make_requests():
+    random.seed(3)
+    requests = []
+
+    for kepler_id in random.sample(xrange(1, 13000000), 2000):
+        kepler_id = str(kepler_id)
+        # Bright targets with short-cadence data cluster at the start of the list.
+        if len(requests) < 400:
+            requests.append([kepler_id, '*', 'slc'])
+        for quarter in random.sample(xrange(18), random.randint(1, 17)):
+            requests.append([kepler_id, str(quarter), 'llc'])
+
+    return requests
+
+
+def __targets(requests):
+    targets = {}
+    for request in requests:
+        targets.setdefault("%09d" % int(request[0]), []).append(request)
+    return targets.values()
+
+
+def main():
+    requests = __make_requests()
+    kepler_ids = set(["%09d" % int(r[0]) for r in requests])
+
+    for method in ['hash', 'cost']:
+        print 'TEST_SHARDING: Shards by %s partition the targets ...' % method
+        shards = [list(shard_requests(iter(requests), i, NSHARDS, method))
+            for i in xrange(NSHARDS)]
+
+        seen = {}
+        for i, shard in enumerate(shards):
+            for request in shard:
+                kepler_id = "%09d" % int(request[0])
+                if seen.setdefault(kepler_id, i) != i:
+                    raise RuntimeError('%s is in shards %d and %d' % (kepler_id,
+                        seen[kepler_id], i))
+
+        if set(seen) != kepler_ids or sum([len(s) for s in shards]) != len(requests):
+            raise RuntimeError('Shards do not cover the requests exactly once')
+
+        if shards != [list(shard_requests(iter(requests), i, NSHARDS, method))
+        for i in xrange(NSHARDS)]:
+            raise RuntimeError('Sharding is not deterministic')
+
+        costs = [sum([estimate_cost(target) for target in __targets(shard)])
+            for shard in shards]
+        imbalance = max(costs) / (sum(costs) / NSHARDS)
+        print 'TEST_SHARDING: Largest shard is %.3f times the mean cost' % imbalance
+
+        if method == 'cost' and imbalance > 1.01:
+            raise RuntimeError('Cost-based shards are not balanced')
+
+    print 'TEST_SHARDING: Hash shards do not depend on padding ...'
+    if shard_of('11138155', NSHARDS) != shard_of('011138155', NSHARDS):
+        raise RuntimeError('Padding changes the shard')
+
+    print 'Test complete; shards partition the targets'
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        print e
+        sys.exit(1)
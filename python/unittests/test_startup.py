@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import subprocess
+from startup import ENTRY_POINTS
+
+# Modules each entry point must not load at import time.
+DEFERRED = {'drive_bls_pulse':['cProfile', 'pstats', 'configparser', 'bls_pulse_cython'],
+    'get_data':['pyfits', 'urllib2', 'fetch', 'archive', 'fits_cache', 'kepler_fits',
+        'manifest', 'sharding', 'join_quarters'], 'join_quarters':['pyfits'],
+    'bls_client':['numpy', 'drive_bls_pulse']}
+
+
+def __loaded(module, names):
+    code = 'import sys, %s; print " ".join([n for n in %r if n in sys.modules])' % \
+        (module, names)
+    return subprocess.check_output([sys.executable, '-W', 'ignore', '-c', code]).split()
+
+
+def __report(args):
+    proc = subprocess.Popen([sys.executable, 'startup.py', '--repeat', '1'] + args,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out = proc.communicate()[0]
+    return proc.returncode, out
+
+
+def main():
+    print 'TEST_STARTUP: Deferred imports ...'
+    for module, names in sorted(DEFERRED.items()):
+        loaded = __loaded(module, names)
+        if loaded:
+            raise RuntimeError('Importing %s loads %s' % (module, ', '.join(loaded)))
+
+    print 'TEST_STARTUP: Report ...'
+    status, out = __report(['--budget', '1e6'])
+    if status != 0 or any([('\n%s ' % m) not in out for m in ENTRY_POINTS]):
+        raise RuntimeError('Report failed:\n%s' % out)
+
+    status, out = __report(['drive_bls_pulse', '--budget', '0'])
+    if status != 1 or 'Over budget: drive_bls_pulse' not in out:
+        raise RuntimeError('Report did not fail over budget:\n%s' % out)
+
+    print 'Test complete; entry points defer their heavy imports'
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        print e
+        sys.exit(1)
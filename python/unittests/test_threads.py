@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import subprocess
+import numpy as np
+from utils import encode_array
+from bls_pulse_cython import bls_pulse
+
+SEGMENT = 2.
+
+BLS_ARGS = ['-p', str(SEGMENT), '-b', '200', '-m', '0.02', '--mode', 'cython',
+    '--direction', '2']
+
+
+def __make_lightcurve():
+    '''
+    Returns a lightcurve of 40 segments with transits, missing fluxes, a gap of several
+    empty segments, and a partly empty segment.
+    '''
+    np.random.seed(7)
+    time = np.arange(54950.3, 55030., 0.0204)
+    time = time[((time < 54970.) | (time > 54981.)) & ((time < 54990.) | (time > 54991.9))]
+    flux = 1. + 0.0005 * np.random.randn(len(time))
+    flux[np.abs(np.mod(time - 54950., 3.1) - 1.) < 0.05] -= 0.005
+    flux[np.random.randint(0, len(time), 200)] = np.nan
+    fluxerr = np.ones_like(time) * 0.0005
+    return time, flux, fluxerr
+
+
+def __compare(expected, out):
+    for name in expected:
+        if expected[name].tostring() != out[name].tostring():
+            return name
+    return None
+
+
+def __drive(args, stdin):
+    with open(os.devnull, 'w') as devnull:
+        proc = subprocess.Popen([sys.executable, 'drive_bls_pulse.py'] + BLS_ARGS + args,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=devnull)
+        out = proc.communicate(stdin)[0]
+
+    if proc.returncode != 0:
+        raise RuntimeError('drive_bls_pulse.py %s failed' % ' '.join(args))
+
+    return out
+
+
+def main():
+    time, flux, fluxerr = __make_lightcurve()
+    args = (200, SEGMENT, 0.02, 0.5)
+
+    for direction in [2, 1, -1, 0]:
+        for detrend_order in [3, 0]:
+            expected = bls_pulse(time.copy(), flux, fluxerr, *args, direction=direction,
+                detrend_order=detrend_order)
+
+            for nthreads in [2, 3, 8]:
+                print 'TEST_THREADS: Direction %d, detrending order %d, %d threads ...' % \
+                    (direction, detrend_order, nthreads)
+                out = bls_pulse(time.copy(), flux, fluxerr, *args, direction=direction,
+                    detrend_order=detrend_order, nthreads=nthreads)
+                name = __compare(expected, out)
+                if name is not None:
+                    raise RuntimeError('%s differs from the serial search' % name)
+
+    print 'TEST_THREADS: Block of segments ...'
+    sel = (time >= 54960.3) & (time < 54976.3)
+    expected = bls_pulse(time[sel].copy(), flux[sel], fluxerr[sel], *args, direction=2,
+        epoch=54950.3, first_segment=5, segment_count=8)
+    out = bls_pulse(time[sel].copy(), flux[sel], fluxerr[sel], *args, direction=2,
+        epoch=54950.3, first_segment=5, segment_count=8, nthreads=4)
+    name = __compare(expected, out)
+    if name is not None:
+        raise RuntimeError('%s differs from the serial search of the block' % name)
+
+    print 'TEST_THREADS: Driver ...'
+    line = '\t'.join(['001234567_llc', str(['03']), encode_array(time), encode_array(flux),
+        encode_array(fluxerr)]) + '\n'
+    if __drive(['--search-threads', '4'], line) != __drive([], line):
+        raise RuntimeError('Driver output on 4 threads differs from one thread')
+
+    print 'Test complete; the threaded search is identical to the serial search'
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        print e
+        sys.exit(1)
@@ -9,13 +9,22 @@ import json
 import base64
 import zlib
 import numpy as np
+from collections import deque
 
+# Records written by :func:`encode_array` start with this character, which is not part of
+# the base64 alphabet; legacy JSON records (base64 of a zlib stream) never start with it.
+CODEC_MAGIC = '@'
+CODEC_VERSION = 1
+CODEC_SEPARATOR = ';'
 
-def read_mapper_output(f, separator='\t', uri=False):
+
+def read_mapper_output(f, separator='\t', uri=False, writable=False):
     '''
-    Reads data from the input file, assuming the given separator, in base64 format;
-    yields the decoded and split line. The format is KIC ID, quarter, [uri], time,
-    flux, error for each line.
+    Reads data from the input file, assuming the given separator, with arrays encoded by
+    :func:`encode_array`; yields the decoded and split line. The format is KIC ID,
+    quarter, [uri], time, flux, error for each line. The arrays are C-contiguous float64
+    NumPy arrays built directly over the decoded bytes; they are read-only unless
+    ``writable`` is set.
 
     :param f: File to read; usually stdin
     :type f: file
@@ -23,6 +32,8 @@ def read_mapper_output(f, separator='\t', uri=False):
     :type separator: str
     :param uri: Whether the URI is included on the line
     :type uri: bool
+    :param writable: Whether the yielded arrays must be writable
+    :type writable: bool
 
     :rtype: tuple
     '''
@@ -32,18 +43,19 @@ def read_mapper_output(f, separator='\t', uri=False):
         else:
             kic, q, t, f, e = line.rstrip().split(separator)
 
-        time = decode_array(t)
-        flux = decode_array(f)
-        fluxerr = decode_array(e)
+        time = __as_float64(decode_array(t, writable=writable))
+        flux = __as_float64(decode_array(f, writable=writable))
+        fluxerr = __as_float64(decode_array(e, writable=writable))
         yield kic, q, time, flux, fluxerr
 
 
 def read_pipeline_output(f, separator='\t'):
     '''
-    Reads data from the input file, assuming the given separator, in base64 format;
-    yields the decoded and split line. The format for each line is KIC ID, quarter,
-    segment_start, segment_end, srsq_dip, duration_dip, depth_dip, midtime_dip,
-    srsq_blip, duration_blip, depth_blip, midtime_blip.
+    Reads data from the input file, assuming the given separator, with arrays encoded by
+    :func:`encode_array`; yields the decoded and split line. The format for each line is
+    KIC ID, quarter, segment_start, segment_end, srsq_dip, duration_dip, depth_dip,
+    midtime_dip, srsq_blip, duration_blip, depth_blip, midtime_blip. The arrays are
+    read-only C-contiguous float64 NumPy arrays built directly over the decoded bytes.
 
     :param f: File to read; usually stdin
     :type f: file
@@ -55,55 +67,150 @@ def read_pipeline_output(f, separator='\t'):
     for line in f:
         kic, q, s1, s2, a1, a2, a3, a4, b1, b2, b3, b4 = line.rstrip().split(separator)
 
-        segstart = decode_array(s1)
-        segend = decode_array(s2)
-        srsq_dip = decode_array(a1)
-        duration_dip = decode_array(a2)
-        depth_dip = decode_array(a3)
-        midtime_dip = decode_array(a4)
-        srsq_blip = decode_array(b1)
-        duration_blip = decode_array(b2)
-        depth_blip = decode_array(b3)
-        midtime_blip = decode_array(b4)
+        segstart = __as_float64(decode_array(s1))
+        segend = __as_float64(decode_array(s2))
+        srsq_dip = __as_float64(decode_array(a1))
+        duration_dip = __as_float64(decode_array(a2))
+        depth_dip = __as_float64(decode_array(a3))
+        midtime_dip = __as_float64(decode_array(a4))
+        srsq_blip = __as_float64(decode_array(b1))
+        duration_blip = __as_float64(decode_array(b2))
+        depth_blip = __as_float64(decode_array(b3))
+        midtime_blip = __as_float64(decode_array(b4))
 
         yield kic, q, segstart, segend, srsq_dip, duration_dip, depth_dip, midtime_dip, \
             srsq_blip, duration_blip, depth_blip, midtime_blip
 
 
-def encode_array(arr):
+def encode_array(arr, compress=False):
     '''
-    base64-encodes the given numpy array.
+    Encodes the given numpy array as a single tab-safe string. The array is written
+    as raw little-endian bytes behind a short header that records the codec version,
+    dtype and shape, and is then base64-encoded. The layout is::
+
+        @<version>;<dtype>;<shape>;<compression>;<base64 payload>
+
+    where the shape is the dimensions joined with ``x`` and the compression flag is
+    ``z`` for zlib or ``r`` for raw bytes.
 
     :param arr: Array to encode
     :type arr: numpy.ndarray
+    :param compress: Whether to zlib-compress the payload before encoding
+    :type compress: bool
 
     :rtype: str
     '''
-    return base64.b64encode(zlib.compress(json.dumps(arr.tolist())))
+    arr = np.asarray(arr)
+
+    if arr.dtype.hasobject:
+        raise TypeError('Cannot encode arrays of dtype %s' % arr.dtype)
+
+    # Always store little-endian data so that records are portable between hosts.
+    dtype = arr.dtype.newbyteorder('<')
+    raw = np.ascontiguousarray(arr, dtype=dtype).tostring()
+
+    if compress:
+        raw = zlib.compress(raw, 1)
+
+    return CODEC_SEPARATOR.join([CODEC_MAGIC + str(CODEC_VERSION), dtype.str,
+        'x'.join([str(n) for n in arr.shape]), 'z' if compress else 'r',
+        base64.b64encode(raw)])
 
 
-def encode_list(lst):
+def encode_list(lst, compress=False):
     '''
-    base64-encodes the given Python list.
+    Encodes the given Python list; see :func:`encode_array`.
 
     :param lst: List to encode
     :type lst: list
+    :param compress: Whether to zlib-compress the payload before encoding
+    :type compress: bool
 
     :rtype: str
     '''
-    return base64.b64encode(zlib.compress(json.dumps(lst)))
+    return encode_array(np.asarray(lst), compress=compress)
 
 
-def decode_array(s):
+def decode_array(s, writable=False):
     '''
-    base64-decode the given string.
+    Decodes a string produced by :func:`encode_array`. Records written by the legacy
+    JSON codec (base64-encoded, zlib-compressed JSON lists) are detected automatically
+    and decoded as well.
+
+    The returned array is a view over the decoded bytes rather than a copy, so it is
+    read-only unless ``writable`` is set; in that case the bytes are copied once into a
+    mutable buffer first.
 
     :param s: String to decode
     :type s: str
+    :param writable: Whether the returned array must be writable
+    :type writable: bool
+
+    :rtype: numpy.ndarray
+    '''
+    if not s.startswith(CODEC_MAGIC):
+        return np.array(json.loads(zlib.decompress(base64.b64decode(s))))
+
+    version, dtype, shape, compression, payload = s.split(CODEC_SEPARATOR)
+
+    if int(version[len(CODEC_MAGIC):]) != CODEC_VERSION:
+        raise ValueError('Unsupported codec version: %s' % version)
+
+    raw = base64.b64decode(payload)
+
+    if compression == 'z':
+        raw = zlib.decompress(raw)
+    elif compression != 'r':
+        raise ValueError('Invalid compression flag: %s' % compression)
 
-    :rtype: list
+    if writable:
+        raw = bytearray(raw)
+
+    shape = tuple([int(n) for n in shape.split('x')]) if shape else ()
+    return np.frombuffer(raw, dtype=np.dtype(dtype)).reshape(shape)
+
+
+def __as_float64(arr):
+    '''
+    Returns the given array as a C-contiguous, native float64 array, copying only if the
+    array is not already in that form.
+
+    :param arr: Array to convert
+    :type arr: numpy.ndarray
+
+    :rtype: numpy.ndarray
     '''
-    return json.loads(zlib.decompress(base64.b64decode(s)))
+    return np.require(arr, dtype='float64', requirements='C')
+
+
+def ordered_map(pool, func, iterable, window):
+    '''
+    Applies ``func`` to every item of ``iterable`` on the given thread or process pool
+    and yields the results in input order. At most ``window`` items are in flight at any
+    time, so results that finish early wait in a bounded reorder buffer and the input is
+    consumed lazily.
+
+    :param pool: Pool to run the function on
+    :type pool: multiprocessing.pool.Pool
+    :param func: Function to apply; must be picklable for process pools
+    :type func: function
+    :param iterable: Items to process
+    :type iterable: iterable
+    :param window: Maximum number of items in flight
+    :type window: int
+
+    :rtype: generator
+    '''
+    pending = deque()
+
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+
+        if len(pending) >= window:
+            yield pending.popleft().get()
+
+    while pending:
+        yield pending.popleft().get()
 
 
 def extreme(a, b, direction):